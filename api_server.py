@@ -0,0 +1,449 @@
+"""
+ModelScope API 无界面HTTP服务
+以JSON接口提交文生图、图像编辑、文本对话和图生文任务，再查询状态、获取结果。
+不导入gradio。连接池、限流器、熔断器和调度器都是进程内对象，与另外启动的WebUI互不共享；
+磁盘上的结果缓存、上传缓存和任务日志可与WebUI共用。
+
+接口：
+    POST /v1/images/generations    提交文生图任务
+    POST /v1/images/edits          提交图像编辑任务（image为base64）
+    POST /v1/chat                  提交文本对话任务
+    POST /v1/vision                提交图生文任务（image为base64）
+    GET  /v1/jobs/{job_id}         查询任务状态
+    GET  /v1/jobs/{job_id}/result  获取任务结果（图像返回图片本身，文本返回JSON）
+    GET  /metrics                  Prometheus指标
+    GET  /healthz                  健康检查
+
+请求头 Authorization: Bearer <ModelScope API Token>，未提供时返回401；
+仅监听本机地址时可用 --allow-saved-token 改为使用本地保存的Token。
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import math
+import threading
+import time
+import uuid
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+from modules.common import load_config, load_api_token, install_config_reload_signal
+from modules.metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from modules.scheduler import QueueFullError, scheduled_slot
+from modules.task_journal import token_hash
+from modules.text_to_image import generate_image
+from modules.image_edit import edit_image
+from modules.text_chat import stream_chat
+from modules.image_to_text import stream_image_analysis
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+DEFAULT_JOB_TTL = 3600
+DEFAULT_MAX_JOBS = 1000
+
+# 允许回退到本地保存Token的监听地址
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+class ApiError(Exception):
+    """返回给客户端的请求错误"""
+
+    def __init__(self, status, message):
+        self.status = status
+        super().__init__(message)
+
+
+class Job:
+    """一个提交到本服务的任务"""
+
+    def __init__(self, kind, model, owner):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.model = model
+        self.owner = owner
+        self.status = QUEUED
+        self.message = None
+        self.error = None
+        self.image = None
+        self.output = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def finish(self, status, message=None, error=None):
+        self.status = status
+        self.message = message
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'model': self.model,
+            'status': self.status,
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobStore:
+    """内存中的任务表，完成的任务保留api_job_ttl秒"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, job, config):
+        ttl = float(config.get("api_job_ttl", DEFAULT_JOB_TTL))
+        max_jobs = int(config.get("api_max_jobs", DEFAULT_MAX_JOBS))
+        with self._lock:
+            now = time.time()
+            expired = [
+                job_id for job_id, existing in self._jobs.items()
+                if existing.finished_at is not None and now - existing.finished_at > ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            if len(self._jobs) >= max_jobs:
+                raise ApiError(503, "任务数已达上限，请稍后再试")
+            self._jobs[job.id] = job
+
+    def get(self, job_id, owner):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            raise ApiError(404, "任务不存在")
+        return job
+
+
+def _api_token(request, allow_saved_token=False):
+    """取出请求头中的Token；allow_saved_token为True时未提供则使用本地保存的Token"""
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):].strip()
+    elif allow_saved_token:
+        token = load_api_token()
+    else:
+        token = ""
+    if not token:
+        raise ApiError(401, "请在Authorization请求头中提供ModelScope API Token")
+    return token
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except Exception:
+        raise ApiError(400, "请求体必须是JSON对象")
+    if not isinstance(body, dict):
+        raise ApiError(400, "请求体必须是JSON对象")
+    return body
+
+
+def _int_field(body, name, default, minimum=None):
+    """读取整数字段（允许512.0这样的整数值浮点数），格式错误时返回400"""
+    value = body.get(name, default)
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name}字段必须是整数")
+    if minimum is not None and number < minimum:
+        raise ApiError(400, f"{name}字段不能小于{minimum}")
+    return int(number)
+
+
+def _float_field(body, name, default):
+    """读取数值字段，格式错误时返回400"""
+    value = body.get(name, default)
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not math.isfinite(number):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name}字段必须是数值")
+    return number
+
+
+def _bool_field(body, name, default):
+    """读取布尔字段，接受JSON布尔值和"true"/"false"字符串"""
+    value = body.get(name, default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ApiError(400, f"{name}字段必须是布尔值")
+
+
+def _decode_image(value):
+    """解码base64图片（可带data URL前缀），返回文件字节"""
+    if not value or not isinstance(value, str):
+        raise ApiError(400, "缺少image字段（base64编码的图片）")
+    if value.startswith('data:'):
+        value = value.split(',', 1)[-1]
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ApiError(400, "image字段不是有效的base64")
+
+
+def _image_bytes(image):
+    """取出结果图片的文件字节，未加载的图片直接读取底层文件，避免重新编码"""
+    fp = getattr(image, 'fp', None)
+    if fp is not None and image.format:
+        fp.seek(0)
+        return fp.read(), Image.MIME.get(image.format, 'application/octet-stream')
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue(), 'image/png'
+
+
+async def _run_image_job(job, run):
+    """在图像任务池中执行生成函数，run返回 (图像, 状态信息)"""
+    pool = 'image_edit' if job.kind == 'image_edit' else 'image_generation'
+    async with scheduled_slot(pool, job.owner, model=job.model):
+        job.status = RUNNING
+        result_image, message = await run()
+    if result_image is None:
+        job.finish(FAILED, error=message)
+        return
+    job.image = await asyncio.to_thread(_image_bytes, result_image)
+    job.finish(SUCCEEDED, message=message)
+
+
+def _last_result(results):
+    """消费流式核心函数，返回最后一次产出的 (ok, 内容, 统计)"""
+    result = (False, "未返回任何结果", "")
+    for result in results:
+        pass
+    return result
+
+
+async def _run_chat_job(job, api_token, message, history, system_prompt, max_tokens, temperature):
+    async with scheduled_slot('chat', job.owner, model=job.model):
+        job.status = RUNNING
+        ok, content, stats = await asyncio.to_thread(_last_result, stream_chat(
+            message, history, api_token, job.model, system_prompt, max_tokens, temperature
+        ))
+    if not ok:
+        job.finish(FAILED, error=content)
+        return
+    reasoning, answer = content
+    job.output = {
+        'content': answer,
+        'reasoning': reasoning or None,
+        'timing': stats,
+        'history': history + [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': answer}],
+    }
+    job.finish(SUCCEEDED, message=stats)
+
+
+async def _run_vision_job(job, api_token, image, prompt, max_tokens, temperature):
+    async with scheduled_slot('vision', job.owner, model=job.model):
+        job.status = RUNNING
+        ok, content, stats = await asyncio.to_thread(_last_result, stream_image_analysis(
+            image, prompt, api_token, job.model, max_tokens, temperature
+        ))
+    if not ok:
+        job.finish(FAILED, error=content)
+        return
+    job.output = {'content': content, 'stats': stats}
+    job.finish(SUCCEEDED, message=stats)
+
+
+class ApiServer:
+    """HTTP接口及其任务表"""
+
+    def __init__(self, allow_saved_token=False):
+        self.jobs = JobStore()
+        self.allow_saved_token = allow_saved_token
+        self._tasks = set()
+
+    def _token(self, request):
+        return _api_token(request, self.allow_saved_token)
+
+    def _start(self, job, coroutine):
+        """在后台执行任务，异常记录到任务状态中"""
+        async def runner():
+            try:
+                await coroutine
+            except QueueFullError as e:
+                job.finish(FAILED, error=str(e))
+            except Exception as e:
+                job.finish(FAILED, error=f"处理过程中发生错误: {str(e)}")
+
+        task = asyncio.ensure_future(runner())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _submit(self, kind, model, api_token, make_coroutine):
+        config = load_config()
+        job = Job(kind, model, token_hash(api_token))
+        self.jobs.add(job, config)
+        self._start(job, make_coroutine(job, config))
+        return web.json_response(job.to_dict(), status=202)
+
+    async def submit_generation(self, request):
+        api_token = self._token(request)
+        body = await _json_body(request)
+        config = load_config()
+        model = body.get('model', config.get("default_model", "Qwen/Qwen-Image"))
+        # 在返回202之前校验参数，格式错误直接返回400
+        args = (
+            api_token,
+            model,
+            body.get('prompt', config.get("default_prompt", "A beautiful landscape")),
+            body.get('negative_prompt', config.get("default_negative_prompt", "")),
+            _int_field(body, 'width', config.get("default_width", 512), minimum=1),
+            _int_field(body, 'height', config.get("default_height", 512), minimum=1),
+            _int_field(body, 'steps', config.get("default_steps", 30), minimum=1),
+            _float_field(body, 'guidance', config.get("default_guidance", 7.5)),
+            _int_field(body, 'seed', config.get("default_seed", -1), minimum=-1),
+            _bool_field(body, 'include_metadata', True)
+        )
+
+        def run(job, config):
+            return _run_image_job(job, lambda: generate_image(*args))
+
+        return self._submit('text_to_image', model, api_token, run)
+
+    async def submit_edit(self, request):
+        api_token = self._token(request)
+        body = await _json_body(request)
+        image_data = _decode_image(body.get('image'))
+        config = load_config()
+        default_models = config.get("image_edit_models") or ["Qwen/Qwen-Image-Edit"]
+        model = body.get('model', default_models[0])
+        args = (
+            api_token,
+            model,
+            image_data,
+            body.get('prompt', "修改图片中的内容"),
+            body.get('negative_prompt', config.get("default_negative_prompt", "")),
+            _bool_field(body, 'adaptive_ratio', True),
+            _int_field(body, 'width', config.get("default_width", 512), minimum=1),
+            _int_field(body, 'height', config.get("default_height", 512), minimum=1),
+            _int_field(body, 'long_edge', 1024, minimum=1),
+            _int_field(body, 'steps', config.get("default_steps", 30), minimum=1),
+            _float_field(body, 'guidance', config.get("default_guidance", 7.5)),
+            _int_field(body, 'seed', config.get("default_seed", -1), minimum=-1),
+            _bool_field(body, 'include_metadata', True)
+        )
+
+        def run(job, config):
+            return _run_image_job(job, lambda: edit_image(*args))
+
+        return self._submit('image_edit', model, api_token, run)
+
+    async def submit_chat(self, request):
+        api_token = self._token(request)
+        body = await _json_body(request)
+        message = body.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise ApiError(400, "缺少message字段")
+        config = load_config()
+        model = body.get('model', config.get("default_text_model", "Qwen/Qwen3-Coder-480B-A35B-Instruct"))
+        history = body.get('history') or []
+        if not isinstance(history, list):
+            raise ApiError(400, "history字段必须是消息列表")
+        args = (
+            message,
+            history,
+            body.get('system_prompt', config.get("default_system_prompt", "You are a helpful assistant.")),
+            _int_field(body, 'max_tokens', 2000, minimum=1),
+            _float_field(body, 'temperature', 0.7)
+        )
+        return self._submit('chat', model, api_token, lambda job, config: _run_chat_job(job, api_token, *args))
+
+    async def submit_vision(self, request):
+        api_token = self._token(request)
+        body = await _json_body(request)
+        image_data = _decode_image(body.get('image'))
+        try:
+            image = Image.open(BytesIO(image_data))
+        except Exception:
+            raise ApiError(400, "无法识别image中的图片")
+        config = load_config()
+        default_models = config.get("vision_models") or ["stepfun-ai/step3"]
+        model = body.get('model', default_models[0])
+        args = (
+            body.get('prompt', "请详细描述这幅图像的内容"),
+            _int_field(body, 'max_tokens', 1000, minimum=1),
+            _float_field(body, 'temperature', 0.7)
+        )
+        return self._submit('vision', model, api_token, lambda job, config: _run_vision_job(job, api_token, image, *args))
+
+    async def job_status(self, request):
+        job = self.jobs.get(request.match_info['job_id'], token_hash(self._token(request)))
+        return web.json_response(job.to_dict())
+
+    async def job_result(self, request):
+        job = self.jobs.get(request.match_info['job_id'], token_hash(self._token(request)))
+        if job.status in (QUEUED, RUNNING):
+            raise ApiError(409, "任务尚未完成")
+        if job.status == FAILED:
+            raise ApiError(422, job.error or "任务失败")
+        if job.image is not None:
+            data, content_type = job.image
+            return web.Response(body=data, content_type=content_type)
+        return web.json_response(dict(job.to_dict(), output=job.output))
+
+    async def metrics(self, request):
+        return web.Response(body=render_metrics().encode('utf-8'), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+    async def healthz(self, request):
+        return web.json_response({'status': 'ok'})
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """把ApiError转换为JSON错误响应"""
+    try:
+        return await handler(request)
+    except ApiError as e:
+        return web.json_response({'error': str(e)}, status=e.status)
+
+
+def create_app(allow_saved_token=False):
+    """创建aiohttp应用；allow_saved_token只应在仅监听本机地址时开启"""
+    server = ApiServer(allow_saved_token)
+    app = web.Application(middlewares=[error_middleware], client_max_size=64 * 1024 * 1024)
+    app.add_routes([
+        web.post('/v1/images/generations', server.submit_generation),
+        web.post('/v1/images/edits', server.submit_edit),
+        web.post('/v1/chat', server.submit_chat),
+        web.post('/v1/vision', server.submit_vision),
+        web.get('/v1/jobs/{job_id}', server.job_status),
+        web.get('/v1/jobs/{job_id}/result', server.job_result),
+        web.get('/metrics', server.metrics),
+        web.get('/healthz', server.healthz),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ModelScope API 无界面HTTP服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7861)
+    parser.add_argument('--allow-saved-token', action='store_true',
+                        help="请求未携带Token时使用本地保存的Token（仅限监听本机地址）")
+    args = parser.parse_args()
+    if args.allow_saved_token and args.host not in LOOPBACK_HOSTS:
+        parser.error("--allow-saved-token 只能在 --host 为本机地址（如127.0.0.1）时使用")
+
+    install_config_reload_signal()
+    web.run_app(create_app(args.allow_saved_token), host=args.host, port=args.port)
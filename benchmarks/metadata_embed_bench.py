@@ -0,0 +1,100 @@
+"""
+元数据写入微基准
+对比旧的“两次PNG编码 + 重新解码”方式与直接插入eXIf数据块的方式，
+测试对象为2048×2048的PNG结果图
+
+运行: python benchmarks/metadata_embed_bench.py [--size 2048] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.generation import build_result_image  # noqa: E402
+
+METADATA = {
+    'model': 'Qwen/Qwen-Image',
+    'prompt': 'A beautiful landscape',
+    'negative_prompt': '',
+    'width': 2048,
+    'height': 2048,
+    'steps': 30,
+    'guidance': 7.5,
+    'seed': 42,
+    'task_id': 'benchmark'
+}
+
+
+def make_result_png(size):
+    """生成一张带渐变和噪声的PNG，压缩特性接近真实生成结果"""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, size, dtype=np.float32)
+    pixels = np.empty((size, size, 3), dtype=np.float32)
+    pixels[..., 0] = gradient[None, :]
+    pixels[..., 1] = gradient[:, None]
+    pixels[..., 2] = 128
+    pixels += rng.normal(0, 12, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def legacy_embed(data, metadata):
+    """旧实现：解码后两次PNG编码，再重新打开"""
+    result_image = Image.open(BytesIO(data))
+    metadata_json = json.dumps(metadata, ensure_ascii=False)
+
+    img_buffer = BytesIO()
+    result_image.save(img_buffer, format='PNG', exif=result_image.getexif())
+
+    exif_dict = result_image.getexif()
+    exif_dict[0x927C] = metadata_json.encode('utf-8')
+
+    img_buffer_with_exif = BytesIO()
+    result_image.save(img_buffer_with_exif, format='PNG', exif=exif_dict)
+    img_buffer_with_exif.seek(0)
+    return Image.open(img_buffer_with_exif)
+
+
+def single_pass_embed(data, metadata):
+    """新实现：直接插入eXIf数据块"""
+    return build_result_image(BytesIO(data), metadata, {})
+
+
+def measure(func, data, repeat):
+    """返回每次调用（含最终解码）耗时的中位数和最小值（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = func(data, METADATA)
+        image.load()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="元数据写入微基准")
+    parser.add_argument('--size', type=int, default=2048, help="测试图边长（像素）")
+    parser.add_argument('--repeat', type=int, default=5, help="每种方式重复次数")
+    args = parser.parse_args()
+
+    data = make_result_png(args.size)
+    print(f"测试图: {args.size}×{args.size} PNG, {len(data) / 1024 / 1024:.1f} MB")
+
+    for name, func in (("两次编码（旧）", legacy_embed), ("插入eXIf块（新）", single_pass_embed)):
+        median, best = measure(func, data, args.repeat)
+        print(f"{name:<16} 中位数 {median:8.1f} ms   最小 {best:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+冷启动基准
+每次都在全新的Python进程中测量：
+  1. 导入耗时：import gradio_app（或api_server）所需时间，以及导入后已加载的重量级依赖
+  2. 首页耗时：从启动进程到首个页面（或 /healthz）返回200的时间
+
+运行: python benchmarks/startup_bench.py [--target gradio|api] [--repeat 5] [--skip-serve]
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 应在首次使用对应功能时才导入的依赖
+HEAVY_MODULES = ('openai', 'cryptography', 'numpy', 'requests', 'httpx')
+
+TARGETS = {
+    'gradio': {'module': 'gradio_app', 'path': '/'},
+    'api': {'module': 'api_server', 'path': '/healthz'},
+}
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+SERVE_SCRIPTS = {
+    'gradio': """
+import sys
+import uvicorn
+from gradio_app import create_gradio_interface, create_app
+uvicorn.run(create_app(create_gradio_interface()), host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')
+""",
+    'api': """
+import sys
+from aiohttp import web
+from api_server import create_app
+web.run_app(create_app(), host='127.0.0.1', port=int(sys.argv[1]), print=None)
+""",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(target):
+    """返回 (导入耗时秒, 已加载的重量级依赖)"""
+    script = IMPORT_SCRIPT.format(module=TARGETS[target]['module'], heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['loaded']
+
+
+def measure_first_page(target, timeout):
+    """返回从启动进程到首个请求返回200的耗时（秒）"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{TARGETS[target]['path']}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVE_SCRIPTS[target], str(port)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"服务进程提前退出:\n{process.stderr.read()}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"{timeout:.0f}秒内未能访问 {url}")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2], timings[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动基准")
+    parser.add_argument('--target', choices=sorted(TARGETS), default='gradio', help="测试的入口")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数")
+    parser.add_argument('--timeout', type=float, default=120, help="等待首页的最长时间（秒）")
+    parser.add_argument('--skip-serve', action='store_true', help="只测导入耗时")
+    args = parser.parse_args()
+
+    import_timings = []
+    loaded = []
+    for _ in range(args.repeat):
+        seconds, loaded = measure_import(args.target)
+        import_timings.append(seconds)
+    median, best = summarize(import_timings)
+    print(f"导入 {TARGETS[args.target]['module']:<12} 中位数 {median * 1000:8.1f} ms   最小 {best * 1000:8.1f} ms")
+    print(f"导入后已加载的重量级依赖: {', '.join(loaded) or '无'}")
+
+    if args.skip_serve:
+        return
+
+    serve_timings = [measure_first_page(args.target, args.timeout) for _ in range(args.repeat)]
+    median, best = summarize(serve_timings)
+    print(f"首个页面{'':<8} 中位数 {median * 1000:8.1f} ms   最小 {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
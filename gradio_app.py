@@ -11,15 +11,19 @@ from PIL import Image
 from PIL.ExifTags import TAGS
 from modules.common import (
     load_config, 
+    install_config_reload_signal, 
     load_api_token, 
     handle_token_save, 
     update_image_info
 )
-from modules.text_to_image import generate_image
+from modules.text_to_image import generate_image, generate_image_batch
 from modules.image_edit import edit_image
 from modules.text_chat import chat_with_model, clear_chat
 from modules.image_to_text import analyze_image_with_text
+from modules.task_recovery import list_pending_tasks, recover_task, PENDING_TASK_HEADERS
 from modules.photopea import create_photopea_collapsible_component
+from modules.scheduler import scheduled_handler, DEFAULT_QUEUE_MAX_SIZE
+from modules.metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from modules.whiteboard import create_whiteboard_tab, switch_whiteboard_tool
 
 def save_text_to_image_params(model, prompt, negative_prompt, width, height, steps, guidance, seed, include_metadata):
@@ -225,21 +229,40 @@ def load_image_edit_params(file):
         print(f"加载参数失败: {e}")
         return [gr.update()] * 10
 
-def create_text_to_image_tab(config, saved_token):
+def load_saved_token():
+    """页面加载时读取本地保存的Token，返回 (Token, 是否勾选保存)"""
+    try:
+        token = load_api_token()
+    except Exception as e:
+        print(f"⚠️ 读取保存的API Token失败: {e}")
+        token = ""
+    return token, bool(token)
+
+def create_api_token_row():
+    """创建所有标签页共用的API Token输入框，已保存的Token在页面加载时填入"""
+    with gr.Row():
+        api_token = gr.Textbox(
+            label="API Token",
+            placeholder="请输入您的ModelScope API Token",
+            type="password",
+            scale=4
+        )
+        save_token = gr.Checkbox(
+            label="保存API Token到本地加密文件",
+            value=False,
+            scale=1
+        )
+    
+    return {
+        'api_token': api_token,
+        'save_token': save_token
+    }
+
+def create_text_to_image_tab(config):
     """创建文生图标签页"""
     with gr.Tab("文生图"):
         with gr.Row():
             with gr.Column(scale=1):
-                api_token_gen = gr.Textbox(
-                    label="API Token",
-                    placeholder="请输入您的ModelScope API Token",
-                    type="password",
-                    value=saved_token
-                )
-                save_token_gen = gr.Checkbox(
-                    label="保存API Token到本地加密文件",
-                    value=bool(saved_token)
-                )
                 model_gen = gr.Dropdown(
                     label="模型",
                     choices=config.get("image_models", ["Qwen/Qwen-Image"]),
@@ -266,10 +289,20 @@ def create_text_to_image_tab(config, saved_token):
                     steps_gen = gr.Slider(label="步数", minimum=1, maximum=100, value=config.get("default_steps", 30), step=1)
                     guidance_gen = gr.Slider(label="引导系数", minimum=1.0, maximum=20.0, value=config.get("default_guidance", 7.5), step=0.1)
                     seed_gen = gr.Number(label="随机种子", value=config.get("default_seed", -1))
+                
+                batch_count_gen = gr.Slider(
+                    label="批量数量",
+                    minimum=1,
+                    maximum=16,
+                    value=4,
+                    step=1,
+                    info="批量生成时并发提交的任务数，种子依次递增"
+                )
             
             with gr.Column(scale=1):
                 output_image_gen = gr.Image(label="生成结果", type="pil")
                 output_message_gen = gr.Textbox(label="输出信息", interactive=False)
+                output_gallery_gen = gr.Gallery(label="批量结果", columns=4, height="auto")
                 
                 # 参数管理控件 - 移动到右侧栏
                 with gr.Group():
@@ -291,15 +324,15 @@ def create_text_to_image_tab(config, saved_token):
                         type="filepath"
                     )
                 
-                gen_btn = gr.Button("生成图像", variant="primary")
+                with gr.Row():
+                    gen_btn = gr.Button("生成图像", variant="primary")
+                    batch_btn_gen = gr.Button("批量生成", variant="primary")
                 
                 # 隐藏的JSON输出和文件下载组件
                 json_output_gen = gr.Textbox(label="参数JSON", visible=False)
                 file_download_gen = gr.File(label="下载参数文件", visible=True, type="filepath")
         
         return {
-            'api_token': api_token_gen,
-            'save_token': save_token_gen,
             'model': model_gen,
             'prompt': prompt_gen,
             'negative_prompt': negative_prompt_gen,
@@ -314,32 +347,26 @@ def create_text_to_image_tab(config, saved_token):
             'file_upload': file_upload_gen,
             'json_output': json_output_gen,
             'file_download': file_download_gen,
+            'batch_count': batch_count_gen,
             'output_image': output_image_gen,
             'output_message': output_message_gen,
-            'button': gen_btn
+            'output_gallery': output_gallery_gen,
+            'button': gen_btn,
+            'batch_button': batch_btn_gen
         }
 
-def create_image_edit_tab(config, saved_token):
+def create_image_edit_tab(config):
     """创建图像编辑标签页"""
     with gr.Tab("图像编辑"):
         with gr.Row():
             with gr.Column(scale=1):
-                api_token_edit = gr.Textbox(
-                    label="API Token",
-                    placeholder="请输入您的ModelScope API Token",
-                    type="password",
-                    value=saved_token
-                )
-                save_token_edit = gr.Checkbox(
-                    label="保存API Token到本地加密文件",
-                    value=bool(saved_token)
-                )
                 model_edit = gr.Dropdown(
                     label="模型",
                     choices=config.get("image_edit_models", ["Qwen/Qwen-Image-Edit"]),
                     value=config.get("image_edit_models", ["Qwen/Qwen-Image-Edit"])[0] if config.get("image_edit_models") else "Qwen/Qwen-Image-Edit"
                 )
-                input_image_edit = gr.Image(label="输入图像", type="pil")
+                # 使用文件路径，未经转换的原图可直接上传
+                input_image_edit = gr.Image(label="输入图像", type="filepath")
                 input_image_info_edit = gr.Textbox(label="输入图像信息", interactive=False, visible=False)
                 prompt_edit = gr.Textbox(
                     label="提示词",
@@ -404,8 +431,6 @@ def create_image_edit_tab(config, saved_token):
                 file_download_edit = gr.File(label="下载参数文件", visible=True, type="filepath")
         
         return {
-            'api_token': api_token_edit,
-            'save_token': save_token_edit,
             'model': model_edit,
             'input_image': input_image_edit,
             'input_image_info': input_image_info_edit,
@@ -431,21 +456,11 @@ def create_image_edit_tab(config, saved_token):
             'button': edit_btn
         }
 
-def create_text_chat_tab(config, saved_token):
+def create_text_chat_tab(config):
     """创建文本对话标签页"""
     with gr.Tab("文本对话"):
         with gr.Row():
             with gr.Column(scale=1):
-                api_token_chat = gr.Textbox(
-                    label="API Token",
-                    placeholder="请输入您的ModelScope API Token",
-                    type="password",
-                    value=saved_token
-                )
-                save_token_chat = gr.Checkbox(
-                    label="保存API Token到本地加密文件",
-                    value=bool(saved_token)
-                )
                 model_chat = gr.Dropdown(
                     label="模型",
                     choices=config.get("text_models", ["Qwen/Qwen3-Coder-480B-A35B-Instruct"]),
@@ -470,8 +485,6 @@ def create_text_chat_tab(config, saved_token):
                     clear_btn = gr.Button("清空对话")
         
         return {
-            'api_token': api_token_chat,
-            'save_token': save_token_chat,
             'model': model_chat,
             'system_prompt': system_prompt_chat,
             'max_tokens': max_tokens_chat,
@@ -482,21 +495,11 @@ def create_text_chat_tab(config, saved_token):
             'clear_btn': clear_btn
         }
 
-def create_image_to_text_tab(config, saved_token):
+def create_image_to_text_tab(config):
     """创建图生文标签页"""
     with gr.Tab("图生文"):
         with gr.Row():
             with gr.Column(scale=1):
-                api_token_vision = gr.Textbox(
-                    label="API Token",
-                    placeholder="请输入您的ModelScope API Token",
-                    type="password",
-                    value=saved_token
-                )
-                save_token_vision = gr.Checkbox(
-                    label="保存API Token到本地加密文件",
-                    value=bool(saved_token)
-                )
                 model_vision = gr.Dropdown(
                     label="模型",
                     choices=config.get("vision_models", ["stepfun-ai/step3"]),
@@ -520,8 +523,6 @@ def create_image_to_text_tab(config, saved_token):
                 analyze_btn = gr.Button("分析图像", variant="primary")
         
         return {
-            'api_token': api_token_vision,
-            'save_token': save_token_vision,
             'model': model_vision,
             'input_image': input_image_vision,
             'input_image_info': input_image_info_vision,
@@ -532,21 +533,62 @@ def create_image_to_text_tab(config, saved_token):
             'button': analyze_btn
         }
 
+def create_task_recovery_tab(config):
+    """创建任务恢复标签页"""
+    with gr.Tab("任务恢复"):
+        gr.Markdown("轮询超时或程序重启后，已提交的任务仍会在服务端完成，可以在这里取回结果而无需重新提交。")
+        with gr.Row():
+            with gr.Column(scale=1):
+                refresh_btn = gr.Button("刷新未取回的任务")
+                pending_tasks = gr.Dataframe(
+                    headers=PENDING_TASK_HEADERS,
+                    label="未取回结果的任务",
+                    interactive=False,
+                    wrap=True
+                )
+                task_id_recovery = gr.Dropdown(
+                    label="任务ID",
+                    choices=[],
+                    allow_custom_value=True
+                )
+                recover_btn = gr.Button("取回结果", variant="primary")
+            
+            with gr.Column(scale=1):
+                output_image_recovery = gr.Image(label="任务结果", type="pil")
+                output_message_recovery = gr.Textbox(label="状态信息", interactive=False)
+        
+        return {
+            'refresh_button': refresh_btn,
+            'pending_tasks': pending_tasks,
+            'task_id': task_id_recovery,
+            'button': recover_btn,
+            'output_image': output_image_recovery,
+            'output_message': output_message_recovery
+        }
+
+def refresh_pending_tasks(api_token):
+    """刷新未取回结果的任务列表，并把任务ID填入下拉框"""
+    rows, task_ids, message = list_pending_tasks(api_token)
+    return rows, gr.update(choices=task_ids, value=task_ids[0] if task_ids else None), message
+
 def create_gradio_interface():
     """创建Gradio界面"""
     config = load_config()
-    saved_token = load_api_token()  # 加载保存的token
     
     with gr.Blocks(title="ModelScope API WebUI", theme=gr.themes.Soft()) as demo:
         gr.Markdown("# ModelScope API WebUI")
         gr.Markdown("使用魔搭ModelScope API进行图像生成和编辑")
         
+        # 所有标签页共用同一个API Token
+        token_components = create_api_token_row()
+        
         # 创建各个标签页
-        text_to_image_components = create_text_to_image_tab(config, saved_token)
-        image_edit_components = create_image_edit_tab(config, saved_token)
-        text_chat_components = create_text_chat_tab(config, saved_token)
-        image_to_text_components = create_image_to_text_tab(config, saved_token)
-        whiteboard_components = create_whiteboard_tab(config, saved_token)
+        text_to_image_components = create_text_to_image_tab(config)
+        image_edit_components = create_image_edit_tab(config)
+        text_chat_components = create_text_chat_tab(config)
+        image_to_text_components = create_image_to_text_tab(config)
+        whiteboard_components = create_whiteboard_tab(config)
+        task_recovery_components = create_task_recovery_tab(config)
         
         # 在底部添加可折叠的 Photopea 编辑器（在所有标签中都可见）
         create_photopea_collapsible_component()
@@ -562,13 +604,14 @@ def create_gradio_interface():
         with gr.Row():
             token_status = gr.Textbox(label="Token状态", interactive=False, visible=False)
         
-        # 绑定事件 - 文生图
-        text_to_image_components['save_token'].change(
+        # 绑定事件 - API Token
+        token_components['save_token'].change(
             fn=handle_token_save,
-            inputs=[text_to_image_components['api_token'], text_to_image_components['save_token']],
+            inputs=[token_components['api_token'], token_components['save_token']],
             outputs=[token_status]
         )
         
+        # 绑定事件 - 文生图
         # 绑定文生图保存和加载参数事件
         text_to_image_components['save_params_btn'].click(
             fn=save_text_to_image_params,
@@ -602,9 +645,9 @@ def create_gradio_interface():
         )
         
         text_to_image_components['button'].click(
-            fn=generate_image,
+            fn=scheduled_handler('image_generation', generate_image),
             inputs=[
-                text_to_image_components['api_token'],
+                token_components['api_token'],
                 text_to_image_components['model'],
                 text_to_image_components['prompt'],
                 text_to_image_components['negative_prompt'],
@@ -618,13 +661,25 @@ def create_gradio_interface():
             outputs=[text_to_image_components['output_image'], text_to_image_components['output_message']]
         )
         
-        # 绑定事件 - 图像编辑
-        image_edit_components['save_token'].change(
-            fn=handle_token_save,
-            inputs=[image_edit_components['api_token'], image_edit_components['save_token']],
-            outputs=[token_status]
+        text_to_image_components['batch_button'].click(
+            fn=scheduled_handler('image_generation', generate_image_batch, slot_per_item=True),
+            inputs=[
+                token_components['api_token'],
+                text_to_image_components['model'],
+                text_to_image_components['prompt'],
+                text_to_image_components['negative_prompt'],
+                text_to_image_components['width'],
+                text_to_image_components['height'],
+                text_to_image_components['steps'],
+                text_to_image_components['guidance'],
+                text_to_image_components['seed'],
+                text_to_image_components['include_metadata'],
+                text_to_image_components['batch_count']
+            ],
+            outputs=[text_to_image_components['output_gallery'], text_to_image_components['output_message']]
         )
         
+        # 绑定事件 - 图像编辑
         image_edit_components['adaptive_ratio'].change(
             fn=toggle_size_controls,
             inputs=[image_edit_components['adaptive_ratio']],
@@ -674,9 +729,9 @@ def create_gradio_interface():
         )
         
         image_edit_components['button'].click(
-            fn=edit_image,
+            fn=scheduled_handler('image_edit', edit_image),
             inputs=[
-                image_edit_components['api_token'],
+                token_components['api_token'],
                 image_edit_components['model'],
                 image_edit_components['input_image'],
                 image_edit_components['prompt'],
@@ -694,18 +749,13 @@ def create_gradio_interface():
         )
         
         # 绑定事件 - 文本对话
-        text_chat_components['save_token'].change(
-            fn=handle_token_save,
-            inputs=[text_chat_components['api_token'], text_chat_components['save_token']],
-            outputs=[token_status]
-        )
-        
+        chat_handler = scheduled_handler('chat', chat_with_model)
         text_chat_components['submit_btn'].click(
-            fn=chat_with_model,
+            fn=chat_handler,
             inputs=[
                 text_chat_components['msg'],
                 text_chat_components['chatbot'],
-                text_chat_components['api_token'],
+                token_components['api_token'],
                 text_chat_components['model'],
                 text_chat_components['system_prompt'],
                 text_chat_components['max_tokens'],
@@ -715,11 +765,11 @@ def create_gradio_interface():
         )
         
         text_chat_components['msg'].submit(
-            fn=chat_with_model,
+            fn=chat_handler,
             inputs=[
                 text_chat_components['msg'],
                 text_chat_components['chatbot'],
-                text_chat_components['api_token'],
+                token_components['api_token'],
                 text_chat_components['model'],
                 text_chat_components['system_prompt'],
                 text_chat_components['max_tokens'],
@@ -734,12 +784,6 @@ def create_gradio_interface():
         )
         
         # 绑定事件 - 图生文
-        image_to_text_components['save_token'].change(
-            fn=handle_token_save,
-            inputs=[image_to_text_components['api_token'], image_to_text_components['save_token']],
-            outputs=[token_status]
-        )
-        
         image_to_text_components['input_image'].change(
             fn=update_image_info,
             inputs=[image_to_text_components['input_image']],
@@ -747,11 +791,11 @@ def create_gradio_interface():
         )
         
         image_to_text_components['button'].click(
-            fn=analyze_image_with_text,
+            fn=scheduled_handler('vision', analyze_image_with_text),
             inputs=[
                 image_to_text_components['input_image'],
                 image_to_text_components['prompt'],
-                image_to_text_components['api_token'],
+                token_components['api_token'],
                 image_to_text_components['model'],
                 image_to_text_components['max_tokens'],
                 image_to_text_components['temperature']
@@ -766,6 +810,30 @@ def create_gradio_interface():
             outputs=[whiteboard_components['excalidraw_frame'], whiteboard_components['tldraw_frame']]
         )
         
+        # 绑定事件 - 任务恢复
+        task_recovery_components['refresh_button'].click(
+            fn=refresh_pending_tasks,
+            inputs=[token_components['api_token']],
+            outputs=[
+                task_recovery_components['pending_tasks'],
+                task_recovery_components['task_id'],
+                task_recovery_components['output_message']
+            ]
+        )
+        
+        task_recovery_components['button'].click(
+            fn=scheduled_handler('image_generation', recover_task, handler='task_recovery'),
+            inputs=[token_components['api_token'], task_recovery_components['task_id']],
+            outputs=[task_recovery_components['output_image'], task_recovery_components['output_message']]
+        )
+        
+        # 构建界面时不读取Token文件，每次打开页面时再填入已保存的Token
+        demo.load(
+            fn=load_saved_token,
+            outputs=[token_components['api_token'], token_components['save_token']],
+            queue=False
+        )
+        
         # 添加简单的JavaScript代码用于界面增强
         demo.load(js="""
         function() {
@@ -789,8 +857,30 @@ def create_gradio_interface():
         }
         """)
     
+    # 并发由各任务池的调度器控制，Gradio队列只限制总排队长度
+    demo.queue(
+        max_size=int(config.get("queue_max_size", DEFAULT_QUEUE_MAX_SIZE)),
+        default_concurrency_limit=None
+    )
+    
     return demo
 
+def create_app(demo):
+    """把Gradio界面挂载到FastAPI应用上，并提供Prometheus格式的 /metrics 接口"""
+    from fastapi import FastAPI
+    from fastapi.responses import Response
+    
+    app = FastAPI()
+    
+    @app.get("/metrics")
+    def metrics():
+        return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+    
+    return gr.mount_gradio_app(app, demo, path="/")
+
 if __name__ == "__main__":
+    import uvicorn
+    
+    install_config_reload_signal()
     demo = create_gradio_interface()
-    demo.launch(server_name="127.0.0.1", server_port=7860, share=False, inbrowser=False)
\ No newline at end of file
+    uvicorn.run(create_app(demo), host="127.0.0.1", port=7860)
\ No newline at end of file
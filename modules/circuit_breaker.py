@@ -0,0 +1,140 @@
+"""
+熔断模块
+按上游主机统计连续失败次数，上游不可用时直接失败，避免每个请求都耗尽重试、长时间占用工作线程
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RECOVERY_SECONDS = 30
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出"""
+
+    def __init__(self, name, retry_in):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"上游服务 {name} 暂时不可用（连续请求失败），请在 {max(1, int(retry_in + 0.5))} 秒后重试")
+
+
+class CircuitBreaker:
+    """熔断器
+
+    - 关闭：正常放行，连续失败达到阈值后打开
+    - 打开：直接抛出CircuitOpenError，经过恢复时间后进入半开
+    - 半开：只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, recovery_seconds=DEFAULT_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+
+    @property
+    def state(self):
+        return self._state
+
+    def before_call(self):
+        """发请求前调用，熔断时抛出CircuitOpenError"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+
+            now = time.monotonic()
+            if self._state == OPEN:
+                retry_in = self._opened_at + self.recovery_seconds - now
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self._state = HALF_OPEN
+                self._probe_started_at = None
+
+            # 半开状态只放行一个探测请求；探测长时间没有结果时允许再探测一次
+            if self._probe_started_at is not None and now - self._probe_started_at < self.recovery_seconds:
+                raise CircuitOpenError(self.name, self._probe_started_at + self.recovery_seconds - now)
+            self._probe_started_at = now
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"✅ 上游服务 {self.name} 已恢复")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_started_at = None
+
+    def release_probe(self):
+        """半开状态下的探测请求没有得到上游的结论（如请求未发出）时归还探测名额"""
+        with self._lock:
+            self._probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f"⚠️ 上游服务 {self.name} 连续失败 {self._failures} 次，熔断 {self.recovery_seconds:g} 秒")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+
+
+def is_upstream_failure(error):
+    """判断异常是否说明上游不可用（连接失败、超时或5xx）"""
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, OSError)) or \
+        type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url):
+    """获取URL所在主机的熔断器"""
+    from .common import load_config
+
+    config = load_config()
+    host = urlparse(url).netloc or url
+    threshold = int(config.get("circuit_failure_threshold", DEFAULT_FAILURE_THRESHOLD))
+    recovery = float(config.get("circuit_recovery_seconds", DEFAULT_RECOVERY_SECONDS))
+
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, threshold, recovery)
+            _breakers[host] = breaker
+        else:
+            # 配置热加载后更新阈值
+            breaker.failure_threshold = threshold
+            breaker.recovery_seconds = recovery
+        return breaker
+
+
+def record_upstream_error(url, error):
+    """请求抛出异常时调用
+
+    上游不可用类的错误计入熔断；上游返回了其他错误响应（如400、429）说明主机可达，按成功处理；
+    其余错误不改变状态，只归还半开状态的探测名额，避免其他请求被挡住整个恢复时间。
+    """
+    if isinstance(error, CircuitOpenError):
+        return
+    breaker = get_circuit_breaker(url)
+    if is_upstream_failure(error):
+        breaker.record_failure()
+    elif isinstance(getattr(error, 'status_code', None), int):
+        breaker.record_success()
+    else:
+        breaker.release_probe()
@@ -6,76 +6,96 @@
 import os
 import json
 import time
-import base64
-import hashlib
-import requests
-import numpy as np
+import signal
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from urllib.parse import urlparse
 from PIL import Image
+from .http_client import http_request, get_shared_httpx_client
+from .rate_limit import get_rate_limiter, pause_for_rate_limit, token_from_headers
+from .circuit_breaker import OPEN, CircuitOpenError, get_circuit_breaker
+from .metrics import RATE_LIMITED, RETRIES, TIMEOUTS
+from .credentials import get_credential_store
 
-try:
-    from cryptography.fernet import Fernet
-    CRYPTO_AVAILABLE = True
-except ImportError:
-    print("⚠️ 警告: 未安装cryptography库，将使用简单编码保存API Token")
-    print("建议运行: pip install cryptography")
-    CRYPTO_AVAILABLE = False
-    Fernet = None
-
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    print("⚠️ 警告: 未安装openai库，文本对话和图生文功能将不可用")
-    print("请运行: pip install openai")
-    OPENAI_AVAILABLE = False
-    OpenAI = None
-
-# API Token 加密保存和读取功能
+# openai导入较慢，首次用到对话或图生文时才导入；None表示尚未尝试
+_openai_class = None
+_openai_checked = False
+
+def _get_openai_class():
+    """首次调用时导入openai的OpenAI客户端类，未安装时返回None"""
+    global _openai_class, _openai_checked
+    if not _openai_checked:
+        try:
+            from openai import OpenAI
+            _openai_class = OpenAI
+        except ImportError:
+            print("⚠️ 警告: 未安装openai库，文本对话和图生文功能将不可用")
+            print("请运行: pip install openai")
+        _openai_checked = True
+    return _openai_class
+
+def is_openai_available():
+    """openai库是否可用（首次调用时才导入）"""
+    return _get_openai_class() is not None
+
+MODELSCOPE_BASE_URL = 'https://api-inference.modelscope.cn/v1'
+
+# OpenAI客户端注册表：(base_url, token) -> (客户端, 最后使用时间)，按LRU淘汰
+_openai_clients = OrderedDict()
+_openai_clients_lock = threading.Lock()
+
+def get_openai_client(api_token, base_url=MODELSCOPE_BASE_URL):
+    """获取复用的OpenAI客户端
+
+    所有客户端共享同一个httpx连接池，注册表只缓存轻量的客户端对象；
+    超过openai_client_pool_size个或闲置超过openai_client_idle_seconds秒的客户端会被淘汰。
+    客户端不自动重试，429由调用方按共享限流器的暂停窗口处理，避免绕过限流。
+    """
+    config = load_config()
+    max_clients = int(config.get("openai_client_pool_size", 32))
+    idle_seconds = float(config.get("openai_client_idle_seconds", 600))
+    key = (base_url, api_token)
+    now = time.monotonic()
+
+    with _openai_clients_lock:
+        # 淘汰闲置过久的客户端（注册表按最近使用排序，最旧的在前）
+        while _openai_clients:
+            oldest_key, (_, last_used) = next(iter(_openai_clients.items()))
+            if now - last_used <= idle_seconds:
+                break
+            del _openai_clients[oldest_key]
+
+        entry = _openai_clients.pop(key, None)
+        if entry is not None:
+            client = entry[0]
+        else:
+            client = _get_openai_class()(
+                base_url=base_url,
+                api_key=api_token,
+                http_client=get_shared_httpx_client(),
+                max_retries=0
+            )
+
+        _openai_clients[key] = (client, now)
+        while len(_openai_clients) > max_clients:
+            _openai_clients.popitem(last=False)
+
+        return client
+
+# API Token 加密保存和读取功能（由凭据存储缓存解密结果）
 def get_encryption_key():
     """生成或获取加密密钥"""
-    key_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.token_key')
-    
-    if os.path.exists(key_file):
-        with open(key_file, 'rb') as f:
-            return f.read()
-    else:
-        # 基于机器特征生成密钥
-        machine_id = hashlib.sha256(
-            (os.getcwd() + str(os.path.getsize(__file__))).encode()
-        ).digest()[:32]
-        
-        if CRYPTO_AVAILABLE:
-            key = Fernet.generate_key()
-        else:
-            # 简单的base64编码作为备选
-            key = base64.b64encode(machine_id)
-        
-        with open(key_file, 'wb') as f:
-            f.write(key)
-        
-        return key
+    return get_credential_store().get_key()
 
 def save_api_token(token):
-    """保存API Token到加密文件"""
+    """保存API Token到加密文件（与已保存的值相同时不写盘）"""
     if not token or not token.strip():
         return False
     
     try:
-        token_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.api_token')
-        key = get_encryption_key()
-        
-        if CRYPTO_AVAILABLE:
-            # 使用Fernet加密
-            fernet = Fernet(key)
-            encrypted_token = fernet.encrypt(token.encode())
-        else:
-            # 简单的base64编码
-            encrypted_token = base64.b64encode(token.encode())
-        
-        with open(token_file, 'wb') as f:
-            f.write(encrypted_token)
-        
-        print("✅ API Token已保存到本地加密文件")
+        if get_credential_store().save(token):
+            print("✅ API Token已保存到本地加密文件")
         return True
         
     except Exception as e:
@@ -83,27 +103,9 @@ def save_api_token(token):
         return False
 
 def load_api_token():
-    """从加密文件读取API Token"""
+    """读取API Token，文件未变化时直接返回内存中缓存的值"""
     try:
-        token_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.api_token')
-        
-        if not os.path.exists(token_file):
-            return ""
-        
-        key = get_encryption_key()
-        
-        with open(token_file, 'rb') as f:
-            encrypted_token = f.read()
-        
-        if CRYPTO_AVAILABLE:
-            # 使用Fernet解密
-            fernet = Fernet(key)
-            token = fernet.decrypt(encrypted_token).decode()
-        else:
-            # 简单的base64解码
-            token = base64.b64decode(encrypted_token).decode()
-        
-        return token
+        return get_credential_store().load()
         
     except Exception as e:
         print(f"⚠️ 读取API Token失败: {e}")
@@ -112,15 +114,8 @@ def load_api_token():
 def delete_api_token():
     """删除保存的API Token"""
     try:
-        token_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.api_token')
-        key_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.token_key')
-        
-        if os.path.exists(token_file):
-            os.remove(token_file)
-        if os.path.exists(key_file):
-            os.remove(key_file)
-        
-        print("✅ API Token已删除")
+        if get_credential_store().delete():
+            print("✅ API Token已删除")
         return True
         
     except Exception as e:
@@ -132,6 +127,14 @@ def get_image_info(image):
     if image is None:
         return "无图像"
     
+    if isinstance(image, (str, os.PathLike)):  # 文件路径，只读取文件头
+        try:
+            with Image.open(image) as img:
+                width, height = img.size
+            return f"尺寸: {width} × {height} 像素"
+        except Exception:
+            return "无法获取尺寸信息"
+    
     if hasattr(image, 'size'):  # PIL Image
         width, height = image.size
         return f"尺寸: {width} × {height} 像素"
@@ -144,40 +147,258 @@ def get_image_info(image):
     else:
         return "无法获取尺寸信息"
 
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'modelscope_config.json')
+
+# 配置文件缺失或无法解析时使用的默认值
+DEFAULT_CONFIG = {
+    "default_model": "Qwen/Qwen-Image",
+    "timeout": 720,
+    "image_download_timeout": 30,
+    "default_prompt": "A beautiful landscape"
+}
+
+# 已知配置项的类型约束，类型不符的项会被丢弃并回退到代码中的默认值
+CONFIG_SCHEMA = {
+    "default_model": str,
+    "timeout": (int, float),
+    "image_download_timeout": (int, float),
+    "upload_timeout": (int, float),
+    "http_pool_connections": int,
+    "http_pool_maxsize": int,
+    "poll_interval": (int, float),
+    "poll_min_interval": (int, float),
+    "poll_max_interval": (int, float),
+    "poll_request_timeout": (int, float),
+    "poll_max_workers": int,
+    "batch_max_concurrency": int,
+    "openai_client_pool_size": int,
+    "openai_client_idle_seconds": (int, float),
+    "upload_cache_ttl": (int, float),
+    "result_cache_enabled": bool,
+    "result_cache_max_entries": int,
+    "result_cache_max_bytes": int,
+    "result_download_max_bytes": int,
+    "result_spool_bytes": int,
+    "rate_limit_per_second": (int, float),
+    "rate_limit_burst": int,
+    "circuit_failure_threshold": int,
+    "circuit_recovery_seconds": (int, float),
+    "concurrency_image_generation": int,
+    "concurrency_image_edit": int,
+    "concurrency_chat": int,
+    "concurrency_vision": int,
+    "queue_max_size": int,
+    "task_journal_retention_days": (int, float),
+    "tracing_otlp_endpoint": str,
+    "api_job_ttl": (int, float),
+    "api_max_jobs": int,
+    "upload_max_edge": int,
+    "upload_max_edge_per_model": dict,
+    "upload_max_bytes": int,
+    "upload_format": str,
+    "vision_max_edge": int,
+    "vision_max_edge_per_model": dict,
+    "default_prompt": str,
+    "default_negative_prompt": str,
+    "default_width": int,
+    "default_height": int,
+    "default_seed": int,
+    "default_steps": int,
+    "default_guidance": (int, float),
+    "default_text_model": str,
+    "default_system_prompt": str,
+    "default_user_prompt": str,
+    "api_token": str,
+    "image_models": list,
+    "image_edit_models": list,
+    "text_models": list,
+    "vision_models": list
+}
+
+# 必须大于0的配置项（另外所有concurrency_*项也是），为0或负数时调度器会永远排队、限流器会空转
+POSITIVE_CONFIG_KEYS = frozenset({
+    "timeout",
+    "image_download_timeout",
+    "upload_timeout",
+    "http_pool_connections",
+    "http_pool_maxsize",
+    "poll_interval",
+    "poll_min_interval",
+    "poll_max_interval",
+    "poll_request_timeout",
+    "poll_max_workers",
+    "batch_max_concurrency",
+    "openai_client_pool_size",
+    "rate_limit_per_second",
+    "rate_limit_burst",
+    "circuit_failure_threshold",
+    "queue_max_size",
+    "api_max_jobs"
+})
+
+# 0表示不限制、不能为负数的配置项
+NON_NEGATIVE_CONFIG_KEYS = frozenset({"upload_max_edge", "upload_max_bytes", "vision_max_edge"})
+
+# 两次检查配置文件修改时间的最小间隔（秒）
+CONFIG_CHECK_INTERVAL = 1.0
+
+_config_lock = threading.Lock()
+_config_state = {"snapshot": None, "mtime": None, "checked_at": 0.0, "force_reload": False}
+
+def _freeze_config(value):
+    """转换为只读结构，防止调用方修改共享的配置快照"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze_config(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze_config(v) for v in value)
+    return value
+
+def validate_config(data):
+    """校验配置内容，返回 (合法配置, 警告列表)"""
+    if not isinstance(data, dict):
+        raise ValueError("配置文件顶层必须是JSON对象")
+
+    valid = {}
+    warnings = []
+    for key, value in data.items():
+        expected = CONFIG_SCHEMA.get(key)
+        # bool是int的子类，数值项不接受true/false
+        if expected is not None and (not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool)):
+            warnings.append(f"配置项 {key} 类型错误，已忽略")
+            continue
+        if (key in POSITIVE_CONFIG_KEYS or key.startswith("concurrency_")) and \
+                (not isinstance(value, (int, float)) or isinstance(value, bool) or not value > 0):
+            warnings.append(f"配置项 {key} 必须大于0，已忽略")
+            continue
+        if key in NON_NEGATIVE_CONFIG_KEYS and value < 0:
+            warnings.append(f"配置项 {key} 不能为负数，已忽略")
+            continue
+        # 未在CONFIG_SCHEMA中列出的同类配置项也按后缀校验，先确认容器类型
+        if key.endswith("_models") and (not isinstance(value, list) or not all(isinstance(v, str) for v in value)):
+            warnings.append(f"配置项 {key} 必须是字符串列表，已忽略")
+            continue
+        if key.endswith("_per_model") and (
+                not isinstance(value, dict) or
+                not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in value.values())):
+            warnings.append(f"配置项 {key} 的值必须是非负整数，已忽略")
+            continue
+        valid[key] = value
+    return valid, warnings
+
+def _read_config_file():
+    """读取并校验配置文件，返回只读快照"""
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    valid, warnings = validate_config(data)
+    for warning in warnings:
+        print(f"⚠️ {warning}")
+
+    return _freeze_config(valid)
+
+def reload_config():
+    """标记配置需要重新读取（供SIGHUP等外部触发使用）"""
+    # 可能在信号处理函数中调用，这里不加锁
+    _config_state["force_reload"] = True
+
+def install_config_reload_signal():
+    """注册SIGHUP信号处理，收到信号时热加载配置（仅主线程、非Windows可用）"""
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: reload_config())
+        except ValueError:
+            pass
+
 def load_config():
-    """加载配置文件"""
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'modelscope_config.json')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {
-            "default_model": "Qwen/Qwen-Image",
-            "timeout": 720,
-            "image_download_timeout": 30,
-            "default_prompt": "A beautiful landscape"
-        }
-
-def make_api_request_with_retry(url, headers, data=None, timeout=60, max_retries=3, base_delay=2, method='post'):
-    """带有重试机制的API请求函数"""
+    """获取当前配置快照
+
+    配置文件只在首次调用、修改时间变化或收到重新加载请求时解析，
+    返回的快照是只读的，所有请求共享同一份。
+    """
+    state = _config_state
+    now = time.monotonic()
+    if state["snapshot"] is not None and not state["force_reload"] and now - state["checked_at"] < CONFIG_CHECK_INTERVAL:
+        return state["snapshot"]
+
+    with _config_lock:
+        state["checked_at"] = now
+        try:
+            mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        if state["snapshot"] is not None and not state["force_reload"] and mtime == state["mtime"]:
+            return state["snapshot"]
+
+        state["force_reload"] = False
+        try:
+            snapshot = _read_config_file()
+            if state["snapshot"] is not None:
+                print("🔄 配置文件已重新加载")
+        except Exception as e:
+            if state["snapshot"] is not None:
+                # 保留上一次成功加载的配置
+                print(f"⚠️ 配置文件重新加载失败，继续使用旧配置: {e}")
+                state["mtime"] = mtime
+                return state["snapshot"]
+            print(f"⚠️ 读取配置文件失败，使用默认配置: {e}")
+            snapshot = _freeze_config(DEFAULT_CONFIG)
+
+        state["snapshot"] = snapshot
+        state["mtime"] = mtime
+        return snapshot
+
+def make_api_request_with_retry(url, headers, data=None, timeout=60, max_retries=3, base_delay=2, method='post',
+                                acquire_token=True):
+    """带有重试机制的API请求函数
+
+    请求前从该Token共享的限流器取令牌；收到429时按Retry-After暂停该Token的所有请求。
+    acquire_token为False表示调用方已为第一次请求取得令牌（如轮询器），重试时仍会取令牌。
+    目标主机熔断时不再发请求和重试，直接抛出CircuitOpenError。
+    """
+    import requests
+
+    api_token = token_from_headers(headers)
+    limiter = get_rate_limiter(api_token)
+    breaker = get_circuit_breaker(url)
+    endpoint = urlparse(url).netloc
+    
     for attempt in range(max_retries):
+        breaker.before_call()
         try:
+            if acquire_token or attempt > 0:
+                limiter.acquire()
+            
             if method.lower() == 'get':
-                response = requests.get(url, headers=headers, timeout=timeout)
+                response = http_request('get', url, headers=headers, timeout=timeout)
             else:
-                response = requests.post(url, data=data, headers=headers, timeout=timeout)
+                response = http_request('post', url, data=data, headers=headers, timeout=timeout)
+            
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
             
             if response.status_code == 429:
-                retry_after = response.headers.get('Retry-After')
-                wait_time = int(retry_after) if retry_after else base_delay * (2 ** attempt)
-                print(f"Rate limited. Waiting {wait_time} seconds before retry...")
-                time.sleep(wait_time)
+                RATE_LIMITED.inc(endpoint=endpoint)
+                if attempt < max_retries - 1:
+                    RETRIES.inc(endpoint=endpoint)
+                wait_time = pause_for_rate_limit(
+                    api_token,
+                    response.headers.get('Retry-After'),
+                    base_delay * (2 ** attempt)
+                )
+                print(f"Rate limited. Pausing requests for {wait_time:.1f} seconds before retry...")
                 continue
             
             return response
             
         except requests.exceptions.Timeout:
+            TIMEOUTS.inc(endpoint=endpoint)
+            breaker.record_failure()
+            _raise_if_circuit_open(breaker)
             if attempt < max_retries - 1:
+                RETRIES.inc(endpoint=endpoint)
                 wait_time = base_delay * (2 ** attempt)
                 print(f"Request timeout. Retrying in {wait_time} seconds...")
                 time.sleep(wait_time)
@@ -186,7 +407,10 @@ def make_api_request_with_retry(url, headers, data=None, timeout=60, max_retries
                 print("Max retries reached. Request failed.")
                 return None
         except Exception as e:
+            breaker.record_failure()
+            _raise_if_circuit_open(breaker)
             if attempt < max_retries - 1:
+                RETRIES.inc(endpoint=endpoint)
                 wait_time = base_delay * (2 ** attempt)
                 print(f"Request failed: {e}. Retrying in {wait_time} seconds...")
                 time.sleep(wait_time)
@@ -197,6 +421,11 @@ def make_api_request_with_retry(url, headers, data=None, timeout=60, max_retries
     
     return None
 
+def _raise_if_circuit_open(breaker):
+    """本次失败触发熔断时立即放弃，不再退避重试"""
+    if breaker.state == OPEN:
+        raise CircuitOpenError(breaker.name, breaker.recovery_seconds)
+
 def calculate_adaptive_size(image, long_edge):
     """计算自适应尺寸"""
     if hasattr(image, 'shape'):  # numpy array
@@ -0,0 +1,175 @@
+"""
+凭据存储模块
+API Token解密一次后缓存在内存中，.api_token或.token_key的修改时间变化时才重新读取；
+只有Token实际变化时才写盘，写入时先写临时文件再原子替换
+"""
+
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN_FILE = os.path.join(ROOT_DIR, '.api_token')
+KEY_FILE = os.path.join(ROOT_DIR, '.token_key')
+
+# cryptography导入较慢，首次读写Token时才导入；None表示尚未尝试
+_fernet_class = None
+_fernet_checked = False
+
+
+def _get_fernet_class():
+    """首次调用时导入cryptography的Fernet，未安装时返回None"""
+    global _fernet_class, _fernet_checked
+    if not _fernet_checked:
+        try:
+            from cryptography.fernet import Fernet
+            _fernet_class = Fernet
+        except ImportError:
+            print("⚠️ 警告: 未安装cryptography库，将使用简单编码保存API Token")
+            print("建议运行: pip install cryptography")
+        _fernet_checked = True
+    return _fernet_class
+
+
+def _mtime(path):
+    """文件的修改时间（纳秒），文件不存在时返回None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _atomic_write(path, data):
+    """写入同目录下的临时文件后替换目标文件，进程中断时不会留下半个文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class CredentialStore:
+    """加密保存在本地文件中的API Token"""
+
+    def __init__(self, token_file=TOKEN_FILE, key_file=KEY_FILE):
+        self.token_file = token_file
+        self.key_file = key_file
+        self._lock = threading.Lock()
+        # (密钥文件mtime, 密钥, 加解密器)
+        self._key = None
+        # (Token文件mtime, 密钥文件mtime, 明文Token)
+        self._token = None
+
+    def _cipher(self, create):
+        """返回 (密钥, Fernet实例或None)，密钥文件未变化时复用；需持有锁"""
+        key_mtime = _mtime(self.key_file)
+        if self._key is not None and self._key[0] == key_mtime and key_mtime is not None:
+            return self._key[1], self._key[2]
+
+        Fernet = _get_fernet_class()
+        if key_mtime is not None:
+            with open(self.key_file, 'rb') as f:
+                key = f.read()
+        elif create:
+            if Fernet is not None:
+                key = Fernet.generate_key()
+            else:
+                # 简单的base64编码作为备选
+                machine_id = hashlib.sha256((os.getcwd() + str(os.path.getsize(__file__))).encode()).digest()[:32]
+                key = base64.b64encode(machine_id)
+            _atomic_write(self.key_file, key)
+            key_mtime = _mtime(self.key_file)
+        else:
+            return None, None
+
+        fernet = Fernet(key) if Fernet is not None else None
+        self._key = (key_mtime, key, fernet)
+        return key, fernet
+
+    def _load_locked(self):
+        token_mtime = _mtime(self.token_file)
+        if token_mtime is None:
+            self._token = None
+            return ""
+
+        key_mtime = _mtime(self.key_file)
+        if self._token is not None and self._token[:2] == (token_mtime, key_mtime):
+            return self._token[2]
+
+        _, fernet = self._cipher(create=True)
+        with open(self.token_file, 'rb') as f:
+            encrypted_token = f.read()
+        if fernet is not None:
+            token = fernet.decrypt(encrypted_token).decode()
+        else:
+            token = base64.b64decode(encrypted_token).decode()
+
+        self._token = (token_mtime, _mtime(self.key_file), token)
+        return token
+
+    def get_key(self):
+        """获取加密密钥，不存在时生成"""
+        with self._lock:
+            return self._cipher(create=True)[0]
+
+    def load(self):
+        """读取Token，文件未变化时直接返回内存中的值"""
+        with self._lock:
+            return self._load_locked()
+
+    def save(self, token):
+        """保存Token，返回是否实际写入了文件（与已保存的值相同时不写盘）"""
+        with self._lock:
+            try:
+                if self._load_locked() == token:
+                    return False
+            except Exception:
+                # 旧文件无法解密时直接覆盖
+                pass
+
+            _, fernet = self._cipher(create=True)
+            if fernet is not None:
+                encrypted_token = fernet.encrypt(token.encode())
+            else:
+                encrypted_token = base64.b64encode(token.encode())
+            _atomic_write(self.token_file, encrypted_token)
+            self._token = (_mtime(self.token_file), _mtime(self.key_file), token)
+            return True
+
+    def delete(self):
+        """删除Token和密钥文件，返回是否实际删除了文件"""
+        with self._lock:
+            removed = False
+            for path in (self.token_file, self.key_file):
+                try:
+                    os.remove(path)
+                    removed = True
+                except FileNotFoundError:
+                    pass
+            self._token = None
+            self._key = None
+            return removed
+
+
+_credential_store = None
+_credential_store_lock = threading.Lock()
+
+
+def get_credential_store():
+    """获取进程内共享的凭据存储"""
+    global _credential_store
+    if _credential_store is None:
+        with _credential_store_lock:
+            if _credential_store is None:
+                _credential_store = CredentialStore()
+    return _credential_store
@@ -0,0 +1,389 @@
+"""
+图像生成任务模块
+文生图和图像编辑共用的任务提交、等待、结果下载和元数据写入流程
+"""
+
+import asyncio
+import json
+import struct
+import tempfile
+import threading
+import zlib
+from concurrent.futures import Future
+from io import BytesIO
+from PIL import Image
+from .http_client import http_request
+from .common import make_api_request_with_retry
+from .circuit_breaker import CircuitOpenError
+from .task_poller import wait_for_task
+from .result_cache import get_result_cache, is_deterministic, result_cache_key
+from .task_journal import get_task_journal, token_hash, SUCCEED, DOWNLOADED
+from .metrics import timed_stage
+
+IMAGE_GENERATION_URL = 'https://api-inference.modelscope.cn/v1/images/generations'
+
+
+def submit_image_task(api_token, payload, config):
+    """提交异步图像生成任务，返回 (task_id, 错误信息)"""
+    headers = {
+        'Authorization': f'Bearer {api_token}',
+        'Content-Type': 'application/json',
+        'X-ModelScope-Async-Mode': 'true'
+    }
+
+    try:
+        response = make_api_request_with_retry(
+            url=IMAGE_GENERATION_URL,
+            headers=headers,
+            data=json.dumps(payload),
+            timeout=int(config.get("timeout", 720)),
+            max_retries=2,
+            base_delay=3,
+            method='post'
+        )
+    except CircuitOpenError as e:
+        return None, str(e)
+
+    if not response:
+        return None, "API请求失败: 网络连接问题"
+
+    if response.status_code != 200:
+        return None, f"API请求失败: {response.status_code}, {response.text}"
+
+    task_data = response.json()
+    if 'task_id' not in task_data:
+        return None, f"API响应格式错误: {task_data}"
+
+    return task_data['task_id'], None
+
+
+async def run_image_task(api_token, payload, config, metadata=None, task_key=None, handler='image_generation'):
+    """提交任务并等待完成，返回 (task_id, 输出图片URL, 错误信息)
+
+    提交成功后先写入任务日志，轮询超时或进程退出后仍可按任务ID取回结果。
+    """
+    with timed_stage(handler, payload.get('model'), 'submit'):
+        task_id, error = await asyncio.to_thread(submit_image_task, api_token, payload, config)
+    if error:
+        return None, None, error
+
+    print(f"任务已提交，任务ID: {task_id}")
+    await asyncio.to_thread(get_task_journal().record_submitted, task_id, api_token, payload, metadata, task_key)
+
+    return await wait_image_task(api_token, task_id, payload, config, handler)
+
+
+async def wait_image_task(api_token, task_id, payload, config, handler='image_generation'):
+    """等待已提交的任务完成并更新任务日志，返回 (task_id, 输出图片URL, 错误信息)"""
+    journal = get_task_journal()
+    model = payload.get('model')
+
+    # 交给共享轮询器等待，不占用工作线程
+    max_wait_seconds = max(60, int(config.get('timeout', 720)))
+    with timed_stage(handler, model, 'poll'):
+        status_data = await wait_for_task(task_id, api_token, max_wait_seconds, model, payload.get('size'), handler)
+
+    if status_data is None:
+        # 任务保持未完成状态，之后可在任务恢复页面取回
+        return task_id, None, f"任务轮询超时，可稍后在「任务恢复」页面取回结果（任务ID: {task_id}）"
+
+    if status_data.get('task_status') == 'FAILED':
+        error_info = status_data.get('errors', {})
+        error = f"任务失败: {error_info.get('message', 'Unknown error')}"
+        await asyncio.to_thread(journal.mark_failed, task_id, error)
+        return task_id, None, error
+
+    output_images = status_data.get('output_images', [])
+    if not output_images:
+        error = "任务成功但无输出图像"
+        await asyncio.to_thread(journal.mark_failed, task_id, error)
+        return task_id, None, error
+
+    await asyncio.to_thread(journal.mark_succeeded, task_id, output_images[0])
+    return task_id, output_images[0], None
+
+
+# 下载时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _new_spooled_buffer(config):
+    """创建临时缓冲：小于阈值时在内存中，超过后自动落盘"""
+    return tempfile.SpooledTemporaryFile(max_size=int(config.get("result_spool_bytes", 4 * 1024 * 1024)))
+
+
+def download_result_file(img_url, config):
+    """流式下载生成的图片，返回 (文件对象, 错误信息)
+
+    数据分块写入临时缓冲，超过result_download_max_bytes时中止下载。
+    """
+    max_bytes = int(config.get("result_download_max_bytes", 64 * 1024 * 1024))
+
+    with http_request('get', img_url, timeout=int(config.get("image_download_timeout", 30)), stream=True) as img_response:
+        if img_response.status_code != 200:
+            return None, f"图片下载失败: {img_response.status_code}"
+
+        declared_size = img_response.headers.get('Content-Length')
+        if declared_size and declared_size.isdigit() and int(declared_size) > max_bytes:
+            return None, f"图片下载失败: 结果图片大小 {int(declared_size)} 字节超过上限 {max_bytes} 字节"
+
+        buffer = _new_spooled_buffer(config)
+        received = 0
+        for chunk in img_response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            received += len(chunk)
+            if received > max_bytes:
+                buffer.close()
+                return None, f"图片下载失败: 结果图片超过上限 {max_bytes} 字节"
+            buffer.write(chunk)
+
+    buffer.seek(0)
+    return buffer, None
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 0x927C 是 MakerNote 标签，常用于存储自定义数据
+METADATA_EXIF_TAG = 0x927C
+
+
+def _png_chunk(chunk_type, chunk_data):
+    """构造一个PNG数据块（长度 + 类型 + 数据 + CRC）"""
+    return (
+        struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data
+        + struct.pack('>I', zlib.crc32(chunk_type + chunk_data) & 0xffffffff)
+    )
+
+
+def _build_exif_bytes(exif, metadata):
+    """在已有EXIF基础上写入元数据，返回不带"Exif"前缀的TIFF数据"""
+    # 将元数据转换为JSON字符串并添加到EXIF数据中
+    exif[METADATA_EXIF_TAG] = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+    exif_bytes = exif.tobytes()
+    if exif_bytes.startswith(b'Exif\x00\x00'):
+        exif_bytes = exif_bytes[6:]
+    return exif_bytes
+
+
+def _copy_bytes(source, target, length):
+    """从source复制length字节到target"""
+    while length > 0:
+        block = source.read(min(length, DOWNLOAD_CHUNK_SIZE))
+        if not block:
+            raise ValueError("PNG数据不完整")
+        target.write(block)
+        length -= len(block)
+
+
+def embed_metadata_file(source_file, metadata, config):
+    """将生成参数写入图片EXIF的MakerNote标签，返回新的文件对象
+
+    PNG直接在IHDR之后插入eXIf数据块，不解码也不重新压缩像素数据；
+    其他格式只做一次PNG编码。
+    """
+    source = Image.open(source_file)
+
+    if source.format != 'PNG':
+        # 非PNG结果：解码一次并以PNG格式写出
+        output = _new_spooled_buffer(config)
+        source.save(output, format='PNG', exif=_build_exif_bytes(source.getexif(), metadata))
+        output.seek(0)
+        return output
+
+    # PNG的getexif()在没有eXIf块时会解码整张图，这里只使用文件头中已解析的EXIF
+    exif = Image.Exif()
+    if source.info.get('exif'):
+        exif.load(source.info['exif'])
+    exif_chunk = _png_chunk(b'eXIf', _build_exif_bytes(exif, metadata))
+
+    source_file.seek(0)
+    if source_file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError("PNG文件头无效")
+
+    # 逐块复制，在IHDR之后插入新的eXIf块并丢弃原有的eXIf块
+    output = _new_spooled_buffer(config)
+    output.write(PNG_SIGNATURE)
+    while True:
+        header = source_file.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            source_file.seek(length + 4, 1)
+            continue
+        output.write(header)
+        _copy_bytes(source_file, output, length + 4)
+        if chunk_type == b'IHDR':
+            output.write(exif_chunk)
+
+    output.seek(0)
+    return output
+
+
+def build_result_image(result_file, metadata, config):
+    """按需写入元数据后打开结果图片（在工作线程中执行）
+
+    返回的图像是惰性加载的，像素在显示时才解码；元数据保存在图像的exif信息中。
+    """
+    if metadata is not None:
+        result_file = embed_metadata_file(result_file, metadata, config)
+
+    return Image.open(result_file)
+
+
+# 进行中的确定性任务：参数键 -> (asyncio.Task, Future)，相同参数的请求复用同一个上游任务
+_inflight_tasks = {}
+_inflight_lock = threading.Lock()
+
+
+def _finish_inflight(key, task, future):
+    """共享任务结束：移除参数键，并把结果转给其他事件循环中的等待方"""
+    with _inflight_lock:
+        if _inflight_tasks.get(key, (None,))[0] is task:
+            del _inflight_tasks[key]
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+async def _run_coalesced(key, start_task):
+    """相同key的任务同时只执行一个，其余调用等待同一结果
+
+    start_task是返回协程的函数，结果为 (task_id, 输出图片URL, 错误信息)。
+    共享任务作为独立的asyncio.Task运行，不属于任何一个调用方：
+    发起的请求被取消（如页面关闭）时任务继续执行，其他等待方仍能拿到结果。
+    返回 (结果, 是否复用了其他请求的任务)。
+    """
+    if key is None:
+        return await start_task(), False
+
+    loop = asyncio.get_running_loop()
+    with _inflight_lock:
+        inflight = _inflight_tasks.get(key)
+        is_leader = inflight is None
+        if is_leader:
+            task = loop.create_task(start_task())
+            future = Future()
+            _inflight_tasks[key] = (task, future)
+            task.add_done_callback(lambda t: _finish_inflight(key, t, future))
+        else:
+            task, future = inflight
+
+    if not is_leader:
+        print("🔗 相同参数的任务正在进行，等待其结果")
+
+    # shield避免某个等待方被取消时连带取消共享的任务
+    if task.get_loop() is loop:
+        result = await asyncio.shield(task)
+    else:
+        result = await asyncio.shield(asyncio.wrap_future(future))
+    return result, not is_leader
+
+
+async def _build_image(result_file, metadata, config, handler, model):
+    """在线程中构建结果图像，写入元数据时计入metadata_embed耗时"""
+    if metadata is None:
+        return await asyncio.to_thread(build_result_image, result_file, None, config)
+    with timed_stage(handler, model, 'metadata_embed'):
+        return await asyncio.to_thread(build_result_image, result_file, metadata, config)
+
+
+async def _download(img_url, config, handler, model):
+    with timed_stage(handler, model, 'download'):
+        return await asyncio.to_thread(download_result_file, img_url, config)
+
+
+async def generate_result_image(api_token, payload, config, metadata=None, input_digest=None, upload_input=None,
+                                handler='image_generation'):
+    """文生图和图像编辑的完整流程，返回 (图像, 任务ID, 错误信息, 是否命中缓存)
+
+    固定种子的任务先查结果缓存，命中时不调用ModelScope；
+    与同一Token正在进行的相同参数任务合并，只提交一次上游任务；
+    不同Token之间不合并，某个Token的错误不会影响其他用户，任务日志也记在各自的Token下。
+    upload_input用于图像编辑：需要提交任务时才上传输入图片，返回 (图片URL, 错误信息)。
+    metadata不为None时写入图像，task_id会自动补充到其中。
+    handler用于监控指标标签。
+    """
+    model = payload.get('model')
+    task_key = None
+    use_cache = False
+    if is_deterministic(payload):
+        task_key = result_cache_key(payload, input_digest)
+        use_cache = bool(config.get("result_cache_enabled", True))
+
+    if use_cache:
+        cached = await asyncio.to_thread(get_result_cache().get, task_key)
+        if cached is not None:
+            data, task_id = cached
+            print(f"♻️ 命中结果缓存，任务ID: {task_id}")
+            result_image = await _build_image(BytesIO(data), _with_task_id(metadata, task_id), config, handler, model)
+            return result_image, task_id, None, True
+
+    async def start_task():
+        # 之前超时的相同参数任务仍未完成时，接着等待它而不是重新提交
+        pending_task_id = await asyncio.to_thread(get_task_journal().find_pending, task_key, api_token)
+        if pending_task_id:
+            print(f"♻️ 接着等待之前提交的相同任务，任务ID: {pending_task_id}")
+            return await wait_image_task(api_token, pending_task_id, payload, config, handler)
+
+        task_payload = payload
+        if upload_input is not None:
+            with timed_stage(handler, model, 'upload'):
+                image_url, error = await asyncio.to_thread(upload_input)
+            if error:
+                return None, None, error
+            task_payload = dict(payload, image_url=image_url)
+
+        # 提交任务并等待完成
+        return await run_image_task(api_token, task_payload, config, metadata, task_key, handler)
+
+    inflight_key = (token_hash(api_token), task_key) if task_key is not None else None
+    (task_id, img_url, error), shared = await _run_coalesced(inflight_key, start_task)
+    if error:
+        return None, task_id, error, False
+
+    # 下载生成的图片
+    result_file, error = await _download(img_url, config, handler, model)
+    if error:
+        return None, task_id, error, False
+    await asyncio.to_thread(get_task_journal().mark_downloaded, task_id)
+
+    if use_cache and not shared:
+        await asyncio.to_thread(get_result_cache().put, task_key, result_file, task_id, config)
+
+    result_image = await _build_image(result_file, _with_task_id(metadata, task_id), config, handler, model)
+    return result_image, task_id, None, False
+
+
+async def recover_result_image(api_token, task_id, config, handler='task_recovery'):
+    """按任务日志取回之前提交的任务结果，返回 (图像, 错误信息)"""
+    journal = get_task_journal()
+    entry = await asyncio.to_thread(journal.get, task_id, api_token)
+    if entry is None:
+        return None, "未找到该任务（任务ID错误，或不是当前API Token提交的任务）"
+
+    model = entry['model']
+    if entry['status'] in (SUCCEED, DOWNLOADED) and entry['image_url']:
+        img_url = entry['image_url']
+    else:
+        _, img_url, error = await wait_image_task(api_token, task_id, entry['payload'], config, handler)
+        if error:
+            return None, error
+
+    result_file, error = await _download(img_url, config, handler, model)
+    if error:
+        return None, error
+    await asyncio.to_thread(journal.mark_downloaded, task_id)
+
+    if entry['task_key'] and config.get("result_cache_enabled", True):
+        await asyncio.to_thread(get_result_cache().put, entry['task_key'], result_file, task_id, config)
+
+    result_image = await _build_image(result_file, _with_task_id(entry['metadata'], task_id), config, handler, model)
+    return result_image, None
+
+
+def _with_task_id(metadata, task_id):
+    if metadata is None:
+        return None
+    return dict(metadata, task_id=task_id)
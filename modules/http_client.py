@@ -0,0 +1,105 @@
+"""
+HTTP连接池模块
+为ModelScope API、结果图片下载和图片上传CDN提供进程内共享的keep-alive连接池，
+并为OpenAI兼容客户端提供共享的httpx连接池
+"""
+
+import threading
+from urllib.parse import urlparse
+
+# 每个主机一个Session，各自维护独立的连接池
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+
+
+def _create_session(config):
+    """创建带有连接池的Session（首次请求时才导入requests）"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    pool_connections = int(config.get("http_pool_connections", DEFAULT_POOL_CONNECTIONS))
+    pool_maxsize = int(config.get("http_pool_maxsize", DEFAULT_POOL_MAXSIZE))
+
+    session = requests.Session()
+    # 重试由调用方负责，这里不做连接层重试
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(url):
+    """获取目标URL所在主机的共享Session"""
+    from .common import load_config
+
+    parsed = urlparse(url)
+    host_key = f"{parsed.scheme}://{parsed.netloc}"
+
+    session = _sessions.get(host_key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(host_key)
+        if session is None:
+            session = _create_session(load_config())
+            _sessions[host_key] = session
+        return session
+
+
+def http_request(method, url, **kwargs):
+    """通过共享连接池发送HTTP请求"""
+    return get_session(url).request(method.upper(), url, **kwargs)
+
+
+_httpx_client = None
+
+
+def get_shared_httpx_client():
+    """获取所有OpenAI客户端共用的httpx.Client
+
+    安装了h2库时启用HTTP/2，多轮对话可以复用同一条连接。
+    """
+    global _httpx_client
+    if _httpx_client is not None:
+        return _httpx_client
+
+    with _sessions_lock:
+        if _httpx_client is None:
+            import httpx
+            from .common import load_config
+
+            config = load_config()
+            try:
+                import h2  # noqa: F401
+                http2 = True
+            except ImportError:
+                http2 = False
+
+            limits = httpx.Limits(
+                max_connections=int(config.get("http_pool_maxsize", DEFAULT_POOL_MAXSIZE)) * 2,
+                max_keepalive_connections=int(config.get("http_pool_maxsize", DEFAULT_POOL_MAXSIZE)),
+                keepalive_expiry=60
+            )
+            # 读取超时与openai库默认一致，长回答不会被截断
+            _httpx_client = httpx.Client(
+                http2=http2,
+                limits=limits,
+                timeout=httpx.Timeout(600, connect=10)
+            )
+        return _httpx_client
+
+
+def close_all_sessions():
+    """关闭所有连接池（用于进程退出或测试）"""
+    global _httpx_client
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        if _httpx_client is not None:
+            _httpx_client.close()
+            _httpx_client = None
@@ -3,16 +3,217 @@
 处理图像编辑功能
 """
 
-import json
-import time
-import tempfile
+import asyncio
 import os
-import requests
-from PIL import Image
 from io import BytesIO
-from .common import load_config, make_api_request_with_retry, calculate_adaptive_size
+from PIL import Image, ImageOps
+from .http_client import http_request
+from .circuit_breaker import CircuitOpenError, get_circuit_breaker
+from .common import load_config, calculate_adaptive_size
+from .generation import generate_result_image
+from .upload_cache import content_digest, get_upload_cache
+from .tracing import start_trace, span, append_breakdown
 
-def edit_image(api_token, model, image, prompt, negative_prompt, adaptive_ratio, width, height, long_edge, steps, guidance, seed, include_metadata=True):
+UPLOAD_URL = 'https://ai.kefan.cn/api/upload/local'
+
+# 上传请求的默认超时（秒）：图床挂起不响应时按失败计入熔断，不无限占用工作线程
+DEFAULT_UPLOAD_TIMEOUT = 30
+
+# 上传前预处理的默认值：长边上限和字节预算
+DEFAULT_UPLOAD_MAX_EDGE = 2048
+DEFAULT_UPLOAD_MAX_BYTES = 1024 * 1024
+
+# 按字节预算选择编码质量时尝试的档位（从低到高）
+UPLOAD_QUALITY_STEPS = (50, 55, 60, 65, 70, 75, 80, 85, 90)
+
+# upload_format配置 -> (PIL格式, 扩展名, MIME类型)
+UPLOAD_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'webp': ('WEBP', 'webp', 'image/webp')
+}
+
+# 可以不经转码直接上传的格式
+FORWARDABLE_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'WEBP': ('webp', 'image/webp')
+}
+
+def load_input_image(image):
+    """读取输入图像，返回 (PIL图像, 原始文件字节)
+
+    输入为文件路径或文件字节且格式可直接上传、无需按EXIF旋转时返回原始字节，否则原始字节为None。
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as f:
+            image = f.read()
+    
+    if isinstance(image, (bytes, bytearray)):
+        original_bytes = bytes(image)
+        pil_image = Image.open(BytesIO(original_bytes))
+        
+        # 274 是EXIF方向标签，1表示无需旋转
+        if pil_image.format in FORWARDABLE_FORMATS and pil_image.getexif().get(274, 1) == 1:
+            return pil_image, original_bytes
+        
+        return ImageOps.exif_transpose(pil_image), None
+    
+    if hasattr(image, 'shape'):  # numpy array
+        return Image.fromarray(image.astype('uint8')), None
+    
+    # PIL Image
+    return image, None
+
+def upload_size(size, target_size, max_edge):
+    """计算上传前的缩放尺寸，无需缩小时返回None
+
+    缩放后的图像刚好覆盖目标尺寸（服务端不必再放大），且长边不超过max_edge。
+    """
+    w, h = size
+    target_w, target_h = target_size
+    scale = min(1.0, max(target_w / w, target_h / h))
+    if max_edge:
+        scale = min(scale, max_edge / max(w, h))
+    if scale >= 1.0:
+        return None
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+def get_upload_max_edge(config, model):
+    """上传图像的最大长边，模型单独配置时优先"""
+    per_model = config.get("upload_max_edge_per_model") or {}
+    return int(per_model.get(model, config.get("upload_max_edge", DEFAULT_UPLOAD_MAX_EDGE)))
+
+def _encode(pil_image, image_format, quality):
+    buffer = BytesIO()
+    pil_image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+def encode_within_budget(pil_image, image_format, max_bytes):
+    """按字节预算选择编码质量，返回 (字节, 质量)
+
+    优先使用最高质量；超出预算时在质量档位中二分查找不超预算的最高质量，
+    最低质量仍超出时返回最低质量的结果。
+    """
+    data = _encode(pil_image, image_format, UPLOAD_QUALITY_STEPS[-1])
+    if not max_bytes or len(data) <= max_bytes:
+        return data, UPLOAD_QUALITY_STEPS[-1]
+    
+    best = None
+    low, high = 0, len(UPLOAD_QUALITY_STEPS) - 2
+    while low <= high:
+        mid = (low + high) // 2
+        candidate = _encode(pil_image, image_format, UPLOAD_QUALITY_STEPS[mid])
+        if len(candidate) <= max_bytes:
+            best = (candidate, UPLOAD_QUALITY_STEPS[mid])
+            low = mid + 1
+        else:
+            high = mid - 1
+    
+    if best is None:
+        quality = UPLOAD_QUALITY_STEPS[0]
+        return _encode(pil_image, image_format, quality), quality
+    return best
+
+def encode_upload_image(pil_image, original_bytes, target_size=None, max_edge=None, max_bytes=None, upload_format='jpeg'):
+    """生成上传内容，返回 (字节, 文件名, MIME类型)
+
+    原图无需缩小且不超过字节预算时直接上传原始字节；否则缩放到目标尺寸，
+    再按字节预算选择JPEG或WebP的编码质量。
+    """
+    resized = upload_size(pil_image.size, target_size, max_edge) if target_size else None
+    
+    if original_bytes is not None and resized is None and (not max_bytes or len(original_bytes) <= max_bytes):
+        extension, mime_type = FORWARDABLE_FORMATS[pil_image.format]
+        return original_bytes, f"image.{extension}", mime_type
+    
+    original_size = pil_image.size
+    if resized is not None and pil_image.format == 'JPEG':
+        # 尚未解码的JPEG直接按不小于目标的1/2^n比例解码，省去大部分解码和缩放开销
+        pil_image.draft('RGB', resized)
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    if resized is not None:
+        pil_image = pil_image.resize(resized, Image.LANCZOS, reducing_gap=3.0)
+    
+    image_format, extension, mime_type = UPLOAD_FORMATS.get(str(upload_format).lower(), UPLOAD_FORMATS['jpeg'])
+    data, quality = encode_within_budget(pil_image, image_format, max_bytes)
+    if resized is not None:
+        print(f"📐 输入图像已从 {original_size[0]}×{original_size[1]} 缩放到 {resized[0]}×{resized[1]}，"
+              f"{image_format} 质量 {quality}，上传 {len(data) / 1024:.0f} KB")
+    return data, f"image.{extension}", mime_type
+
+def upload_image(data, filename, mime_type, timeout=DEFAULT_UPLOAD_TIMEOUT):
+    """从内存上传图片到临时CDN，返回 (图片URL, 错误信息)"""
+    import requests
+    
+    breaker = get_circuit_breaker(UPLOAD_URL)
+    try:
+        breaker.before_call()
+    except CircuitOpenError as e:
+        return None, f"图片上传失败: {e}"
+    
+    files = {'file': (filename, data, mime_type)}
+    try:
+        upload_response = http_request('post', UPLOAD_URL, files=files, timeout=timeout)
+    except requests.exceptions.Timeout:
+        breaker.record_failure()
+        return None, f"图片上传失败: {timeout}秒内未响应"
+    except Exception:
+        breaker.record_failure()
+        raise
+    
+    if upload_response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    
+    if upload_response.status_code != 200:
+        return None, f"图片上传失败: {upload_response.text}"
+    
+    upload_data = upload_response.json()
+    if not upload_data.get('success'):
+        return None, f"图片上传失败: {upload_data.get('message', 'Unknown error')}"
+    
+    return upload_data['data'], None
+
+def prepare_input_image(image, model, adaptive_ratio, width, height, long_edge, config):
+    """读取输入图像、计算最终尺寸并按该尺寸预处理，返回 (最终宽, 最终高, 上传字节, 文件名, MIME类型)"""
+    pil_image, original_bytes = load_input_image(image)
+    
+    # 根据自适应比例选项计算最终尺寸
+    if adaptive_ratio:
+        final_width, final_height = calculate_adaptive_size(pil_image, long_edge)
+    else:
+        final_width, final_height = width, height
+    
+    data, filename, mime_type = encode_upload_image(
+        pil_image, original_bytes,
+        target_size=(final_width, final_height),
+        max_edge=get_upload_max_edge(config, model),
+        max_bytes=int(config.get("upload_max_bytes", DEFAULT_UPLOAD_MAX_BYTES)),
+        upload_format=config.get("upload_format", "jpeg")
+    )
+    return final_width, final_height, data, filename, mime_type
+
+def upload_image_cached(data, filename, mime_type, config):
+    """上传图片，相同内容在upload_cache_ttl秒内只上传一次，返回 (图片URL, 错误信息)"""
+    ttl = float(config.get("upload_cache_ttl", 3600))
+    digest = content_digest(data)
+    cache = get_upload_cache()
+    
+    image_url = cache.get(digest, ttl)
+    if image_url:
+        print(f"♻️ 复用已上传的图片: {image_url}")
+        return image_url, None
+    
+    image_url, error = upload_image(
+        data, filename, mime_type, float(config.get("upload_timeout", DEFAULT_UPLOAD_TIMEOUT))
+    )
+    if not error:
+        cache.put(digest, image_url, ttl)
+    return image_url, error
+
+async def edit_image(api_token, model, image, prompt, negative_prompt, adaptive_ratio, width, height, long_edge, steps, guidance, seed, include_metadata=True):
     """图像编辑功能"""
     config = load_config()
     
@@ -22,184 +223,57 @@ def edit_image(api_token, model, image, prompt, negative_prompt, adaptive_ratio,
     if image is None:
         return None, "请先上传图像"
     
-    try:
-        # 转换上传的图片为base64
-        if hasattr(image, 'shape'):  # numpy array
-            pil_image = Image.fromarray(image.astype('uint8'))
-        else:  # PIL Image
-            pil_image = image
-        
-        # 根据自适应比例选项计算最终尺寸
-        if adaptive_ratio:
-            final_width, final_height = calculate_adaptive_size(image, long_edge)
-        else:
-            final_width, final_height = width, height
-        
-        # 保存图像到临时文件
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-            pil_image.save(tmp_file.name, format='JPEG')
-            temp_img_path = tmp_file.name
-        
-        # 上传图片到临时CDN获取URL
-        upload_url = 'https://ai.kefan.cn/api/upload/local'
-        
+    with start_trace('edit_image', model=model):
         try:
-            with open(temp_img_path, 'rb') as img_file:
-                files = {'file': img_file}
-                upload_response = requests.post(upload_url, files=files)
-        finally:
-            # 确保文件句柄关闭后再删除
-            try:
-                os.unlink(temp_img_path)
-            except:
-                pass
-        
-        if upload_response.status_code != 200:
-            return None, f"图片上传失败: {upload_response.text}"
-        
-        upload_data = upload_response.json()
-        if not upload_data.get('success'):
-            return None, f"图片上传失败: {upload_data.get('message', 'Unknown error')}"
-        
-        image_url = upload_data['data']
-        
-        # 构建API请求
-        payload = {
-            'model': model,
-            'prompt': prompt,
-            'image_url': image_url,
-            'size': f"{final_width}x{final_height}",
-            'steps': steps,
-            'guidance': guidance,
-            'seed': seed
-        }
-        
-        if negative_prompt.strip():
-            payload['negative_prompt'] = negative_prompt
-        
-        url = 'https://api-inference.modelscope.cn/v1/images/generations'
-        
-        headers = {
-            'Authorization': f'Bearer {api_token}',
-            'Content-Type': 'application/json',
-            'X-ModelScope-Async-Mode': 'true'
-        }
-        
-        # 发送API请求
-        response = make_api_request_with_retry(
-            url=url,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=int(config.get("timeout", 720)),
-            max_retries=2,
-            base_delay=3,
-            method='post'
-        )
-        
-        if not response:
-            return None, "API请求失败: 网络连接问题"
-        
-        if response.status_code != 200:
-            return None, f"API请求失败: {response.status_code}, {response.text}"
-        
-        task_data = response.json()
-        if 'task_id' not in task_data:
-            return None, f"API响应格式错误: {task_data}"
-        
-        task_id = task_data['task_id']
-        print(f"任务已提交，任务ID: {task_id}")
-        
-        # 轮询任务状态
-        max_wait_seconds = max(60, int(config.get('timeout', 720)))
-        start_time = time.time()
-        check_interval = 3
-        
-        while time.time() - start_time < max_wait_seconds:
-            time.sleep(check_interval)
+            # 读取输入图像，缩放到最终尺寸后编码
+            with span('encode'):
+                final_width, final_height, data, filename, mime_type = await asyncio.to_thread(
+                    prepare_input_image, image, model, adaptive_ratio, width, height, long_edge, config
+                )
             
-            status_response = make_api_request_with_retry(
-                url=f'https://api-inference.modelscope.cn/v1/tasks/{task_id}',
-                headers={
-                    'Authorization': f'Bearer {api_token}',
-                    'X-ModelScope-Task-Type': 'image_generation'
-                },
-                method='get',
-                timeout=int(config.get("timeout", 720))
-            )
+            # 构建API请求（image_url在需要提交任务时上传后补充）
+            payload = {
+                'model': model,
+                'prompt': prompt,
+                'size': f"{final_width}x{final_height}",
+                'steps': steps,
+                'guidance': guidance,
+                'seed': seed
+            }
             
-            if not status_response:
-                continue
-                
-            if status_response.status_code != 200:
-                continue
-                
-            status_data = status_response.json()
-            status = status_data.get('task_status')
+            if negative_prompt.strip():
+                payload['negative_prompt'] = negative_prompt
             
-            if status == 'SUCCEED':
-                output_images = status_data.get('output_images', [])
-                if not output_images:
-                    return None, "任务成功但无输出图像"
-                
-                # 下载生成的图片
-                img_url = output_images[0]
-                img_response = requests.get(img_url, timeout=int(config.get("image_download_timeout", 30)))
-                
-                if img_response.status_code == 200:
-                    img_data = BytesIO(img_response.content)
-                    result_image = Image.open(img_data)
-                    
-                    # 添加元数据到图像
-                    if include_metadata:
-                        metadata = {
-                            'model': model,
-                            'prompt': prompt,
-                            'negative_prompt': negative_prompt,
-                            'adaptive_ratio': adaptive_ratio,
-                            'width': final_width,
-                            'height': final_height,
-                            'original_width': width,
-                            'original_height': height,
-                            'long_edge': long_edge,
-                            'steps': steps,
-                            'guidance': guidance,
-                            'seed': seed,
-                            'task_id': task_id
-                        }
-                        
-                        # 将元数据转换为JSON字符串并添加到EXIF数据中
-                        metadata_json = json.dumps(metadata, ensure_ascii=False)
-                        
-                        # 保存图像到内存并重新加载以添加EXIF数据
-                        img_buffer = BytesIO()
-                        result_image.save(img_buffer, format='PNG', exif=result_image.getexif())
-                        
-                        # 重新加载图像并添加自定义EXIF标签
-                        from PIL.ExifTags import TAGS
-                        exif_dict = result_image.getexif()
-                        
-                        # 使用自定义标签存储元数据（使用私有标签范围）
-                        # 0x927C 是 MakerNote 标签，常用于存储自定义数据
-                        exif_dict[0x927C] = metadata_json.encode('utf-8')
-                        
-                        # 保存带有EXIF数据的图像
-                        img_buffer_with_exif = BytesIO()
-                        result_image.save(img_buffer_with_exif, format='PNG', exif=exif_dict)
-                        img_buffer_with_exif.seek(0)
-                        result_image = Image.open(img_buffer_with_exif)
-                    
-                    return result_image, f"图像编辑成功！任务ID: {task_id}, 尺寸: {final_width}x{final_height}"
-                else:
-                    return None, f"图片下载失败: {img_response.status_code}"
+            # 添加元数据到图像（任务ID在任务完成后补充）
+            metadata = None
+            if include_metadata:
+                metadata = {
+                    'model': model,
+                    'prompt': prompt,
+                    'negative_prompt': negative_prompt,
+                    'adaptive_ratio': adaptive_ratio,
+                    'width': final_width,
+                    'height': final_height,
+                    'original_width': width,
+                    'original_height': height,
+                    'long_edge': long_edge,
+                    'steps': steps,
+                    'guidance': guidance,
+                    'seed': seed
+                }
             
-            elif status == 'FAILED':
-                error_info = status_data.get('errors', {})
-                return None, f"任务失败: {error_info.get('message', 'Unknown error')}"
+            # 上传输入图片到临时CDN、提交任务并下载结果
+            result_image, task_id, error, cached = await generate_result_image(
+                api_token, payload, config, metadata,
+                input_digest=content_digest(data),
+                upload_input=lambda: upload_image_cached(data, filename, mime_type, config),
+                handler='image_edit'
+            )
+            if error:
+                return None, append_breakdown(error)
             
-            elif status == 'PENDING' or status == 'RUNNING':
-                continue
-        
-        return None, "任务轮询超时，请稍后重试"
-        
-    except Exception as e:
-        return None, f"处理过程中发生错误: {str(e)}"
\ No newline at end of file
+            cache_note = "（命中缓存）" if cached else ""
+            return result_image, append_breakdown(f"图像编辑成功{cache_note}！任务ID: {task_id}, 尺寸: {final_width}x{final_height}")
+            
+        except Exception as e:
+            return None, append_breakdown(f"处理过程中发生错误: {str(e)}")
\ No newline at end of file
@@ -4,52 +4,106 @@
 """
 
 import base64
-import numpy as np
+import time
 from PIL import Image
 from io import BytesIO
-from .common import OPENAI_AVAILABLE, OpenAI
+from .common import load_config, is_openai_available, MODELSCOPE_BASE_URL, get_openai_client
+from .rate_limit import call_with_rate_limit, pause_on_rate_limit_error
+from .circuit_breaker import get_circuit_breaker, record_upstream_error
+from .tracing import new_trace, finish_trace
 
-def analyze_image_with_text(image, prompt, api_token, model, max_tokens, temperature):
-    """图生文功能"""
-    if not OPENAI_AVAILABLE:
-        return "请先安装openai库: pip install openai"
+# 未单独配置时发送给视觉模型的最大长边（像素）
+DEFAULT_VISION_MAX_EDGE = 1536
+
+def format_stream_stats(ttft, token_count, generation_seconds):
+    """格式化首字延迟和生成速度"""
+    if ttft is None:
+        return ""
+    speed = token_count / generation_seconds if generation_seconds > 0 else 0.0
+    return f"⏱️ 首字延迟 {ttft:.2f}s · 生成 {token_count} tokens · {speed:.1f} tokens/s"
+
+def get_vision_max_edge(config, model):
+    """模型支持的最大输入长边，模型单独配置时优先"""
+    per_model = config.get("vision_max_edge_per_model") or {}
+    return int(per_model.get(model, config.get("vision_max_edge", DEFAULT_VISION_MAX_EDGE)))
+
+def to_pil_image(image):
+    """把numpy数组或PIL图像转换为PIL图像
+
+    uint8数组直接引用原数据；浮点数组（0-1或0-255）只做一次就地缩放和截断，再转换为uint8。
+    """
+    if not hasattr(image, 'shape'):  # PIL Image
+        return image
+    
+    import numpy as np
+    if image.dtype != np.uint8:
+        if np.issubdtype(image.dtype, np.floating):
+            array = image if image.flags.writeable else image.copy()
+            if array.max() <= 1.0:
+                np.multiply(array, 255, out=array)
+            np.clip(array, 0, 255, out=array)
+        else:
+            array = np.clip(image, 0, 255)
+        image = array.astype(np.uint8)
+    return Image.fromarray(image)
+
+def encode_vision_image(image, max_edge, quality=85):
+    """长边缩放到max_edge以内后编码为JPEG，返回data URL"""
+    pil_image = to_pil_image(image)
+    w, h = pil_image.size
+    
+    if max_edge and max(w, h) > max_edge:
+        scale = max_edge / max(w, h)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if pil_image.format == 'JPEG':
+            # 尚未解码的JPEG直接按不小于目标的1/2^n比例解码
+            pil_image.draft('RGB', size)
+        if pil_image.mode not in ('RGB', 'RGBA', 'L'):
+            pil_image = pil_image.convert('RGB')
+        pil_image = pil_image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        print(f"📐 图像已从 {w}×{h} 缩放到 {size[0]}×{size[1]}")
+    
+    # 确保图像是RGB格式
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    
+    buffered = BytesIO()
+    pil_image.save(buffered, format="JPEG", quality=quality)
+    img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{img_base64}"
+
+def stream_image_analysis(image, prompt, api_token, model, max_tokens, temperature):
+    """图生文核心，逐步产出 (ok, 内容, 统计)
+
+    生成过程中ok为None，内容为已收到的描述；成功时ok为True，统计为首字延迟、生成速度和耗时明细；
+    失败时ok为False，内容为错误信息，统计为耗时明细（发送请求前的检查失败时为空字符串）。
+    """
+    if not is_openai_available():
+        yield False, "请先安装openai库: pip install openai", ""
+        return
     
     if not api_token:
-        return "请提供有效的API Token"
+        yield False, "请提供有效的API Token", ""
+        return
     
     if image is None:
-        return "请先上传图像"
+        yield False, "请先上传图像", ""
+        return
     
+    trace = new_trace('analyze_image_with_text', model=model)
     try:
         print(f"🔍 开始分析图像...")
         print(f"📝 提示词: {prompt}")
         print(f"🤖 模型: {model}")
         
-        # 转换图像为base64
-        if hasattr(image, 'shape'):  # numpy array
-            if image.max() <= 1.0:
-                image_np = (image * 255).astype(np.uint8)
-            else:
-                image_np = image.astype(np.uint8)
-            pil_image = Image.fromarray(image_np)
-        else:  # PIL Image
-            pil_image = image
-        
-        # 确保图像是RGB格式
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        buffered = BytesIO()
-        pil_image.save(buffered, format="JPEG", quality=85)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        image_url = f"data:image/jpeg;base64,{img_base64}"
+        # 缩放到模型支持的分辨率后转换为base64
+        encode_start = time.monotonic()
+        image_url = encode_vision_image(image, get_vision_max_edge(load_config(), model))
+        trace.add_span('encode', encode_start, time.monotonic())
         
         print(f"🖼️ 图像已转换为base64格式")
         
-        client = OpenAI(
-            base_url='https://api-inference.modelscope.cn/v1',
-            api_key=api_token
-        )
+        client = get_openai_client(api_token)
         
         messages = [{
             'role': 'user',
@@ -66,24 +120,78 @@ def analyze_image_with_text(image, prompt, api_token, model, max_tokens, tempera
         
         print(f"🚀 发送API请求...")
         
-        response = client.chat.completions.create(
+        breaker = get_circuit_breaker(MODELSCOPE_BASE_URL)
+        breaker.before_call()
+        stream, request_start = call_with_rate_limit(api_token, lambda: client.chat.completions.create(
             model=model,
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
-            stream=False
-        )
+            stream=True,
+            stream_options={"include_usage": True}
+        ), trace)
+        breaker.record_success()
         
-        description = response.choices[0].message.content
+        description = ""
+        first_token_at = None
+        chunk_count = 0
+        completion_tokens = None
+        
+        for chunk in stream:
+            # 服务端支持时，最后一个块携带准确的token用量
+            if getattr(chunk, 'usage', None) and chunk.usage.completion_tokens:
+                completion_tokens = chunk.usage.completion_tokens
+            
+            if not chunk.choices:
+                continue
+            
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+                trace.add_span('first_token', request_start, first_token_at)
+            chunk_count += 1
+            description += content
+            yield None, description, ""
+        
+        finished_at = time.monotonic()
+        if first_token_at is not None:
+            trace.add_span('stream', first_token_at, finished_at)
+        finish_trace(trace)
         print(f"✅ 分析完成!")
         print(f"📄 结果: {description[:100] if description else 'None'}...")
         
         if not description:
-            return "API返回了空的响应，请检查模型是否支持图像分析功能"
+            yield False, "API返回了空的响应，请检查模型是否支持图像分析功能", trace.breakdown()
+            return
         
-        return description
+        # 未返回用量时，以内容块数近似token数
+        stats = format_stream_stats(
+            first_token_at - request_start,
+            completion_tokens or chunk_count,
+            finished_at - first_token_at
+        )
+        print(stats)
+        yield True, description, f"{stats}\n{trace.breakdown()}"
         
     except Exception as e:
+        pause_on_rate_limit_error(api_token, e)
+        record_upstream_error(MODELSCOPE_BASE_URL, e)
         error_msg = f"图像分析失败: {str(e)}"
         print(f"❌ {error_msg}")
-        return error_msg
\ No newline at end of file
+        finish_trace(trace)
+        yield False, error_msg, trace.breakdown()
+
+def analyze_image_with_text(image, prompt, api_token, model, max_tokens, temperature):
+    """图生文功能（流式输出，逐步更新描述文本）"""
+    for ok, content, stats in stream_image_analysis(image, prompt, api_token, model, max_tokens, temperature):
+        if ok is None:
+            yield content
+        elif ok:
+            yield f"{content}\n\n---\n{stats}"
+        elif stats:
+            yield f"{content}\n{stats}"
+        else:
+            yield content
@@ -0,0 +1,159 @@
+"""
+监控指标模块
+进程内的直方图和计数器，以Prometheus文本格式通过 /metrics 输出，
+用于评估容量和发现响应变慢的模型
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from .tracing import span
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+POLL_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                lines.extend(self._render_series(values, series))
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, values, series):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(series)}"]
+
+
+class Histogram(_Metric):
+    """累计分桶的直方图"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def _render_series(self, values, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+STAGE_DURATION = Histogram(
+    'modelscope_stage_duration_seconds',
+    'Duration of each request stage (upload, submit, queue_wait, poll, download, metadata_embed, total).',
+    ('handler', 'model', 'stage')
+)
+TASK_POLL_COUNT = Histogram(
+    'modelscope_task_poll_count',
+    'Number of status polls until a generation task finished or timed out.',
+    ('handler', 'model'),
+    POLL_COUNT_BUCKETS
+)
+RATE_LIMITED = Counter(
+    'modelscope_rate_limited_total',
+    'HTTP 429 responses received from the API.',
+    ('endpoint',)
+)
+RETRIES = Counter(
+    'modelscope_retries_total',
+    'Request retries performed by make_api_request_with_retry.',
+    ('endpoint',)
+)
+TIMEOUTS = Counter(
+    'modelscope_timeouts_total',
+    'Request timeouts seen by make_api_request_with_retry.',
+    ('endpoint',)
+)
+
+REGISTRY = (STAGE_DURATION, TASK_POLL_COUNT, RATE_LIMITED, RETRIES, TIMEOUTS)
+
+
+def observe_stage(handler, model, stage, seconds):
+    STAGE_DURATION.observe(seconds, handler=handler, model=model or '', stage=stage)
+
+
+@contextmanager
+def timed_stage(handler, model, stage):
+    """统计代码块耗时，异常退出时同样计入；同时记录为当前追踪中的一个阶段"""
+    started = time.monotonic()
+    try:
+        with span(stage):
+            yield
+    finally:
+        observe_stage(handler, model, stage, time.monotonic() - started)
+
+
+def render_metrics():
+    """以Prometheus文本格式输出全部指标"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
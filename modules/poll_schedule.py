@@ -0,0 +1,148 @@
+"""
+轮询调度模块
+按模型和尺寸记录任务耗时分布，据此安排下一次状态查询的时间
+"""
+
+import atexit
+import json
+import os
+import threading
+from collections import deque
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.poll_history.json')
+
+# 每个(模型, 尺寸)最多保留的耗时样本数
+MAX_SAMPLES = 50
+# 样本数少于该值时不做预测
+MIN_SAMPLES = 3
+# 新样本最多延迟多久写入历史文件（秒），进程退出时也会写入
+SAVE_INTERVAL = 30.0
+
+
+def _percentile(sorted_values, fraction):
+    """线性插值计算分位数"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class PollSchedule:
+    """任务耗时历史与轮询间隔计算
+
+    - 预计完成前（早于20分位）：直接睡到20分位附近，少发无效请求
+    - 20~90分位之间：按最小间隔密集查询，尽快拿到结果
+    - 超过90分位：随超出时间逐步退避
+    没有足够历史时使用固定间隔。
+    """
+
+    def __init__(self, history_file=HISTORY_FILE):
+        self._history_file = history_file
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """从本地文件加载历史耗时"""
+        if not self._history_file or not os.path.exists(self._history_file):
+            return
+        try:
+            with open(self._history_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key, values in data.items():
+                self._samples[key] = deque((float(v) for v in values), maxlen=MAX_SAMPLES)
+        except Exception as e:
+            print(f"⚠️ 读取轮询历史失败: {e}")
+
+    def flush(self):
+        """把尚未保存的样本写入历史文件"""
+        with self._lock:
+            self._save_timer = None
+            if not self._dirty or not self._history_file:
+                return
+            self._dirty = False
+            data = {key: list(values) for key, values in self._samples.items()}
+        try:
+            with self._save_lock:
+                tmp_file = self._history_file + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_file, self._history_file)
+        except Exception as e:
+            print(f"⚠️ 保存轮询历史失败: {e}")
+
+    @staticmethod
+    def _key(model, size):
+        return f"{model}|{size}"
+
+    def record(self, model, size, duration):
+        """记录一次任务从提交到完成的耗时（秒）
+
+        只在内存中更新，由后台定时器在SAVE_INTERVAL秒内写盘，不阻塞轮询线程。
+        """
+        if not model:
+            return
+        with self._lock:
+            for key in (self._key(model, size), self._key(model, '*')):
+                self._samples.setdefault(key, deque(maxlen=MAX_SAMPLES)).append(round(duration, 2))
+            self._dirty = True
+            if self._save_timer is None and self._history_file:
+                self._save_timer = threading.Timer(SAVE_INTERVAL, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def estimate(self, model, size):
+        """返回 (20分位, 中位数, 90分位) 耗时；样本不足时返回None
+
+        优先使用相同尺寸的历史，不足时退回到该模型所有尺寸的历史。
+        """
+        if not model:
+            return None
+        with self._lock:
+            for key in (self._key(model, size), self._key(model, '*')):
+                values = self._samples.get(key)
+                if values and len(values) >= MIN_SAMPLES:
+                    ordered = sorted(values)
+                    return _percentile(ordered, 0.2), _percentile(ordered, 0.5), _percentile(ordered, 0.9)
+        return None
+
+    def next_delay(self, model, size, elapsed, config):
+        """根据已等待时间计算距下一次查询的秒数"""
+        base_interval = float(config.get("poll_interval", 3))
+        min_interval = float(config.get("poll_min_interval", 1))
+        max_interval = float(config.get("poll_max_interval", 15))
+
+        estimate = self.estimate(model, size)
+        if estimate is None:
+            return base_interval
+
+        early, _, late = estimate
+        if elapsed < early:
+            delay = early - elapsed
+        elif elapsed < late:
+            delay = min_interval
+        else:
+            # 超过预期后按超出比例退避
+            delay = min_interval + (elapsed - late) * 0.5
+
+        return max(min_interval, min(max_interval, delay))
+
+
+_schedule = None
+_schedule_lock = threading.Lock()
+
+
+def get_poll_schedule():
+    """获取进程级共享的轮询调度器"""
+    global _schedule
+    if _schedule is None:
+        with _schedule_lock:
+            if _schedule is None:
+                _schedule = PollSchedule()
+                atexit.register(_schedule.flush)
+    return _schedule
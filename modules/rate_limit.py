@@ -0,0 +1,161 @@
+"""
+限流模块
+按API Token共享的令牌桶限流器：提交、轮询、对话和图生文请求都先取令牌，
+收到429时按Retry-After暂停该Token的所有请求
+"""
+
+import hashlib
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+DEFAULT_RATE_PER_SECOND = 2.0
+DEFAULT_BURST = 5
+
+
+def parse_retry_after(value, default):
+    """解析Retry-After头（秒数或HTTP日期），无法解析时返回default"""
+    if value is None:
+        return default
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucketLimiter:
+    """令牌桶限流器，带全局暂停窗口"""
+
+    def __init__(self, rate_per_second, burst):
+        self._lock = threading.Lock()
+        self._rate = float(rate_per_second)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def reconfigure(self, rate_per_second, burst):
+        """更新速率和桶容量（配置热加载后生效），与当前值相同时不做任何事"""
+        with self._lock:
+            if self._rate == float(rate_per_second) and self._burst == float(burst):
+                return
+            self._refill(time.monotonic())
+            self._rate = float(rate_per_second)
+            self._burst = float(burst)
+            self._tokens = min(self._tokens, self._burst)
+
+    def _refill(self, now):
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def try_acquire(self):
+        """不阻塞地尝试取得一个令牌：取得时返回0，否则返回至少还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if wait > 0:
+                return wait
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self._rate if self._rate > 0 else 1.0
+
+    def acquire(self):
+        """阻塞直到暂停窗口结束并取得一个令牌，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """在接下来的seconds秒内暂停所有请求，并清空令牌避免恢复时瞬间突发"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated_at = max(now, self._paused_until)
+
+    def paused_for(self):
+        """剩余暂停时间（秒）"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_token):
+    """获取某个API Token共享的限流器"""
+    from .common import load_config
+
+    config = load_config()
+    rate = float(config.get("rate_limit_per_second", DEFAULT_RATE_PER_SECOND))
+    burst = int(config.get("rate_limit_burst", DEFAULT_BURST))
+    # 只保存Token的哈希，避免明文Token常驻在注册表中
+    key = hashlib.sha256((api_token or '').encode('utf-8')).hexdigest()
+
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = TokenBucketLimiter(rate, burst)
+            _limiters[key] = limiter
+            return limiter
+
+    limiter.reconfigure(rate, burst)
+    return limiter
+
+
+def token_from_headers(headers):
+    """从Authorization头中取出API Token"""
+    authorization = (headers or {}).get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):]
+    return authorization
+
+
+def pause_for_rate_limit(api_token, retry_after, default_seconds):
+    """收到429时暂停该Token的所有请求，返回暂停的秒数"""
+    wait_time = parse_retry_after(retry_after, default_seconds)
+    get_rate_limiter(api_token).pause(wait_time)
+    return wait_time
+
+
+def pause_on_rate_limit_error(api_token, error, default_seconds=5):
+    """OpenAI客户端抛出429错误时暂停该Token的所有请求"""
+    response = getattr(error, 'response', None)
+    if getattr(error, 'status_code', None) != 429 or response is None:
+        return
+    wait_time = pause_for_rate_limit(api_token, response.headers.get('retry-after'), default_seconds)
+    print(f"Rate limited. Pausing requests for {wait_time:.1f} seconds...")
+
+
+def call_with_rate_limit(api_token, request, trace=None, max_retries=3, base_delay=2):
+    """经共享限流器发起OpenAI请求，返回 (响应, 最后一次请求的开始时间)
+
+    OpenAI客户端自身不重试；每次尝试前取令牌，收到429时按Retry-After暂停该Token的
+    所有请求后重试。trace不为None时把取令牌的等待记为rate_limit阶段。
+    """
+    limiter = get_rate_limiter(api_token)
+    for attempt in range(max_retries):
+        if trace is not None:
+            with trace.span('rate_limit'):
+                limiter.acquire()
+        else:
+            limiter.acquire()
+        started = time.monotonic()
+        try:
+            return request(), started
+        except Exception as e:
+            if getattr(e, 'status_code', None) != 429 or attempt == max_retries - 1:
+                raise
+            pause_on_rate_limit_error(api_token, e, base_delay * (2 ** attempt))
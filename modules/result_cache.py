@@ -0,0 +1,192 @@
+"""
+结果缓存模块
+固定种子的生成结果是确定的，按生成参数缓存结果图片，命中时无需再调用ModelScope
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from .file_lock import file_lock
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.result_cache')
+INDEX_FILE_NAME = 'index.json'
+
+# 参与缓存键计算的参数（image_url是临时地址，由输入图片哈希代替）
+KEY_FIELDS = ('model', 'prompt', 'negative_prompt', 'size', 'steps', 'guidance', 'seed')
+
+# 命中时只在内存中更新最近使用时间，最多延迟多久写入索引（秒），进程退出时也会写入
+INDEX_SAVE_INTERVAL = 30.0
+
+
+def is_deterministic(payload):
+    """固定种子（非-1）的任务结果可缓存"""
+    try:
+        return int(payload.get('seed', -1)) != -1
+    except (TypeError, ValueError):
+        return False
+
+
+def result_cache_key(payload, input_digest=None):
+    """根据生成参数和输入图片哈希计算缓存键"""
+    normalized = {field: payload.get(field, '') for field in KEY_FIELDS}
+    # Gradio数值控件会返回浮点数，统一格式避免同一参数算出不同的键
+    normalized['seed'] = int(normalized['seed'])
+    normalized['steps'] = int(normalized['steps'])
+    normalized['guidance'] = round(float(normalized['guidance']), 4)
+    normalized['input'] = input_digest or ''
+    canonical = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """磁盘上的结果图片缓存，按最近使用淘汰，同时限制条目数和总字节数
+
+    多个进程（WebUI和HTTP服务）可共用同一个缓存目录，写入索引前会合并其他进程的条目。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self._cache_dir = cache_dir
+        self._index_file = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+        self._load()
+
+    def _read_index(self):
+        """读取磁盘上的索引，丢弃图片文件已不存在的条目"""
+        if not os.path.exists(self._index_file):
+            return {}
+        try:
+            with open(self._index_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"⚠️ 读取结果缓存索引失败: {e}")
+            return {}
+        return {key: entry for key, entry in entries.items() if os.path.exists(self._path(key))}
+
+    def _load(self):
+        self._entries = self._read_index()
+
+    def _save(self, max_entries=None, max_bytes=None):
+        """在文件锁内合并磁盘上的索引后立即写入，给出配额时同时淘汰旧条目（需持有锁）
+
+        其他进程写入的条目会并入内存，淘汰时一并计入配额；
+        图片文件已被其他进程淘汰的条目随之丢弃。
+        """
+        self._dirty = False
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with file_lock(self._index_file):
+                merged = self._read_index()
+                for key, entry in self._entries.items():
+                    existing = merged.get(key)
+                    if existing is None:
+                        if os.path.exists(self._path(key)):
+                            merged[key] = entry
+                    elif entry['last_access'] > existing['last_access']:
+                        merged[key] = entry
+                self._entries = merged
+                if max_entries is not None:
+                    self._evict(max_entries, max_bytes)
+
+                tmp_file = self._index_file + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_file, self._index_file)
+        except Exception as e:
+            print(f"⚠️ 保存结果缓存索引失败: {e}")
+
+    def flush(self):
+        """写入尚未保存的最近使用时间"""
+        with self._lock:
+            self._save_timer = None
+            if self._dirty:
+                self._save()
+
+    def _mark_dirty(self):
+        """标记索引需要保存，由定时器批量写入（需持有锁）"""
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(INDEX_SAVE_INTERVAL, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, f"{key}.img")
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self, max_entries, max_bytes):
+        """按最近使用时间从旧到新淘汰，直到满足条目数和字节配额"""
+        total_bytes = sum(entry['bytes'] for entry in self._entries.values())
+        ordered = sorted(self._entries.items(), key=lambda item: item[1]['last_access'])
+        for key, entry in ordered:
+            if len(self._entries) <= max_entries and total_bytes <= max_bytes:
+                break
+            total_bytes -= entry['bytes']
+            self._remove(key)
+
+    def get(self, key):
+        """读取缓存的图片，返回 (图片字节, 任务ID)；未命中返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self._remove(key)
+                self._save()
+                return None
+            entry['last_access'] = time.time()
+            self._mark_dirty()
+            return data, entry.get('task_id')
+
+    def put(self, key, source_file, task_id, config):
+        """从文件对象写入一条缓存并按配置淘汰旧条目，完成后文件指针回到开头"""
+        max_entries = int(config.get("result_cache_max_entries", 500))
+        max_bytes = int(config.get("result_cache_max_bytes", 1024 * 1024 * 1024))
+
+        with self._lock:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            tmp_path = self._path(key) + '.tmp'
+            source_file.seek(0)
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(source_file, f)
+                size = f.tell()
+            source_file.seek(0)
+
+            if size > max_bytes:
+                os.unlink(tmp_path)
+                return
+            os.replace(tmp_path, self._path(key))
+
+            self._entries[key] = {'bytes': size, 'task_id': task_id, 'last_access': time.time()}
+            self._save(max_entries, max_bytes)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """获取进程级共享的结果缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+                atexit.register(_cache.flush)
+    return _cache
@@ -0,0 +1,301 @@
+"""
+任务调度模块
+文生图、图像编辑、对话和图生文各自有独立的并发上限，互不抢占；
+同一类任务排队时按会话公平轮转，正在运行任务最少的会话优先
+"""
+
+import asyncio
+import functools
+import inspect
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .metrics import observe_stage
+from .tracing import record_queue_wait
+
+# 任务池 -> 默认并发上限
+DEFAULT_CONCURRENCY = {
+    'image_generation': 4,
+    'image_edit': 2,
+    'chat': 8,
+    'vision': 4,
+}
+DEFAULT_QUEUE_MAX_SIZE = 64
+ANONYMOUS_SESSION = 'anonymous'
+
+
+class QueueFullError(Exception):
+    """排队任务数已达上限"""
+
+    def __init__(self, pool, max_queue):
+        self.pool = pool
+        super().__init__(f"当前排队任务过多（{pool}，上限 {max_queue}），请稍后再试")
+
+
+class _Waiter:
+    """排队中的一个任务，在所属事件循环中等待Future，不占用线程"""
+
+    __slots__ = ('session', 'loop', 'future', 'granted')
+
+    def __init__(self, session, loop):
+        self.session = session
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        self.loop.call_soon_threadsafe(_resolve_waiter, self.future)
+
+
+def _resolve_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FairShareScheduler:
+    """带并发上限和会话公平排队的任务池"""
+
+    def __init__(self, name, max_concurrency, max_queue):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._active = 0
+        self._running = {}
+        self._queues = {}
+        self._waiting = 0
+        self._last_served = {}
+        self._serial = itertools.count()
+
+    def configure(self, max_concurrency, max_queue):
+        """更新并发上限和队列长度（配置热加载后生效）"""
+        with self._lock:
+            self.max_concurrency = max_concurrency
+            self.max_queue = max_queue
+            self._dispatch()
+
+    def stats(self):
+        """返回 (运行中, 排队中) 任务数"""
+        with self._lock:
+            return self._active, self._waiting
+
+    def _grant(self, session):
+        self._active += 1
+        self._running[session] = self._running.get(session, 0) + 1
+        self._last_served[session] = next(self._serial)
+
+    def _enqueue(self, waiter):
+        """有空位且无人排队时直接占用并返回True，否则排队并返回False"""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._grant(waiter.session)
+                return True
+            if self._waiting >= self.max_queue:
+                raise QueueFullError(self.name, self.max_queue)
+            self._queues.setdefault(waiter.session, deque()).append(waiter)
+            self._waiting += 1
+            return False
+
+    def _dispatch(self):
+        """把空出的并发名额分给运行任务最少、最久未被服务的会话（需持有锁）"""
+        while self._active < self.max_concurrency and self._waiting:
+            session = min(
+                self._queues,
+                key=lambda s: (self._running.get(s, 0), self._last_served.get(s, -1))
+            )
+            queue = self._queues[session]
+            waiter = queue.popleft()
+            if not queue:
+                del self._queues[session]
+            self._waiting -= 1
+            self._grant(session)
+            waiter.wake()
+
+    def _release_locked(self, session):
+        self._active -= 1
+        remaining = self._running.get(session, 1) - 1
+        if remaining > 0:
+            self._running[session] = remaining
+        else:
+            self._running.pop(session, None)
+            if session not in self._queues:
+                self._last_served.pop(session, None)
+        self._dispatch()
+
+    def release(self, session):
+        with self._lock:
+            self._release_locked(session)
+
+    def _abandon(self, waiter):
+        """等待被取消：已分到名额则归还，否则移出队列"""
+        with self._lock:
+            if waiter.granted:
+                self._release_locked(waiter.session)
+                return
+            queue = self._queues.get(waiter.session)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self._waiting -= 1
+                if not queue:
+                    del self._queues[waiter.session]
+
+    @asynccontextmanager
+    async def slot(self, session):
+        """异步占用一个并发名额"""
+        waiter = _Waiter(session, asyncio.get_running_loop())
+        if not self._enqueue(waiter):
+            try:
+                await waiter.future
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self.release(session)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(pool):
+    """获取任务池对应的调度器，并按当前配置更新上限"""
+    from .common import load_config
+
+    config = load_config()
+    max_concurrency = int(config.get(f"concurrency_{pool}", DEFAULT_CONCURRENCY.get(pool, 4)))
+    max_queue = int(config.get("queue_max_size", DEFAULT_QUEUE_MAX_SIZE))
+
+    with _schedulers_lock:
+        scheduler = _schedulers.get(pool)
+        if scheduler is None:
+            scheduler = FairShareScheduler(pool, max_concurrency, max_queue)
+            _schedulers[pool] = scheduler
+            return scheduler
+
+    if scheduler.max_concurrency != max_concurrency or scheduler.max_queue != max_queue:
+        scheduler.configure(max_concurrency, max_queue)
+    return scheduler
+
+
+@asynccontextmanager
+async def scheduled_slot(pool, session, handler=None, model=''):
+    """在任务池中排队后执行代码块，记录排队耗时和总耗时（handler默认为任务池名）"""
+    handler = handler or pool
+    started = time.monotonic()
+    try:
+        async with get_scheduler(pool).slot(session):
+            queue_wait = time.monotonic() - started
+            observe_stage(handler, model, 'queue_wait', queue_wait)
+            record_queue_wait(queue_wait)
+            yield
+    finally:
+        observe_stage(handler, model, 'total', time.monotonic() - started)
+
+
+_DONE = object()
+
+
+async def iterate_in_thread(generator):
+    """在线程中逐步执行同步生成器，每产出一项返回事件循环；提前结束时关闭生成器"""
+    try:
+        while True:
+            item = await asyncio.to_thread(next, generator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        try:
+            generator.close()
+        except ValueError:
+            # 生成器仍在线程中执行（等待已被取消），执行完这一步后由垃圾回收关闭
+            pass
+
+
+def scheduled_handler(pool, fn, handler=None, slot_per_item=False):
+    """包装Gradio事件处理函数，使其在指定任务池中按会话公平排队执行
+
+    包装后的函数都是异步的，排队等待不占用Gradio的工作线程，客户端断开时等待随之取消；
+    同步函数和生成器拿到名额后才在线程中执行。
+    包装后的函数比原函数多一个gr.Request参数，Gradio会自动传入，用于识别会话。
+    排队耗时和总耗时按handler（默认为任务池名）和model参数记录到监控指标。
+    slot_per_item为True时不为整个调用占用名额，而是把会话ID作为session参数传给fn（异步生成器），
+    由fn为其中的每项任务（如批量生成的每张图）各自调用scheduled_slot，使每项都计入任务池上限。
+    """
+    import gradio as gr
+
+    handler = handler or pool
+    signature = inspect.signature(fn)
+    if slot_per_item:
+        signature = signature.replace(parameters=[
+            param for name, param in signature.parameters.items() if name != 'session'
+        ])
+
+    def split_args(args):
+        """拆出Gradio追加的request，返回 (原参数, 会话ID, 模型名)"""
+        *args, request = args
+        session = getattr(request, 'session_hash', None) or ANONYMOUS_SESSION
+        try:
+            model = signature.bind_partial(*args).arguments.get('model') or ''
+        except TypeError:
+            model = ''
+        return args, session, model
+
+    if slot_per_item:
+        async def wrapper(*args):
+            args, session, _ = split_args(args)
+            try:
+                async for item in fn(*args, session=session):
+                    yield item
+            except QueueFullError as e:
+                raise gr.Error(str(e))
+    elif inspect.isasyncgenfunction(fn):
+        async def wrapper(*args):
+            args, session, model = split_args(args)
+            try:
+                async with scheduled_slot(pool, session, handler, model):
+                    async for item in fn(*args):
+                        yield item
+            except QueueFullError as e:
+                raise gr.Error(str(e))
+    elif inspect.iscoroutinefunction(fn):
+        async def wrapper(*args):
+            args, session, model = split_args(args)
+            try:
+                async with scheduled_slot(pool, session, handler, model):
+                    return await fn(*args)
+            except QueueFullError as e:
+                raise gr.Error(str(e))
+    elif inspect.isgeneratorfunction(fn):
+        # 同步生成器包装为异步生成器：排队时只等待Future，不占用工作线程；拿到名额后逐步在线程中执行
+        async def wrapper(*args):
+            args, session, model = split_args(args)
+            try:
+                async with scheduled_slot(pool, session, handler, model):
+                    async for item in iterate_in_thread(fn(*args)):
+                        yield item
+            except QueueFullError as e:
+                raise gr.Error(str(e))
+    else:
+        async def wrapper(*args):
+            args, session, model = split_args(args)
+            try:
+                async with scheduled_slot(pool, session, handler, model):
+                    return await asyncio.to_thread(fn, *args)
+            except QueueFullError as e:
+                raise gr.Error(str(e))
+
+    # Gradio按签名和类型注解注入gr.Request，这里在原参数之后追加request参数
+    request_param = inspect.Parameter(
+        'request', inspect.Parameter.POSITIONAL_OR_KEYWORD, default=None, annotation=gr.Request
+    )
+    functools.update_wrapper(wrapper, fn)
+    del wrapper.__wrapped__
+    wrapper.__signature__ = signature.replace(parameters=[*signature.parameters.values(), request_param])
+    wrapper.__annotations__ = {**getattr(fn, '__annotations__', {}), 'request': gr.Request}
+    return wrapper
@@ -0,0 +1,179 @@
+"""
+任务日志模块
+把已提交的生成任务记录到本地SQLite，轮询超时、进程崩溃或重新部署后仍可按任务ID取回结果，
+不必重新提交任务。日志中只保存API Token的哈希，不保存Token本身。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.task_journal.sqlite3')
+
+PENDING = 'PENDING'
+SUCCEED = 'SUCCEED'
+FAILED = 'FAILED'
+# 结果图片已下载；SUCCEED表示服务端已完成但结果尚未取回（如下载前进程崩溃）
+DOWNLOADED = 'DOWNLOADED'
+
+DEFAULT_RETENTION_DAYS = 7
+
+# 自动接着等待旧任务的最长时限，更早的任务可能已在服务端过期，直接重新提交
+RESUME_MAX_AGE_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    token_hash TEXT NOT NULL,
+    task_key TEXT,
+    model TEXT,
+    prompt TEXT,
+    payload TEXT NOT NULL,
+    metadata TEXT,
+    status TEXT NOT NULL,
+    image_url TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_token_status ON tasks (token_hash, status);
+CREATE INDEX IF NOT EXISTS idx_tasks_key ON tasks (task_key);
+"""
+
+
+def token_hash(api_token):
+    """Token的哈希，用于区分不同用户的任务"""
+    return hashlib.sha256((api_token or '').encode('utf-8')).hexdigest()
+
+
+class TaskJournal:
+    """已提交任务的持久化记录"""
+
+    def __init__(self, journal_file=JOURNAL_FILE):
+        self._journal_file = journal_file
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self._journal_file, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def _execute(self, sql, params=()):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    return conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # 日志只用于恢复，读写失败不影响正常生成
+            print(f"⚠️ 任务日志读写失败: {e}")
+            return []
+
+    def record_submitted(self, task_id, api_token, payload, metadata=None, task_key=None):
+        """记录一个刚提交的任务"""
+        now = time.time()
+        kind = 'image_edit' if payload.get('image_url') else 'text_to_image'
+        self._execute(
+            """INSERT OR REPLACE INTO tasks
+               (task_id, kind, token_hash, task_key, model, prompt, payload, metadata, status, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                task_id, kind, token_hash(api_token), task_key, payload.get('model'), payload.get('prompt'),
+                json.dumps(payload, ensure_ascii=False),
+                json.dumps(metadata, ensure_ascii=False) if metadata is not None else None,
+                PENDING, now, now
+            )
+        )
+
+    def mark_succeeded(self, task_id, image_url):
+        self._execute(
+            "UPDATE tasks SET status = ?, image_url = ?, error = NULL, updated_at = ? WHERE task_id = ?",
+            (SUCCEED, image_url, time.time(), task_id)
+        )
+
+    def mark_downloaded(self, task_id):
+        """结果图片已下载，不再出现在待取回列表中"""
+        self._execute(
+            "UPDATE tasks SET status = ?, updated_at = ? WHERE task_id = ? AND status = ?",
+            (DOWNLOADED, time.time(), task_id, SUCCEED)
+        )
+
+    def mark_failed(self, task_id, error):
+        self._execute(
+            "UPDATE tasks SET status = ?, error = ?, updated_at = ? WHERE task_id = ?",
+            (FAILED, error, time.time(), task_id)
+        )
+
+    def get(self, task_id, api_token):
+        """按任务ID查询当前Token提交的任务，返回字典或None"""
+        rows = self._execute(
+            "SELECT * FROM tasks WHERE task_id = ? AND token_hash = ?",
+            (task_id, token_hash(api_token))
+        )
+        return _row_to_dict(rows[0]) if rows else None
+
+    def find_pending(self, task_key, api_token):
+        """查找参数相同、仍未完成的任务ID，用于重新提交时接着等待旧任务"""
+        if not task_key:
+            return None
+        rows = self._execute(
+            """SELECT task_id FROM tasks
+               WHERE task_key = ? AND token_hash = ? AND status = ? AND created_at >= ?
+               ORDER BY created_at DESC LIMIT 1""",
+            (task_key, token_hash(api_token), PENDING, time.time() - RESUME_MAX_AGE_SECONDS)
+        )
+        return rows[0]['task_id'] if rows else None
+
+    def list_unretrieved(self, api_token, limit=50):
+        """列出当前Token尚未取回结果的任务（未完成，或已完成但未下载），按提交时间从新到旧"""
+        rows = self._execute(
+            """SELECT * FROM tasks WHERE token_hash = ? AND status IN (?, ?)
+               ORDER BY created_at DESC LIMIT ?""",
+            (token_hash(api_token), PENDING, SUCCEED, int(limit))
+        )
+        return [_row_to_dict(row) for row in rows]
+
+    def prune(self, retention_days):
+        """删除超过保留期的记录（ModelScope上的结果届时也已过期）"""
+        self._execute(
+            "DELETE FROM tasks WHERE created_at < ?",
+            (time.time() - float(retention_days) * 86400,)
+        )
+
+
+def _row_to_dict(row):
+    entry = dict(row)
+    entry['payload'] = json.loads(entry['payload'])
+    entry['metadata'] = json.loads(entry['metadata']) if entry['metadata'] else None
+    return entry
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_task_journal():
+    """获取进程级共享的任务日志，首次使用时清理过期记录"""
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                from .common import load_config
+
+                journal = TaskJournal()
+                journal.prune(load_config().get("task_journal_retention_days", DEFAULT_RETENTION_DAYS))
+                _journal = journal
+    return _journal
@@ -0,0 +1,232 @@
+"""
+任务轮询模块
+在单个后台事件循环中统一轮询所有未完成的ModelScope异步任务
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .common import load_config, make_api_request_with_retry
+from .circuit_breaker import CircuitOpenError
+from .poll_schedule import get_poll_schedule
+from .rate_limit import get_rate_limiter
+from .metrics import TASK_POLL_COUNT
+
+TASK_STATUS_URL = 'https://api-inference.modelscope.cn/v1/tasks/{task_id}'
+FINAL_STATUSES = ('SUCCEED', 'FAILED')
+
+
+class _PendingTask:
+    """一个等待完成的任务"""
+
+    def __init__(self, task_id, api_token, deadline, future, model=None, size=None, handler=None):
+        self.task_id = task_id
+        self.api_token = api_token
+        self.deadline = deadline
+        self.future = future
+        self.model = model
+        self.size = size
+        self.handler = handler
+        self.started = time.monotonic()
+        self.next_check = 0.0
+        self.checking = False
+        self.polls = 0
+        # 最近一次查询到任务仍未完成的时间（发出请求时），用于估计实际完成时间
+        self.last_unfinished = self.started
+
+    def finish(self, value):
+        """记录查询次数并完成Future"""
+        TASK_POLL_COUNT.observe(self.polls, handler=self.handler or '', model=self.model or '')
+        _resolve(self.future, value)
+
+
+class TaskPoller:
+    """任务轮询器：所有任务共用一个事件循环，只在真正发请求时占用线程"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._wakeup = None
+        self._executor = None
+        self._pending = set()
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """首次使用时启动后台事件循环线程"""
+        if self._loop is not None:
+            return
+
+        with self._start_lock:
+            if self._loop is not None:
+                return
+
+            config = load_config()
+            self._executor = ThreadPoolExecutor(
+                max_workers=int(config.get("poll_max_workers", 8)),
+                thread_name_prefix="task-poller"
+            )
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._wakeup = asyncio.Event()
+                ready.set()
+                loop.run_until_complete(self._poll_forever())
+
+            self._thread = threading.Thread(target=run, name="task-poller", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def track(self, task_id, api_token, timeout, model=None, size=None, handler=None):
+        """登记一个任务，返回在任务成功/失败/超时时完成的Future
+
+        Future的结果为任务状态字典；超时则为None。
+        model和size用于按历史耗时安排查询时间，handler仅用于监控指标标签。
+        """
+        self._ensure_started()
+        future = Future()
+        pending = _PendingTask(task_id, api_token, time.monotonic() + timeout, future, model, size, handler)
+        self._loop.call_soon_threadsafe(self._add, pending)
+        return future
+
+    def pending_count(self):
+        """当前正在轮询的任务数"""
+        return len(self._pending)
+
+    def _add(self, pending):
+        pending.next_check = time.monotonic() + self._next_delay(pending, load_config())
+        self._pending.add(pending)
+        self._wakeup.set()
+
+    async def _poll_forever(self):
+        """主循环：睡到最近一个任务需要检查的时间点，再并发检查所有到期任务"""
+        while True:
+            now = time.monotonic()
+            next_wake = None
+
+            for pending in list(self._pending):
+                if pending.future.done():
+                    self._pending.discard(pending)
+                    continue
+
+                if now >= pending.deadline and not pending.checking:
+                    self._pending.discard(pending)
+                    pending.finish(None)
+                    continue
+
+                if pending.checking:
+                    continue
+
+                if now >= pending.next_check:
+                    pending.checking = True
+                    asyncio.ensure_future(self._check(pending))
+                else:
+                    wake_at = min(pending.next_check, pending.deadline)
+                    next_wake = wake_at if next_wake is None else min(next_wake, wake_at)
+
+            self._wakeup.clear()
+            delay = None if next_wake is None else max(0.0, next_wake - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, pending):
+        """在线程池中查询一次任务状态
+
+        先不阻塞地取令牌：该Token被限流或按Retry-After暂停时推迟本次查询，
+        不让一个Token的等待占满线程池、拖慢其他用户的轮询。
+        """
+        loop = asyncio.get_running_loop()
+        config = load_config()
+        wait = get_rate_limiter(pending.api_token).try_acquire()
+        if wait > 0:
+            pending.checking = False
+            pending.next_check = time.monotonic() + wait
+            self._wakeup.set()
+            return
+
+        pending.polls += 1
+        check_started = time.monotonic()
+        try:
+            status_data = await loop.run_in_executor(self._executor, _fetch_task_status, pending.task_id, pending.api_token, config)
+        except Exception as e:
+            print(f"查询任务状态失败 {pending.task_id}: {e}")
+            status_data = None
+
+        pending.checking = False
+
+        if status_data and status_data.get('task_status') in FINAL_STATUSES:
+            self._pending.discard(pending)
+            if status_data.get('task_status') == 'SUCCEED':
+                # 任务在上次查询到未完成与本次查询之间完成，取区间中点，避免耗时样本受轮询间隔影响
+                finished_at = (pending.last_unfinished + check_started) / 2
+                get_poll_schedule().record(pending.model, pending.size, finished_at - pending.started)
+            pending.finish(status_data)
+        else:
+            if status_data:
+                pending.last_unfinished = check_started
+            pending.next_check = time.monotonic() + self._next_delay(pending, config)
+
+        self._wakeup.set()
+
+    @staticmethod
+    def _next_delay(pending, config):
+        elapsed = time.monotonic() - pending.started
+        return get_poll_schedule().next_delay(pending.model, pending.size, elapsed, config)
+
+
+def _resolve(future, value):
+    """设置Future结果（调用方可能已取消等待）"""
+    if not future.done():
+        try:
+            future.set_result(value)
+        except Exception:
+            pass
+
+
+def _fetch_task_status(task_id, api_token, config):
+    """查询任务状态，失败（包括熔断）时返回None，由轮询器下次再试"""
+    try:
+        response = make_api_request_with_retry(
+            url=TASK_STATUS_URL.format(task_id=task_id),
+            headers={
+                'Authorization': f'Bearer {api_token}',
+                'X-ModelScope-Task-Type': 'image_generation'
+            },
+            method='get',
+            timeout=int(config.get("poll_request_timeout", 30)),
+            max_retries=1,
+            acquire_token=False
+        )
+    except CircuitOpenError:
+        return None
+
+    if not response or response.status_code != 200:
+        return None
+
+    return response.json()
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_task_poller():
+    """获取进程级共享的任务轮询器"""
+    global _poller
+    if _poller is None:
+        with _poller_lock:
+            if _poller is None:
+                _poller = TaskPoller()
+    return _poller
+
+
+async def wait_for_task(task_id, api_token, timeout, model=None, size=None, handler=None):
+    """等待任务结束，返回任务状态字典；超时返回None"""
+    future = get_task_poller().track(task_id, api_token, timeout, model, size, handler)
+    return await asyncio.wrap_future(future)
@@ -0,0 +1,62 @@
+"""
+任务恢复模块
+列出轮询超时或进程重启后仍未取回结果的任务，并按任务ID取回结果
+"""
+
+import datetime
+from .common import load_config
+from .generation import recover_result_image
+from .task_journal import get_task_journal, SUCCEED
+
+TASK_KIND_LABELS = {
+    'text_to_image': '文生图',
+    'image_edit': '图像编辑',
+}
+
+TASK_STATUS_LABELS = {
+    'PENDING': '未完成',
+    SUCCEED: '已完成，未取回',
+}
+
+PENDING_TASK_HEADERS = ["任务ID", "类型", "状态", "模型", "提示词", "提交时间"]
+
+
+def list_pending_tasks(api_token):
+    """列出当前Token尚未取回结果的任务，返回 (表格行, 任务ID选项, 提示信息)"""
+    if not api_token:
+        return [], [], "请提供有效的API Token"
+
+    entries = get_task_journal().list_unretrieved(api_token)
+    rows = [
+        [
+            entry['task_id'],
+            TASK_KIND_LABELS.get(entry['kind'], entry['kind']),
+            TASK_STATUS_LABELS.get(entry['status'], entry['status']),
+            entry['model'] or '',
+            entry['prompt'] or '',
+            datetime.datetime.fromtimestamp(entry['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+        ]
+        for entry in entries
+    ]
+    task_ids = [entry['task_id'] for entry in entries]
+
+    if not rows:
+        return rows, task_ids, "没有未取回结果的任务"
+    return rows, task_ids, f"共 {len(rows)} 个未取回结果的任务"
+
+
+async def recover_task(api_token, task_id):
+    """取回指定任务的结果，返回 (图像, 提示信息)"""
+    if not api_token:
+        return None, "请提供有效的API Token"
+    if not task_id:
+        return None, "请选择或输入任务ID"
+
+    task_id = task_id.strip()
+    try:
+        result_image, error = await recover_result_image(api_token, task_id, load_config())
+        if error:
+            return None, error
+        return result_image, f"已取回任务结果！任务ID: {task_id}"
+    except Exception as e:
+        return None, f"处理过程中发生错误: {str(e)}"
@@ -3,65 +3,141 @@
 处理与AI模型的文本对话功能
 """
 
-from .common import load_config, OPENAI_AVAILABLE, OpenAI
+import time
+from .common import is_openai_available, MODELSCOPE_BASE_URL, get_openai_client
+from .rate_limit import call_with_rate_limit, pause_on_rate_limit_error
+from .circuit_breaker import get_circuit_breaker, record_upstream_error
+from .tracing import new_trace, finish_trace
 
-def chat_with_model(message, history, api_token, model, system_prompt, max_tokens, temperature):
-    """文本对话功能"""
-    if not OPENAI_AVAILABLE:
-        return history + [{"role": "assistant", "content": "请先安装openai库: pip install openai"}], ""
-    
-    config = load_config()
+# 思考过程消息的标题，Chatbot会将带标题的消息渲染为可折叠块
+THINKING_TITLE = "💭 思考过程"
+TIMING_TITLE = "⏱️ 耗时明细"
+
+def _is_thinking_message(msg):
+    """判断是否为思考过程消息（不回传给模型）"""
+    metadata = msg.get("metadata") or {}
+    return bool(metadata.get("title"))
+
+def _timing_message(stats):
+    """耗时明细消息（带标题，不回传给模型）"""
+    return {"role": "assistant", "content": stats, "metadata": {"title": TIMING_TITLE}}
+
+def _build_reply(reasoning, answer):
+    """根据已收到的思考内容和回答内容构建助手消息"""
+    reply = []
+    if reasoning:
+        reply.append({"role": "assistant", "content": reasoning, "metadata": {"title": THINKING_TITLE}})
+    if answer or not reasoning:
+        reply.append({"role": "assistant", "content": answer})
+    return reply
+
+def stream_chat(message, history, api_token, model, system_prompt, max_tokens, temperature):
+    """文本对话核心，逐步产出 (ok, 内容, 统计)
+
+    生成过程中ok为None，内容为已收到的 (思考内容, 回答内容)；
+    成功时ok为True，内容同上，统计为耗时明细；
+    失败时ok为False，内容为错误信息，统计为耗时明细（发送请求前的检查失败时为空字符串）。
+    """
+    if not is_openai_available():
+        yield False, "请先安装openai库: pip install openai", ""
+        return
     
     if not api_token:
-        return history + [{"role": "assistant", "content": "请提供有效的API Token"}], ""
+        yield False, "请提供有效的API Token", ""
+        return
     
     if not message.strip():
-        return history, ""
+        yield False, "请输入消息", ""
+        return
+    
+    reasoning = ""
+    answer = ""
+    trace = new_trace('chat_with_model', model=model)
     
     try:
-        client = OpenAI(
-            base_url='https://api-inference.modelscope.cn/v1',
-            api_key=api_token
-        )
+        client = get_openai_client(api_token)
         
         # 构建消息历史
         messages = [{"role": "system", "content": system_prompt}]
         
-        # 添加历史对话（从messages格式转换）
+        # 添加历史对话（从messages格式转换），跳过思考过程
         for msg in history:
             if isinstance(msg, dict) and "role" in msg and "content" in msg:
-                if msg["role"] in ["user", "assistant"] and not msg["content"].startswith("系统"):
-                    messages.append(msg)
+                if msg["role"] in ["user", "assistant"] and isinstance(msg["content"], str) \
+                        and not msg["content"].startswith("系统") and not _is_thinking_message(msg):
+                    messages.append({"role": msg["role"], "content": msg["content"]})
         
         # 添加当前消息
         messages.append({"role": "user", "content": message})
         
         print(f"💬 发送对话请求，模型: {model}")
         
-        response = client.chat.completions.create(
+        yield None, (reasoning, answer), ""
+        
+        breaker = get_circuit_breaker(MODELSCOPE_BASE_URL)
+        breaker.before_call()
+        first_token_at = None
+        stream, request_start = call_with_rate_limit(api_token, lambda: client.chat.completions.create(
             model=model,
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
-            stream=False
-        )
+            stream=True
+        ), trace)
+        breaker.record_success()
         
-        assistant_response = response.choices[0].message.content
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            
+            delta = chunk.choices[0].delta
+            reasoning_delta = getattr(delta, 'reasoning_content', None) or ""
+            content_delta = delta.content or ""
+            if not reasoning_delta and not content_delta:
+                continue
+            
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+                trace.add_span('first_token', request_start, first_token_at)
+            reasoning += reasoning_delta
+            answer += content_delta
+            yield None, (reasoning, answer), ""
         
-        # 更新历史记录（使用messages格式）
-        new_history = history + [
-            {"role": "user", "content": message},
-            {"role": "assistant", "content": assistant_response}
-        ]
+        if not reasoning and not answer:
+            finish_trace(trace)
+            yield False, "API返回了空的响应", trace.breakdown()
+            return
         
-        return new_history, ""
+        trace.add_span('stream', first_token_at, time.monotonic())
+        finish_trace(trace)
+        yield True, (reasoning, answer), trace.breakdown()
         
     except Exception as e:
-        error_msg = f"对话失败: {str(e)}"
-        return history + [
-            {"role": "user", "content": message},
-            {"role": "assistant", "content": error_msg}
-        ], ""
+        pause_on_rate_limit_error(api_token, e)
+        record_upstream_error(MODELSCOPE_BASE_URL, e)
+        finish_trace(trace)
+        yield False, f"对话失败: {str(e)}", trace.breakdown()
+
+def chat_with_model(message, history, api_token, model, system_prompt, max_tokens, temperature):
+    """文本对话功能（流式输出，逐步更新对话历史）"""
+    if not message.strip():
+        yield history, ""
+        return
+    
+    user_history = history + [{"role": "user", "content": message}]
+    # 已经收到的部分内容，失败时保留
+    partial = []
+    for ok, content, stats in stream_chat(message, history, api_token, model, system_prompt, max_tokens, temperature):
+        if ok is None:
+            # 先显示用户消息并清空输入框，再逐步更新回复（使用messages格式）
+            partial = _build_reply(*content) if any(content) else []
+            yield user_history + partial, ""
+        elif ok:
+            yield user_history + _build_reply(*content) + [_timing_message(stats)], ""
+        elif not stats:
+            yield history + [{"role": "assistant", "content": content}], ""
+        else:
+            yield user_history + partial + [{"role": "assistant", "content": content}, _timing_message(stats)], ""
 
 def clear_chat():
     """清空对话历史"""
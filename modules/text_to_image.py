@@ -3,151 +3,116 @@
 处理文本到图像的生成功能
 """
 
-import json
-import time
-import requests
-from PIL import Image
-from io import BytesIO
-from .common import load_config, make_api_request_with_retry
+import asyncio
+import random
+from .common import load_config
+from .generation import generate_result_image
+from .scheduler import QueueFullError, scheduled_slot, ANONYMOUS_SESSION
+from .tracing import start_trace, append_breakdown
 
-def generate_image(api_token, model, prompt, negative_prompt, width, height, steps, guidance, seed, include_metadata=True):
-    """文生图功能"""
-    config = load_config()
+async def _generate_one(api_token, config, model, prompt, negative_prompt, width, height, steps, guidance, seed, include_metadata):
+    """提交单个文生图任务并下载结果，返回 (图像, 任务ID, 错误信息, 是否命中缓存)"""
+    payload = {
+        'model': model,
+        'prompt': prompt,
+        'size': f"{width}x{height}",
+        'steps': steps,
+        'guidance': guidance,
+        'seed': seed
+    }
     
-    if not api_token:
-        return None, "请提供有效的API Token"
+    if negative_prompt.strip():
+        payload['negative_prompt'] = negative_prompt
     
-    try:
-        payload = {
+    # 添加元数据到图像（任务ID在任务完成后补充）
+    metadata = None
+    if include_metadata:
+        metadata = {
             'model': model,
             'prompt': prompt,
-            'size': f"{width}x{height}",
+            'negative_prompt': negative_prompt,
+            'width': width,
+            'height': height,
             'steps': steps,
             'guidance': guidance,
             'seed': seed
         }
-        
-        if negative_prompt.strip():
-            payload['negative_prompt'] = negative_prompt
-        
-        url = 'https://api-inference.modelscope.cn/v1/images/generations'
-        
-        headers = {
-            'Authorization': f'Bearer {api_token}',
-            'Content-Type': 'application/json',
-            'X-ModelScope-Async-Mode': 'true'
-        }
-        
-        response = make_api_request_with_retry(
-            url=url,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=int(config.get("timeout", 720)),
-            max_retries=2,
-            base_delay=3,
-            method='post'
-        )
-        
-        if not response:
-            return None, "API请求失败: 网络连接问题"
-        
-        if response.status_code != 200:
-            return None, f"API请求失败: {response.status_code}, {response.text}"
-        
-        task_data = response.json()
-        if 'task_id' not in task_data:
-            return None, f"API响应格式错误: {task_data}"
-        
-        task_id = task_data['task_id']
-        print(f"任务已提交，任务ID: {task_id}")
-        
-        # 轮询任务状态
-        max_wait_seconds = max(60, int(config.get('timeout', 720)))
-        start_time = time.time()
-        check_interval = 3
-        
-        while time.time() - start_time < max_wait_seconds:
-            time.sleep(check_interval)
-            
-            status_response = make_api_request_with_retry(
-                url=f'https://api-inference.modelscope.cn/v1/tasks/{task_id}',
-                headers={
-                    'Authorization': f'Bearer {api_token}',
-                    'X-ModelScope-Task-Type': 'image_generation'
-                },
-                method='get',
-                timeout=int(config.get("timeout", 720))
+    
+    return await generate_result_image(api_token, payload, config, metadata)
+
+async def generate_image(api_token, model, prompt, negative_prompt, width, height, steps, guidance, seed, include_metadata=True):
+    """文生图功能"""
+    config = load_config()
+    
+    if not api_token:
+        return None, "请提供有效的API Token"
+    
+    with start_trace('generate_image', model=model):
+        try:
+            result_image, task_id, error, cached = await _generate_one(
+                api_token, config, model, prompt, negative_prompt, width, height, steps, guidance, seed, include_metadata
             )
+            if error:
+                return None, append_breakdown(error)
             
-            if not status_response:
-                continue
-                
-            if status_response.status_code != 200:
-                continue
-                
-            status_data = status_response.json()
-            status = status_data.get('task_status')
+            if cached:
+                return result_image, append_breakdown(f"图像生成成功（命中缓存）！任务ID: {task_id}")
+            return result_image, append_breakdown(f"图像生成成功！任务ID: {task_id}")
             
-            if status == 'SUCCEED':
-                output_images = status_data.get('output_images', [])
-                if not output_images:
-                    return None, "任务成功但无输出图像"
-                
-                # 下载生成的图片
-                img_url = output_images[0]
-                img_response = requests.get(img_url, timeout=int(config.get("image_download_timeout", 30)))
-                
-                if img_response.status_code == 200:
-                    img_data = BytesIO(img_response.content)
-                    result_image = Image.open(img_data)
-                    
-                    # 添加元数据到图像
-                    if include_metadata:
-                        metadata = {
-                            'model': model,
-                            'prompt': prompt,
-                            'negative_prompt': negative_prompt,
-                            'width': width,
-                            'height': height,
-                            'steps': steps,
-                            'guidance': guidance,
-                            'seed': seed,
-                            'task_id': task_id
-                        }
-                        
-                        # 将元数据转换为JSON字符串并添加到EXIF数据中
-                        metadata_json = json.dumps(metadata, ensure_ascii=False)
-                        
-                        # 保存图像到内存并重新加载以添加EXIF数据
-                        img_buffer = BytesIO()
-                        result_image.save(img_buffer, format='PNG', exif=result_image.getexif())
-                        
-                        # 重新加载图像并添加自定义EXIF标签
-                        from PIL.ExifTags import TAGS
-                        exif_dict = result_image.getexif()
-                        
-                        # 使用自定义标签存储元数据（使用私有标签范围）
-                        # 0x927C 是 MakerNote 标签，常用于存储自定义数据
-                        exif_dict[0x927C] = metadata_json.encode('utf-8')
-                        
-                        # 保存带有EXIF数据的图像
-                        img_buffer_with_exif = BytesIO()
-                        result_image.save(img_buffer_with_exif, format='PNG', exif=exif_dict)
-                        img_buffer_with_exif.seek(0)
-                        result_image = Image.open(img_buffer_with_exif)
-                    
-                    return result_image, f"图像生成成功！任务ID: {task_id}"
-                else:
-                    return None, f"图片下载失败: {img_response.status_code}"
-            
-            elif status == 'FAILED':
-                error_info = status_data.get('errors', {})
-                return None, f"任务失败: {error_info.get('message', 'Unknown error')}"
-            
-            elif status == 'PENDING' or status == 'RUNNING':
-                continue
-        
-        return None, "任务轮询超时，请稍后重试"
+        except Exception as e:
+            return None, append_breakdown(f"处理过程中发生错误: {str(e)}")
+
+def derive_batch_seeds(seed, batch_count):
+    """为批量生成派生种子：固定种子依次递增，-1时从随机起点递增"""
+    base_seed = int(seed)
+    if base_seed == -1:
+        base_seed = random.randint(0, 2**31 - 1 - batch_count)
+    return [base_seed + i for i in range(batch_count)]
+
+async def generate_image_batch(api_token, model, prompt, negative_prompt, width, height, steps, guidance, seed, include_metadata=True, batch_count=1,
+                               session=ANONYMOUS_SESSION):
+    """批量文生图：并发提交多个任务，每完成一个就输出到画廊
+
+    每张图各自在image_generation任务池中排队，批量任务与单张任务一起受并发上限约束。
+    """
+    config = load_config()
+    
+    if not api_token:
+        yield [], "请提供有效的API Token"
+        return
+    
+    batch_count = max(1, int(batch_count))
+    seeds = derive_batch_seeds(seed, batch_count)
+    
+    # 限制同时进行中的任务数
+    semaphore = asyncio.Semaphore(max(1, int(config.get("batch_max_concurrency", 4))))
+    
+    async def run(task_seed):
+        async with semaphore:
+            try:
+                async with scheduled_slot('image_generation', session, model=model):
+                    result = await _generate_one(
+                        api_token, config, model, prompt, negative_prompt, width, height, steps, guidance, task_seed, include_metadata
+                    )
+            except QueueFullError as e:
+                result = None, None, str(e), False
+            except Exception as e:
+                result = None, None, f"处理过程中发生错误: {str(e)}", False
+            return (task_seed,) + result
+    
+    gallery = []
+    errors = []
+    yield gallery, f"已提交 {batch_count} 个任务，种子: {seeds[0]} ~ {seeds[-1]}"
+    
+    for finished in asyncio.as_completed([run(task_seed) for task_seed in seeds]):
+        task_seed, result_image, task_id, error, _ = await finished
+        if error:
+            errors.append(f"种子 {task_seed}: {error}")
+        else:
+            gallery.append((result_image, f"seed {task_seed}"))
         
-    except Exception as e:
-        return None, f"处理过程中发生错误: {str(e)}"
\ No newline at end of file
+        done = len(gallery) + len(errors)
+        message = f"进度 {done}/{batch_count}，成功 {len(gallery)} 张"
+        if errors:
+            message += "\n" + "\n".join(errors)
+        yield list(gallery), message
\ No newline at end of file
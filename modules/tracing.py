@@ -0,0 +1,198 @@
+"""
+链路追踪模块
+基于contextvar记录一次请求中各阶段的耗时，生成可附加到状态信息中的耗时明细；
+配置了tracing_otlp_endpoint且安装了OpenTelemetry时，同时导出到本地Collector
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 阶段名 -> 耗时明细中显示的名称
+STAGE_LABELS = {
+    'queue_wait': '排队',
+    'rate_limit': '限流等待',
+    'encode': '编码',
+    'upload': '上传',
+    'submit': '提交',
+    'poll': '等待结果',
+    'download': '下载',
+    'metadata_embed': '写入元数据',
+    'first_token': '首字',
+    'stream': '生成',
+}
+
+SERVICE_NAME = 'modelscope-api-webui'
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+# 调度器记录的排队耗时，由随后开始的追踪读取
+_queue_wait = contextvars.ContextVar('queue_wait', default=None)
+
+
+class Trace:
+    """一次请求的追踪记录，各阶段以 (名称, 开始, 结束, 属性) 保存"""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started = time.monotonic()
+        self.started_ns = time.time_ns()
+        self.ended = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, **attributes):
+        with self._lock:
+            self.spans.append((name, start, end, attributes))
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """记录代码块的耗时，异常退出时同样记录"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.monotonic(), **attributes)
+
+    def finish(self):
+        if self.ended is None:
+            self.ended = time.monotonic()
+
+    def breakdown(self):
+        """各阶段耗时明细，同名阶段（如批量中的多个任务）累加"""
+        totals = {}
+        with self._lock:
+            for name, start, end, _ in self.spans:
+                totals[name] = totals.get(name, 0.0) + (end - start)
+        total = (self.ended or time.monotonic()) - self.started
+        parts = [f"{STAGE_LABELS.get(name, name)} {seconds:.2f}s" for name, seconds in totals.items()]
+        parts.append(f"总计 {total:.2f}s")
+        return "⏱️ " + " · ".join(parts)
+
+    def _ns(self, monotonic_time):
+        return self.started_ns + int((monotonic_time - self.started) * 1e9)
+
+
+def current_trace():
+    """当前上下文中的追踪记录，没有则返回None"""
+    return _current_trace.get()
+
+
+def new_trace(name, **attributes):
+    """创建追踪记录但不绑定到当前上下文
+
+    用于在线程中分步执行的同步生成器：每一步可能运行在不同的上下文中，
+    只能显式地通过Trace对象记录阶段，结束时调用finish_trace。
+    如果调度器已记录了本次请求的排队耗时，会作为queue_wait阶段加入。
+    """
+    trace = Trace(name, **attributes)
+    queue_wait = _queue_wait.get()
+    if queue_wait is not None:
+        trace.add_span('queue_wait', trace.started - queue_wait, trace.started)
+        trace.started -= queue_wait
+        trace.started_ns -= int(queue_wait * 1e9)
+    return trace
+
+
+def finish_trace(trace):
+    """结束追踪并按配置导出（重复调用时只导出一次）"""
+    if trace.ended is not None:
+        return
+    trace.finish()
+    _export(trace)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """开始一次请求的追踪并绑定到当前上下文，退出时结束并按配置导出"""
+    trace = new_trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        finish_trace(trace)
+
+
+@contextmanager
+def span(name, **attributes):
+    """在当前追踪中记录一个阶段；没有进行中的追踪时只执行代码块"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **attributes):
+        yield
+
+
+def record_queue_wait(seconds):
+    """记录本次请求在调度器中的排队耗时"""
+    _queue_wait.set(seconds)
+
+
+_tracer = None
+_tracer_endpoint = None
+_tracer_lock = threading.Lock()
+
+
+def _get_tracer():
+    """按配置创建OpenTelemetry Tracer，未配置或未安装时返回None"""
+    global _tracer, _tracer_endpoint
+    from .common import load_config
+
+    endpoint = load_config().get("tracing_otlp_endpoint") or ''
+    if not endpoint:
+        return None
+
+    with _tracer_lock:
+        if _tracer_endpoint == endpoint:
+            return _tracer
+        _tracer_endpoint = endpoint
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("⚠️ 警告: 已配置tracing_otlp_endpoint，但未安装OpenTelemetry，追踪数据不会导出")
+            print("建议运行: pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http")
+            _tracer = None
+            return None
+
+        provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        _tracer = provider.get_tracer(SERVICE_NAME)
+        return _tracer
+
+
+def _export(trace):
+    """请求结束后按记录的时间补建OpenTelemetry span，不依赖跨线程的上下文传播"""
+    try:
+        tracer = _get_tracer()
+        if tracer is None:
+            return
+        from opentelemetry.trace import set_span_in_context
+
+        root = tracer.start_span(trace.name, start_time=trace.started_ns, attributes=_otel_attributes(trace.attributes))
+        parent = set_span_in_context(root)
+        with trace._lock:
+            spans = list(trace.spans)
+        for name, start, end, attributes in spans:
+            child = tracer.start_span(name, context=parent, start_time=trace._ns(start), attributes=_otel_attributes(attributes))
+            child.end(end_time=trace._ns(end))
+        root.end(end_time=trace._ns(trace.ended))
+    except Exception as e:
+        print(f"⚠️ 导出追踪数据失败: {e}")
+
+
+def _otel_attributes(attributes):
+    return {key: value if isinstance(value, (str, bool, int, float)) else str(value) for key, value in attributes.items()}
+
+
+def append_breakdown(message):
+    """在状态信息后附加当前追踪的耗时明细"""
+    trace = _current_trace.get()
+    if trace is None:
+        return message
+    return f"{message}\n{trace.breakdown()}"
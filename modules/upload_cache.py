@@ -0,0 +1,110 @@
+"""
+上传缓存模块
+按图片内容哈希记录已上传到临时CDN的URL，在有效期内重复编辑同一张图时跳过上传
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .file_lock import file_lock
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.upload_cache.json')
+
+# 缓存条目数上限，超出时淘汰最早上传的条目
+MAX_ENTRIES = 1000
+
+
+def content_digest(data):
+    """计算图片字节的内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class UploadCache:
+    """内容哈希 -> CDN URL 的持久化映射，条目超过有效期后失效"""
+
+    def __init__(self, cache_file=CACHE_FILE):
+        self._cache_file = cache_file
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _read_file(self):
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return {}
+        try:
+            with open(self._cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ 读取上传缓存失败: {e}")
+            return {}
+
+    def _load(self):
+        self._entries = self._read_file()
+
+    def _save(self, ttl):
+        """在文件锁内合并其他进程（WebUI或HTTP服务）写入的条目，清理过期条目后写入（需持有锁）"""
+        if not self._cache_file:
+            self._prune(ttl, time.time())
+            return
+        try:
+            with file_lock(self._cache_file):
+                merged = self._read_file()
+                for digest, entry in self._entries.items():
+                    existing = merged.get(digest)
+                    if existing is None or entry['uploaded_at'] > existing['uploaded_at']:
+                        merged[digest] = entry
+                self._entries = merged
+                self._prune(ttl, time.time())
+
+                tmp_file = self._cache_file + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_file, self._cache_file)
+        except Exception as e:
+            print(f"⚠️ 保存上传缓存失败: {e}")
+
+    def _prune(self, ttl, now):
+        """删除过期条目，并把条目数限制在上限内"""
+        expired = [digest for digest, entry in self._entries.items() if now - entry['uploaded_at'] > ttl]
+        for digest in expired:
+            del self._entries[digest]
+
+        if len(self._entries) > MAX_ENTRIES:
+            ordered = sorted(self._entries.items(), key=lambda item: item[1]['uploaded_at'])
+            for digest, _ in ordered[:len(self._entries) - MAX_ENTRIES]:
+                del self._entries[digest]
+
+    def get(self, digest, ttl):
+        """查询仍在有效期内的URL，没有则返回None"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if time.time() - entry['uploaded_at'] > ttl:
+                del self._entries[digest]
+                self._save(ttl)
+                return None
+            return entry['url']
+
+    def put(self, digest, url, ttl):
+        """记录一次成功的上传"""
+        with self._lock:
+            self._entries[digest] = {'url': url, 'uploaded_at': time.time()}
+            self._save(ttl)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_upload_cache():
+    """获取进程级共享的上传缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UploadCache()
+    return _cache
@@ -11,7 +11,7 @@ TLDRAW_URL = "https://www.tldraw.com/"
 IFRAME_HEIGHT = 700
 IFRAME_WIDTH = "100%"
 
-def create_whiteboard_tab(config, saved_token):
+def create_whiteboard_tab(config):
     """创建手绘白板标签页"""
     with gr.Tab("手绘白板"):
         with gr.Row():
@@ -0,0 +1,111 @@
+"""
+无界面HTTP服务的Token校验测试
+"""
+
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import api_server
+
+
+def _get_status(app, headers=None):
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get('/v1/jobs/missing', headers=headers)
+            return response.status, await response.json()
+    return asyncio.run(run())
+
+
+def test_missing_bearer_token_is_rejected(monkeypatch):
+    monkeypatch.setattr(api_server, 'load_api_token', lambda: 'saved-token')
+
+    status, body = _get_status(api_server.create_app())
+
+    assert status == 401
+    assert 'Authorization' in body['error']
+
+
+def test_saved_token_is_used_only_when_allowed(monkeypatch):
+    monkeypatch.setattr(api_server, 'load_api_token', lambda: 'saved-token')
+
+    status, _ = _get_status(api_server.create_app(allow_saved_token=True))
+
+    # 通过了Token校验，任务不存在
+    assert status == 404
+
+
+def test_bearer_token_is_accepted():
+    status, _ = _get_status(api_server.create_app(), headers={'Authorization': 'Bearer token'})
+
+    assert status == 404
+
+
+def _run_job(run, *args):
+    job = api_server.Job('chat', 'model', 'owner')
+    asyncio.run(run(job, *args))
+    return job
+
+
+def test_chat_job_uses_structured_result(monkeypatch):
+    def stream_chat(message, history, *args):
+        yield None, ('', '对话失败'), ''
+        yield True, ('think', '对话失败只是回答的开头'), 'timing'
+    monkeypatch.setattr(api_server, 'stream_chat', stream_chat)
+
+    job = _run_job(api_server._run_chat_job, 'token', 'hi', [], 'system', 100, 0.7)
+
+    assert job.status == api_server.SUCCEEDED
+    assert job.output['content'] == '对话失败只是回答的开头'
+    assert job.output['reasoning'] == 'think'
+    assert job.output['history'][-1] == {'role': 'assistant', 'content': '对话失败只是回答的开头'}
+
+
+def test_vision_job_reports_failure(monkeypatch):
+    def stream_image_analysis(*args):
+        yield False, '图像分析失败: boom', 'timing'
+    monkeypatch.setattr(api_server, 'stream_image_analysis', stream_image_analysis)
+
+    job = _run_job(api_server._run_vision_job, 'token', None, 'prompt', 100, 0.7)
+
+    assert job.status == api_server.FAILED
+    assert job.error == '图像分析失败: boom'
+
+
+def _post(path, body):
+    async def run():
+        async with TestClient(TestServer(api_server.create_app())) as client:
+            response = await client.post(path, json=body, headers={'Authorization': 'Bearer token'})
+            return response.status, await response.json()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('body, field', [
+    ({'width': 'wide'}, 'width'),
+    ({'steps': 2.5}, 'steps'),
+    ({'height': 0}, 'height'),
+    ({'guidance': 'nan'}, 'guidance'),
+    ({'seed': True}, 'seed'),
+    ({'include_metadata': 'yes'}, 'include_metadata'),
+])
+def test_malformed_generation_fields_are_rejected_before_submitting(monkeypatch, body, field):
+    monkeypatch.setattr(api_server, 'load_config', lambda: {})
+
+    status, response = _post('/v1/images/generations', body)
+
+    assert status == 400
+    assert field in response['error']
+
+
+def test_boolean_fields_accept_false_strings():
+    assert api_server._bool_field({'adaptive_ratio': 'false'}, 'adaptive_ratio', True) is False
+    assert api_server._bool_field({}, 'adaptive_ratio', True) is True
+    assert api_server._int_field({'width': 512.0}, 'width', 1) == 512
+
+
+def test_chat_requires_string_message(monkeypatch):
+    monkeypatch.setattr(api_server, 'load_config', lambda: {})
+
+    assert _post('/v1/chat', {'message': 5})[0] == 400
+    assert _post('/v1/chat', {'message': 'hi', 'max_tokens': 'many'})[0] == 400
@@ -0,0 +1,157 @@
+"""
+熔断器测试：关闭/打开/半开状态转换、半开时只放行一个探测请求、错误分类
+"""
+
+import time
+
+import pytest
+
+from modules import circuit_breaker
+from modules.circuit_breaker import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, is_upstream_failure, record_upstream_error
+)
+
+RECOVERY = 0.05
+
+
+def open_breaker(threshold=2):
+    breaker = CircuitBreaker('api.example.com', failure_threshold=threshold, recovery_seconds=RECOVERY)
+    for _ in range(threshold):
+        breaker.before_call()
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('api.example.com', failure_threshold=3, recovery_seconds=RECOVERY)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker('api.example.com', failure_threshold=2, recovery_seconds=RECOVERY)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_single_probe():
+    breaker = open_breaker()
+    time.sleep(RECOVERY * 1.2)
+
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_probe_closes():
+    breaker = open_breaker()
+    time.sleep(RECOVERY * 1.2)
+    breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_probe_reopens():
+    breaker = open_breaker(threshold=5)
+    time.sleep(RECOVERY * 1.2)
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_released_probe_lets_next_request_probe():
+    breaker = open_breaker()
+    time.sleep(RECOVERY * 1.2)
+    breaker.before_call()
+
+    breaker.release_probe()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+@pytest.mark.parametrize('error, expected', [
+    (StatusError(500), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (StatusError(429), False),
+    (ConnectionError(), True),
+    (TimeoutError(), True),
+    (APIConnectionError(), True),
+    (ValueError(), False),
+])
+def test_is_upstream_failure(error, expected):
+    assert is_upstream_failure(error) is expected
+
+
+@pytest.fixture
+def half_open_breaker(monkeypatch):
+    breaker = open_breaker()
+    time.sleep(RECOVERY * 1.2)
+    breaker.before_call()
+    monkeypatch.setattr(circuit_breaker, 'get_circuit_breaker', lambda url: breaker)
+    return breaker
+
+
+def test_client_error_response_closes_half_open_breaker(half_open_breaker):
+    record_upstream_error('https://api.example.com/v1', StatusError(400))
+    assert half_open_breaker.state == CLOSED
+
+
+def test_upstream_error_reopens_half_open_breaker(half_open_breaker):
+    record_upstream_error('https://api.example.com/v1', StatusError(502))
+    assert half_open_breaker.state == OPEN
+
+
+def test_local_error_releases_probe(half_open_breaker):
+    record_upstream_error('https://api.example.com/v1', ValueError('bad image'))
+    assert half_open_breaker.state == HALF_OPEN
+    half_open_breaker.before_call()
+
+
+def test_upload_timeout_counts_as_failure(monkeypatch):
+    import requests
+    from modules import image_edit
+
+    breaker = CircuitBreaker('upload', failure_threshold=1, recovery_seconds=60)
+    calls = []
+
+    def hanging_upload(method, url, **kwargs):
+        calls.append(kwargs.get('timeout'))
+        raise requests.exceptions.ReadTimeout()
+    monkeypatch.setattr(image_edit, 'get_circuit_breaker', lambda url: breaker)
+    monkeypatch.setattr(image_edit, 'http_request', hanging_upload)
+
+    image_url, error = image_edit.upload_image(b'data', 'image.jpg', 'image/jpeg', timeout=5)
+
+    assert image_url is None
+    assert '5秒内未响应' in error
+    assert calls == [5]
+    assert breaker.state == OPEN
+    # 熔断后直接失败，不再发起上传
+    assert image_edit.upload_image(b'data', 'image.jpg', 'image/jpeg')[0] is None
+    assert len(calls) == 1
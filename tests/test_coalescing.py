@@ -0,0 +1,98 @@
+"""
+相同参数任务合并测试：共享任务不随发起请求的取消而中止
+"""
+
+import asyncio
+
+import pytest
+
+from modules import generation
+from modules.generation import _run_coalesced
+
+
+def test_followers_share_one_task():
+    calls = []
+
+    async def start_task():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'task-1', 'url', None
+
+    async def main():
+        return await asyncio.gather(*(_run_coalesced('k', start_task) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [shared for _, shared in results] == [False, True, True]
+    assert all(result == ('task-1', 'url', None) for result, _ in results)
+    assert 'k' not in generation._inflight_tasks
+
+
+def test_cancelled_leader_does_not_fail_followers():
+    release = None
+
+    async def start_task():
+        await release.wait()
+        return 'task-1', 'url', None
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        leader = asyncio.create_task(_run_coalesced('k', start_task))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(_run_coalesced('k', start_task))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert 'k' in generation._inflight_tasks
+
+        release.set()
+        return await follower
+
+    assert asyncio.run(main()) == (('task-1', 'url', None), True)
+    assert 'k' not in generation._inflight_tasks
+
+
+def test_errors_reach_every_waiter_and_clear_the_key():
+    async def start_task():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('boom')
+
+    async def main():
+        return await asyncio.gather(
+            _run_coalesced('k', start_task), _run_coalesced('k', start_task), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert 'k' not in generation._inflight_tasks
+
+
+def test_different_tokens_are_not_coalesced(monkeypatch):
+    class Journal:
+        def find_pending(self, task_key, api_token):
+            return None
+
+    async def run_image_task(api_token, payload, config, metadata, task_key, handler):
+        await asyncio.sleep(0.01)
+        if api_token == 'bad':
+            return None, None, 'API请求失败: 401'
+        return 'task-good', None, '下载前停止'
+
+    monkeypatch.setattr(generation, 'get_task_journal', lambda: Journal())
+    monkeypatch.setattr(generation, 'run_image_task', run_image_task)
+    payload = {'model': 'm', 'prompt': 'p', 'seed': 42, 'steps': 30, 'guidance': 7.5}
+    config = {'result_cache_enabled': False}
+
+    async def main():
+        return await asyncio.gather(
+            generation.generate_result_image('bad', payload, config),
+            generation.generate_result_image('good', payload, config),
+        )
+
+    bad, good = asyncio.run(main())
+    assert bad[2] == 'API请求失败: 401'
+    assert good[1:3] == ('task-good', '下载前停止')
+    assert generation._inflight_tasks == {}
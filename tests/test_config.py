@@ -0,0 +1,54 @@
+"""
+配置校验测试：类型错误、按后缀校验的未知项和数值范围只忽略对应项，不影响整个配置
+"""
+
+import pytest
+
+from modules.common import validate_config
+
+
+def test_valid_config_is_kept():
+    data = {'timeout': 720, 'concurrency_chat': 8, 'image_models': ['a'], 'upload_max_edge_per_model': {'a': 0}}
+
+    assert validate_config(data) == (data, [])
+
+
+@pytest.mark.parametrize('key, value', [
+    ('foo_models', 5),
+    ('foo_models', ['a', 1]),
+    ('foo_per_model', 5),
+    ('foo_per_model', {'a': 'big'}),
+    ('vision_max_edge_per_model', {'a': -1}),
+])
+def test_bad_suffix_keys_are_ignored_without_aborting(key, value):
+    valid, warnings = validate_config({key: value, 'timeout': 30})
+
+    assert valid == {'timeout': 30}
+    assert len(warnings) == 1 and key in warnings[0]
+
+
+@pytest.mark.parametrize('key, value', [
+    ('concurrency_image_generation', 0),
+    ('concurrency_custom_pool', -1),
+    ('rate_limit_per_second', 0),
+    ('rate_limit_burst', 0),
+    ('queue_max_size', -5),
+    ('poll_min_interval', 0.0),
+    ('upload_max_bytes', -1),
+])
+def test_out_of_range_values_fall_back_to_defaults(key, value):
+    valid, warnings = validate_config({key: value})
+
+    assert valid == {}
+    assert key in warnings[0]
+
+
+def test_zero_disables_optional_limits():
+    data = {'upload_max_edge': 0, 'upload_max_bytes': 0, 'vision_max_edge': 0}
+
+    assert validate_config(data) == (data, [])
+
+
+def test_top_level_must_be_an_object():
+    with pytest.raises(ValueError):
+        validate_config([])
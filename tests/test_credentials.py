@@ -0,0 +1,80 @@
+"""
+凭据存储测试：值未变化时不写盘、文件修改后重新读取、原子写入
+"""
+
+import builtins
+import os
+
+import pytest
+
+from modules import credentials
+from modules.credentials import CredentialStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CredentialStore(str(tmp_path / '.api_token'), str(tmp_path / '.token_key'))
+
+
+def test_round_trip_without_storing_plaintext(store):
+    assert store.load() == ""
+    assert store.save('secret-token') is True
+
+    assert store.load() == 'secret-token'
+    with open(store.token_file, 'rb') as f:
+        assert b'secret-token' not in f.read()
+
+
+def test_unchanged_value_is_not_written(store):
+    store.save('token')
+    mtime = os.stat(store.token_file).st_mtime_ns
+
+    assert store.save('token') is False
+    assert os.stat(store.token_file).st_mtime_ns == mtime
+    assert store.save('other') is True
+
+
+def test_load_uses_memory_until_file_changes(store, monkeypatch):
+    store.save('token')
+    reads = []
+
+    def counting_open(path, *args, **kwargs):
+        reads.append(path)
+        return builtins.open(path, *args, **kwargs)
+    monkeypatch.setattr(credentials, 'open', counting_open, raising=False)
+
+    assert store.load() == 'token'
+    assert reads == []
+
+    # 另一个进程（或实例）写入了新Token
+    CredentialStore(store.token_file, store.key_file).save('new-token')
+    stat = os.stat(store.token_file)
+    os.utime(store.token_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert store.load() == 'new-token'
+    assert store.token_file in reads
+
+
+def test_failed_write_keeps_old_file_and_leaves_no_temp_files(store, monkeypatch):
+    store.save('token')
+
+    def failing_replace(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(credentials.os, 'replace', failing_replace)
+
+    with pytest.raises(OSError):
+        store.save('other')
+    monkeypatch.undo()
+
+    assert CredentialStore(store.token_file, store.key_file).load() == 'token'
+    directory = os.path.dirname(store.token_file)
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+
+def test_delete_removes_both_files(store):
+    store.save('token')
+
+    assert store.delete() is True
+    assert store.load() == ""
+    assert not os.path.exists(store.key_file)
+    assert store.delete() is False
@@ -0,0 +1,97 @@
+"""
+上传预处理测试：缩放尺寸、字节预算下的质量选择，以及无需处理时直接上传原始字节
+"""
+
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from modules.image_edit import (
+    UPLOAD_QUALITY_STEPS, _encode, encode_upload_image, encode_within_budget, load_input_image, upload_size
+)
+
+
+def noise_image(size=(256, 256)):
+    """随机像素的图像，编码大小随质量明显变化"""
+    data = random.Random(0).randbytes(size[0] * size[1] * 3)
+    return Image.frombytes('RGB', size, data)
+
+
+def png_bytes(size=(64, 48)):
+    buffer = BytesIO()
+    noise_image(size).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('size, target, max_edge, expected', [
+    ((4000, 3000), (1024, 768), 2048, (1024, 768)),    # 同比例：缩放到目标尺寸
+    ((4000, 2000), (1024, 1024), 2048, (2048, 1024)),  # 不同比例：刚好覆盖目标，短边等于目标
+    ((4000, 3000), (4000, 3000), 2048, (2048, 1536)),  # 长边不超过max_edge
+    ((4000, 3000), (4000, 3000), 0, None),             # max_edge为0表示不限制
+    ((800, 600), (1024, 768), 2048, None),             # 不放大
+])
+def test_upload_size(size, target, max_edge, expected):
+    assert upload_size(size, target, max_edge) == expected
+
+
+def test_highest_quality_is_used_when_within_budget():
+    image = noise_image()
+
+    data, quality = encode_within_budget(image, 'JPEG', None)
+
+    assert quality == UPLOAD_QUALITY_STEPS[-1]
+    assert data == _encode(image, 'JPEG', quality)
+
+
+def test_budget_selects_the_highest_quality_that_fits():
+    image = noise_image()
+    sizes = {quality: len(_encode(image, 'JPEG', quality)) for quality in UPLOAD_QUALITY_STEPS}
+    budget = sizes[70] + 1
+
+    data, quality = encode_within_budget(image, 'JPEG', budget)
+
+    assert len(data) <= budget
+    assert quality == max(q for q, size in sizes.items() if size <= budget)
+
+
+def test_lowest_quality_is_returned_when_nothing_fits():
+    data, quality = encode_within_budget(noise_image(), 'JPEG', 100)
+
+    assert quality == UPLOAD_QUALITY_STEPS[0]
+    assert len(data) > 100
+
+
+def test_original_bytes_are_forwarded_when_no_transform_is_needed():
+    original = png_bytes()
+    image, original_bytes = load_input_image(original)
+
+    data, filename, mime_type = encode_upload_image(
+        image, original_bytes, target_size=(64, 48), max_edge=2048, max_bytes=len(original)
+    )
+
+    assert data is original_bytes
+    assert (filename, mime_type) == ('image.png', 'image/png')
+
+
+def test_oversized_original_is_reencoded():
+    original = png_bytes()
+    image, original_bytes = load_input_image(original)
+
+    data, filename, mime_type = encode_upload_image(
+        image, original_bytes, target_size=(64, 48), max_edge=2048, max_bytes=len(original) - 1, upload_format='webp'
+    )
+
+    assert (filename, mime_type) == ('image.webp', 'image/webp')
+    assert Image.open(BytesIO(data)).size == (64, 48)
+
+
+def test_downscaled_upload_covers_the_target_size():
+    original = png_bytes((400, 200))
+    image, original_bytes = load_input_image(original)
+
+    data, filename, _ = encode_upload_image(image, original_bytes, target_size=(100, 100), max_edge=2048)
+
+    assert filename == 'image.jpg'
+    assert Image.open(BytesIO(data)).size == (200, 100)
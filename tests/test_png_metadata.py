@@ -0,0 +1,88 @@
+"""
+PNG元数据写入测试：插入的eXIf块能被PIL读回，且所有数据块的CRC有效
+"""
+
+import json
+import struct
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+from modules.generation import METADATA_EXIF_TAG, PNG_SIGNATURE, embed_metadata_file
+
+METADATA = {'model': 'Qwen/Qwen-Image', 'prompt': '山水画 A landscape', 'seed': 42, 'task_id': 't-1'}
+
+
+def make_png(exif=None):
+    image = Image.new('RGB', (64, 48))
+    image.putdata([(x * 4 % 256, y * 5 % 256, 128) for y in range(48) for x in range(64)])
+    buffer = BytesIO()
+    if exif is not None:
+        image.save(buffer, format='PNG', exif=exif)
+    else:
+        image.save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def read_chunks(data):
+    """解析PNG数据块，返回 [(类型, 数据, CRC是否有效)]"""
+    assert data[:len(PNG_SIGNATURE)] == PNG_SIGNATURE
+    chunks = []
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+        chunk_data = data[offset + 8:offset + 8 + length]
+        (crc,) = struct.unpack('>I', data[offset + 8 + length:offset + 12 + length])
+        chunks.append((chunk_type, chunk_data, crc == zlib.crc32(chunk_type + chunk_data) & 0xffffffff))
+        offset += 12 + length
+    return chunks
+
+
+def test_exif_round_trips_and_chunk_crcs_are_valid():
+    source = make_png()
+    original_pixels = Image.open(BytesIO(source.getvalue())).tobytes()
+
+    output = embed_metadata_file(source, METADATA, {}).read()
+
+    chunks = read_chunks(output)
+    assert all(valid for _, _, valid in chunks)
+    types = [chunk_type for chunk_type, _, _ in chunks]
+    assert types[:2] == [b'IHDR', b'eXIf']
+    assert types.count(b'eXIf') == 1
+    assert types[-1] == b'IEND'
+
+    reopened = Image.open(BytesIO(output))
+    assert json.loads(reopened.getexif()[METADATA_EXIF_TAG].decode('utf-8')) == METADATA
+    assert reopened.tobytes() == original_pixels
+
+
+def test_existing_exif_is_replaced_and_other_tags_kept():
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera Maker'
+    exif[METADATA_EXIF_TAG] = b'old'
+    source = make_png(exif)
+
+    output = embed_metadata_file(source, METADATA, {}).read()
+
+    chunks = read_chunks(output)
+    assert all(valid for _, _, valid in chunks)
+    assert [chunk_type for chunk_type, _, _ in chunks].count(b'eXIf') == 1
+
+    reopened_exif = Image.open(BytesIO(output)).getexif()
+    assert reopened_exif[0x010F] == 'Camera Maker'
+    assert json.loads(reopened_exif[METADATA_EXIF_TAG].decode('utf-8')) == METADATA
+
+
+def test_non_png_result_is_written_as_png_with_metadata():
+    buffer = BytesIO()
+    Image.new('RGB', (32, 32), 'blue').save(buffer, format='JPEG')
+    buffer.seek(0)
+
+    output = embed_metadata_file(buffer, METADATA, {}).read()
+
+    assert all(valid for _, _, valid in read_chunks(output))
+    reopened = Image.open(BytesIO(output))
+    assert reopened.format == 'PNG'
+    assert json.loads(reopened.getexif()[METADATA_EXIF_TAG].decode('utf-8')) == METADATA
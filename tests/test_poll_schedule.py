@@ -0,0 +1,69 @@
+"""
+轮询调度测试：按耗时分位数安排查询间隔、上下限截断、样本不足时的回退
+"""
+
+import pytest
+
+from modules.poll_schedule import MIN_SAMPLES, PollSchedule
+
+CONFIG = {'poll_interval': 3, 'poll_min_interval': 1, 'poll_max_interval': 15}
+
+
+def schedule_with(durations, model='m', size='512x512'):
+    schedule = PollSchedule(history_file=None)
+    for duration in durations:
+        schedule.record(model, size, duration)
+    return schedule
+
+
+def test_estimate_uses_linear_percentiles():
+    early, median, late = schedule_with(range(10, 20)).estimate('m', '512x512')
+
+    assert early == pytest.approx(11.8)
+    assert median == pytest.approx(14.5)
+    assert late == pytest.approx(18.1)
+
+
+@pytest.mark.parametrize('elapsed, expected', [
+    (0, 11.8),    # 预计完成前：直接睡到20分位
+    (5, 6.8),
+    (11, 1.0),    # 离20分位不足最小间隔时按最小间隔
+    (15, 1.0),    # 20~90分位之间：密集查询
+    (20, 1.95),   # 超过90分位：按超出时间的一半退避
+    (100, 15.0),  # 退避不超过最大间隔
+])
+def test_delay_follows_percentile_phases(elapsed, expected):
+    schedule = schedule_with(range(10, 20))
+
+    assert schedule.next_delay('m', '512x512', elapsed, CONFIG) == pytest.approx(expected)
+
+
+def test_sleep_until_early_percentile_is_capped_at_max_interval():
+    schedule = schedule_with(range(100, 110))
+
+    assert schedule.next_delay('m', '512x512', 0, CONFIG) == 15.0
+
+
+def test_too_few_samples_fall_back_to_fixed_interval():
+    schedule = schedule_with([10] * (MIN_SAMPLES - 1))
+
+    assert schedule.estimate('m', '512x512') is None
+    assert schedule.next_delay('m', '512x512', 0, CONFIG) == 3.0
+    assert schedule.next_delay(None, '512x512', 0, CONFIG) == 3.0
+
+
+def test_other_sizes_fall_back_to_all_sizes_of_the_model():
+    schedule = schedule_with([10, 20, 30], size='1024x1024')
+
+    assert schedule.estimate('m', '512x512') == schedule.estimate('m', '1024x1024')
+    assert schedule.estimate('other', '1024x1024') is None
+
+
+def test_history_round_trips_through_flush(tmp_path):
+    history_file = str(tmp_path / 'history.json')
+    schedule = PollSchedule(history_file)
+    for duration in (10, 20, 30):
+        schedule.record('m', '512x512', duration)
+    schedule.flush()
+
+    assert PollSchedule(history_file).estimate('m', '512x512') == schedule.estimate('m', '512x512')
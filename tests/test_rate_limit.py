@@ -0,0 +1,112 @@
+"""
+限流器测试：令牌桶的突发与补充、Retry-After暂停窗口，以及429重试
+"""
+
+import time
+
+import pytest
+
+from modules import rate_limit
+from modules.rate_limit import TokenBucketLimiter, call_with_rate_limit, parse_retry_after
+
+
+def timed_acquire(limiter):
+    start = time.monotonic()
+    limiter.acquire()
+    return time.monotonic() - start
+
+
+def test_burst_is_available_immediately_then_refills_at_rate():
+    limiter = TokenBucketLimiter(rate_per_second=20, burst=3)
+
+    assert sum(timed_acquire(limiter) for _ in range(3)) < 0.02
+    # 桶已空，下一个令牌需要约1/20秒补充
+    assert 0.03 < timed_acquire(limiter) < 0.2
+
+
+def test_refill_is_capped_at_burst():
+    limiter = TokenBucketLimiter(rate_per_second=100, burst=2)
+    for _ in range(2):
+        limiter.acquire()
+    time.sleep(0.1)  # 足够补充10个令牌，但桶容量只有2
+
+    assert timed_acquire(limiter) + timed_acquire(limiter) < 0.02
+    assert timed_acquire(limiter) > 0.005
+
+
+def test_pause_blocks_until_window_ends_and_drains_tokens():
+    limiter = TokenBucketLimiter(rate_per_second=1000, burst=5)
+    limiter.pause(0.1)
+
+    assert 0.09 < limiter.paused_for() <= 0.1
+    assert timed_acquire(limiter) >= 0.09
+    assert limiter.paused_for() == 0.0
+
+
+def test_shorter_pause_does_not_shorten_window():
+    limiter = TokenBucketLimiter(rate_per_second=1000, burst=5)
+    limiter.pause(0.2)
+    limiter.pause(0.01)
+
+    assert limiter.paused_for() > 0.15
+
+
+def test_reconfigure_applies_new_burst():
+    limiter = TokenBucketLimiter(rate_per_second=1000, burst=10)
+    limiter.reconfigure(1000, 1)
+    limiter.acquire()
+
+    assert timed_acquire(limiter) > 0.0005
+
+
+@pytest.mark.parametrize('value, expected', [(None, 7), ('3', 3.0), ('-1', 0.0), ('soon', 7)])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value, 7) == expected
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    class response:
+        headers = {'retry-after': '0.05'}
+
+
+def test_call_with_rate_limit_retries_429_after_pause(monkeypatch):
+    limiter = TokenBucketLimiter(rate_per_second=1000, burst=5)
+    monkeypatch.setattr(rate_limit, 'get_rate_limiter', lambda api_token: limiter)
+    attempts = []
+
+    def request():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited()
+        return 'ok'
+
+    result, _ = call_with_rate_limit('token', request)
+
+    assert result == 'ok'
+    assert attempts[1] - attempts[0] >= 0.045
+
+
+def test_call_with_rate_limit_does_not_retry_other_errors(monkeypatch):
+    limiter = TokenBucketLimiter(rate_per_second=1000, burst=5)
+    monkeypatch.setattr(rate_limit, 'get_rate_limiter', lambda api_token: limiter)
+
+    def request():
+        raise ValueError('bad request')
+
+    with pytest.raises(ValueError):
+        call_with_rate_limit('token', request)
+
+
+def test_try_acquire_reports_wait_without_blocking():
+    limiter = TokenBucketLimiter(rate_per_second=10, burst=1)
+
+    assert limiter.try_acquire() == 0.0
+    start = time.monotonic()
+    wait = limiter.try_acquire()
+    assert time.monotonic() - start < 0.01
+    assert 0.05 < wait <= 0.1
+
+    limiter.pause(1)
+    assert limiter.try_acquire() > 0.9
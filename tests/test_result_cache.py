@@ -0,0 +1,78 @@
+"""
+结果缓存测试：命中时返回字节而不是打开的文件，最近使用时间批量写入索引
+"""
+
+import json
+import os
+from io import BytesIO
+
+from modules.result_cache import INDEX_FILE_NAME, ResultCache
+
+CONFIG = {'result_cache_max_entries': 2, 'result_cache_max_bytes': 1024}
+
+
+def read_index(cache_dir):
+    with open(os.path.join(cache_dir, INDEX_FILE_NAME), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_get_returns_bytes_and_task_id(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    source = BytesIO(b'png-bytes')
+    cache.put('a', source, 'task-a', CONFIG)
+
+    assert source.tell() == 0
+    assert cache.get('a') == (b'png-bytes', 'task-a')
+    assert cache.get('missing') is None
+
+
+def test_hits_are_batched_until_flush(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('a', BytesIO(b'x'), 'task-a', CONFIG)
+    saved_access = read_index(tmp_path)['a']['last_access']
+
+    cache.get('a')
+    assert read_index(tmp_path)['a']['last_access'] == saved_access
+
+    cache.flush()
+    assert read_index(tmp_path)['a']['last_access'] >= saved_access
+    assert not cache._dirty
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('a', BytesIO(b'1'), 'task-a', CONFIG)
+    cache.put('b', BytesIO(b'2'), 'task-b', CONFIG)
+    cache._entries['a']['last_access'] += 10
+    cache.put('c', BytesIO(b'3'), 'task-c', CONFIG)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == (b'1', 'task-a')
+    assert not os.path.exists(os.path.join(tmp_path, 'b.img'))
+
+
+def test_processes_sharing_a_directory_merge_their_entries(tmp_path):
+    # 两个实例模拟WebUI和HTTP服务两个进程
+    webui = ResultCache(str(tmp_path))
+    api = ResultCache(str(tmp_path))
+    config = {'result_cache_max_entries': 10, 'result_cache_max_bytes': 1024}
+    webui.put('a', BytesIO(b'1'), 'task-a', config)
+    api.put('b', BytesIO(b'2'), 'task-b', config)
+    webui.flush()
+
+    assert set(read_index(tmp_path)) == {'a', 'b'}
+
+
+def test_eviction_counts_entries_written_by_other_processes(tmp_path):
+    webui = ResultCache(str(tmp_path))
+    api = ResultCache(str(tmp_path))
+    webui.put('a', BytesIO(b'1'), 'task-a', CONFIG)
+    api.put('b', BytesIO(b'2'), 'task-b', CONFIG)
+    api.put('c', BytesIO(b'3'), 'task-c', CONFIG)
+
+    assert set(read_index(tmp_path)) == {'b', 'c'}
+    assert not os.path.exists(os.path.join(tmp_path, 'a.img'))
+    # 另一个进程的条目已被淘汰，命中检查时发现文件不存在
+    assert webui.get('a') is None
+    webui.put('d', BytesIO(b'4'), 'task-d', {'result_cache_max_entries': 10, 'result_cache_max_bytes': 1024})
+    assert set(read_index(tmp_path)) == {'b', 'c', 'd'}
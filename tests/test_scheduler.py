@@ -0,0 +1,243 @@
+"""
+调度器测试：会话间公平轮转、任务池并发上限、队列满拒绝、等待中取消
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from modules import scheduler
+from modules.scheduler import FairShareScheduler, QueueFullError, iterate_in_thread
+
+
+async def hold(pool, session, order, release):
+    async with pool.slot(session):
+        order.append(session)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_sessions_are_served_round_robin():
+    async def main():
+        pool = FairShareScheduler('chat', max_concurrency=1, max_queue=10)
+        started = []
+
+        async def job(session):
+            gate = asyncio.Event()
+            async with pool.slot(session):
+                started.append((session, gate))
+                await gate.wait()
+
+        tasks = [asyncio.create_task(job(session)) for session in ('a', 'a', 'a', 'b', 'c')]
+        await settle()
+        # 逐个放行正在运行的任务，记录名额交给谁
+        while len(started) < len(tasks):
+            count = len(started)
+            started[-1][1].set()
+            await settle()
+            assert len(started) == count + 1
+        started[-1][1].set()
+        await asyncio.gather(*tasks)
+        return [session for session, _ in started]
+
+    assert asyncio.run(main()) == ['a', 'b', 'c', 'a', 'a']
+
+
+def test_session_with_fewer_running_jobs_goes_first():
+    async def main():
+        pool = FairShareScheduler('image_edit', max_concurrency=2, max_queue=10)
+        order = []
+        release_a = asyncio.Event()
+        release_b = asyncio.Event()
+        first = asyncio.create_task(hold(pool, 'a', order, release_a))
+        second = asyncio.create_task(hold(pool, 'b', order, release_b))
+        await settle()
+        waiting = [asyncio.create_task(hold(pool, s, order, asyncio.Event())) for s in ('b', 'a')]
+        await settle()
+
+        # b释放后空出一个名额：a仍有1个运行中，b没有，所以排队的b优先
+        release_b.set()
+        await settle()
+        result = list(order)
+        release_a.set()
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(first, second, *waiting, return_exceptions=True)
+        return result
+
+    assert asyncio.run(main()) == ['a', 'b', 'b']
+
+
+def test_pool_limit_bounds_concurrency_and_pools_are_independent():
+    async def main():
+        chat = FairShareScheduler('chat', max_concurrency=2, max_queue=10)
+        vision = FairShareScheduler('vision', max_concurrency=1, max_queue=10)
+        release = asyncio.Event()
+        chat_order, vision_order = [], []
+        tasks = [asyncio.create_task(hold(chat, f's{i}', chat_order, release)) for i in range(4)]
+        tasks.append(asyncio.create_task(hold(vision, 's0', vision_order, release)))
+        await settle()
+        stats = chat.stats(), vision.stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return stats, len(chat_order), chat.stats()
+
+    (chat_stats, vision_stats), served, final = asyncio.run(main())
+    assert chat_stats == (2, 2)
+    assert vision_stats == (1, 0)
+    assert served == 4
+    assert final == (0, 0)
+
+
+def test_queue_full_is_rejected():
+    async def main():
+        pool = FairShareScheduler('chat', max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(pool, 'a', [], release))
+        queued = asyncio.create_task(hold(pool, 'b', [], release))
+        await settle()
+        with pytest.raises(QueueFullError):
+            async with pool.slot('c'):
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+        return pool.stats()
+
+    assert asyncio.run(main()) == (0, 0)
+
+
+def test_cancelled_waiter_leaves_queue_and_frees_nothing():
+    async def main():
+        pool = FairShareScheduler('chat', max_concurrency=1, max_queue=5)
+        order = []
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(pool, 'a', order, release))
+        cancelled = asyncio.create_task(hold(pool, 'b', order, release))
+        await settle()
+        assert pool.stats() == (1, 1)
+
+        cancelled.cancel()
+        await settle()
+        after_cancel = pool.stats()
+
+        later = asyncio.create_task(hold(pool, 'c', order, release))
+        release.set()
+        await asyncio.gather(running, later)
+        return after_cancel, order, pool.stats()
+
+    after_cancel, order, final = asyncio.run(main())
+    assert after_cancel == (1, 0)
+    assert order == ['a', 'c']
+    assert final == (0, 0)
+
+
+def test_waiter_cancelled_after_grant_returns_slot():
+    async def main():
+        pool = FairShareScheduler('chat', max_concurrency=1, max_queue=5)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(pool, 'a', [], release))
+        waiting = asyncio.create_task(hold(pool, 'b', [], asyncio.Event()))
+        await settle()
+        # 名额交给b的同时b被取消，名额必须归还
+        release.set()
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(running, waiting, return_exceptions=True)
+        return pool.stats()
+
+    assert asyncio.run(main()) == (0, 0)
+
+
+def test_sync_generator_steps_run_in_threads_and_close_early():
+    closed = threading.Event()
+    threads = []
+
+    def generate():
+        try:
+            for i in range(10):
+                threads.append(threading.current_thread())
+                yield i
+        finally:
+            closed.set()
+
+    async def main():
+        items = []
+        async for item in iterate_in_thread(generate()):
+            items.append(item)
+            if item == 2:
+                break
+        return items
+
+    assert asyncio.run(main()) == [0, 1, 2]
+    assert closed.is_set()
+    assert all(thread is not threading.main_thread() for thread in threads)
+
+
+def test_scheduled_handler_wraps_sync_generator_as_async(monkeypatch):
+    pool = FairShareScheduler('chat', max_concurrency=1, max_queue=5)
+    monkeypatch.setattr(scheduler, 'get_scheduler', lambda name: pool)
+    pytest.importorskip('gradio')
+
+    def chat(message, model):
+        yield message
+        yield message + '!'
+
+    wrapper = scheduler.scheduled_handler('chat', chat)
+
+    async def main():
+        return [item async for item in wrapper('hi', 'm', None)]
+
+    assert scheduler.inspect.isasyncgenfunction(wrapper)
+    assert list(scheduler.inspect.signature(wrapper).parameters) == ['message', 'model', 'request']
+    assert asyncio.run(main()) == ['hi', 'hi!']
+
+
+def test_batch_items_count_against_the_pool_limit(monkeypatch):
+    from modules import text_to_image
+
+    pool = FairShareScheduler('image_generation', max_concurrency=2, max_queue=10)
+    monkeypatch.setattr(scheduler, 'get_scheduler', lambda name: pool)
+    monkeypatch.setattr(text_to_image, 'load_config', lambda: {'batch_max_concurrency': 4})
+    running = []
+    peak = []
+
+    async def generate_one(*args):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return 'image', 'task', None, False
+    monkeypatch.setattr(text_to_image, '_generate_one', generate_one)
+
+    async def main():
+        batch = text_to_image.generate_image_batch('token', 'm', 'p', '', 64, 64, 10, 7.5, 1, False, 5, session='s1')
+        return [item async for item in batch][-1]
+
+    gallery, message = asyncio.run(main())
+    assert len(gallery) == 5
+    assert max(peak) == 2
+    assert pool.stats() == (0, 0)
+
+
+def test_slot_per_item_handler_passes_session_instead_of_holding_a_slot(monkeypatch):
+    pytest.importorskip('gradio')
+    sessions = []
+
+    async def batch(prompt, model, session='anonymous'):
+        sessions.append(session)
+        yield prompt
+
+    wrapper = scheduler.scheduled_handler('image_generation', batch, slot_per_item=True)
+    request = type('Request', (), {'session_hash': 'abc'})()
+
+    async def main():
+        return [item async for item in wrapper('p', 'm', request)]
+
+    assert list(scheduler.inspect.signature(wrapper).parameters) == ['prompt', 'model', 'request']
+    assert asyncio.run(main()) == ['p']
+    assert sessions == ['abc']
@@ -0,0 +1,94 @@
+"""
+任务日志测试：状态转换、按Token隔离、待取回列表和过期清理
+"""
+
+import time
+
+import pytest
+
+from modules import task_journal, task_recovery
+from modules.task_journal import DOWNLOADED, FAILED, PENDING, SUCCEED, TaskJournal
+
+PAYLOAD = {'model': 'Qwen/Qwen-Image', 'prompt': 'a cat', 'seed': 1}
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return TaskJournal(str(tmp_path / 'journal.sqlite3'))
+
+
+def test_state_transitions(journal):
+    journal.record_submitted('t1', 'token', PAYLOAD, {'seed': 1}, task_key='key')
+    entry = journal.get('t1', 'token')
+    assert entry['status'] == PENDING
+    assert entry['payload'] == PAYLOAD
+    assert entry['metadata'] == {'seed': 1}
+    assert entry['kind'] == 'text_to_image'
+
+    journal.mark_succeeded('t1', 'https://example.com/out.png')
+    entry = journal.get('t1', 'token')
+    assert (entry['status'], entry['image_url']) == (SUCCEED, 'https://example.com/out.png')
+
+    journal.mark_downloaded('t1')
+    assert journal.get('t1', 'token')['status'] == DOWNLOADED
+
+
+def test_failed_task_is_not_marked_downloaded(journal):
+    journal.record_submitted('t1', 'token', PAYLOAD)
+    journal.mark_failed('t1', '生成失败')
+    journal.mark_downloaded('t1')
+
+    entry = journal.get('t1', 'token')
+    assert (entry['status'], entry['error']) == (FAILED, '生成失败')
+
+
+def test_entries_are_isolated_by_token(journal):
+    journal.record_submitted('t1', 'token-a', PAYLOAD, task_key='key')
+
+    assert journal.get('t1', 'token-b') is None
+    assert journal.find_pending('key', 'token-b') is None
+    assert journal.list_unretrieved('token-b') == []
+
+
+def test_find_pending_only_returns_recent_pending_tasks(journal, monkeypatch):
+    journal.record_submitted('old', 'token', PAYLOAD, task_key='key')
+    monkeypatch.setattr(task_journal.time, 'time', lambda: time.time_ns() / 1e9 + task_journal.RESUME_MAX_AGE_SECONDS + 1)
+    journal.record_submitted('new', 'token', PAYLOAD, task_key='key')
+    assert journal.find_pending('key', 'token') == 'new'
+
+    journal.mark_succeeded('new', 'url')
+    assert journal.find_pending('key', 'token') is None
+
+
+def test_unretrieved_lists_pending_and_succeeded_but_not_downloaded(journal):
+    for task_id in ('pending', 'succeeded', 'downloaded', 'failed'):
+        journal.record_submitted(task_id, 'token', PAYLOAD)
+    journal.mark_succeeded('succeeded', 'url')
+    journal.mark_succeeded('downloaded', 'url')
+    journal.mark_downloaded('downloaded')
+    journal.mark_failed('failed', 'error')
+
+    listed = {entry['task_id']: entry['status'] for entry in journal.list_unretrieved('token')}
+    assert listed == {'pending': PENDING, 'succeeded': SUCCEED}
+
+
+def test_prune_removes_old_entries(journal, monkeypatch):
+    journal.record_submitted('t1', 'token', PAYLOAD)
+    monkeypatch.setattr(task_journal.time, 'time', lambda: time.time_ns() / 1e9 + 8 * 86400)
+    journal.prune(7)
+
+    assert journal.get('t1', 'token') is None
+
+
+def test_recovery_list_shows_status(journal, monkeypatch):
+    monkeypatch.setattr(task_recovery, 'get_task_journal', lambda: journal)
+    journal.record_submitted('t1', 'token', PAYLOAD)
+    journal.record_submitted('t2', 'token', dict(PAYLOAD, image_url='https://example.com/in.jpg'))
+    journal.mark_succeeded('t2', 'url')
+
+    rows, task_ids, message = task_recovery.list_pending_tasks('token')
+
+    assert sorted(task_ids) == ['t1', 't2']
+    statuses = {row[0]: (row[1], row[2]) for row in rows}
+    assert statuses == {'t1': ('文生图', '未完成'), 't2': ('图像编辑', '已完成，未取回')}
+    assert '2' in message
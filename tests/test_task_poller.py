@@ -0,0 +1,48 @@
+"""
+任务轮询器测试：被限流的Token推迟查询，不占用轮询线程
+"""
+
+import time
+
+from modules import task_poller
+from modules.rate_limit import TokenBucketLimiter
+
+
+def test_throttled_token_does_not_block_other_polls(monkeypatch):
+    limiters = {'slow': TokenBucketLimiter(1000, 5), 'fast': TokenBucketLimiter(1000, 5)}
+    limiters['slow'].pause(0.3)
+    monkeypatch.setattr(task_poller, 'get_rate_limiter', lambda token: limiters[token])
+    monkeypatch.setattr(task_poller, 'load_config', lambda: {'poll_max_workers': 1})
+    monkeypatch.setattr(task_poller.TaskPoller, '_next_delay', staticmethod(lambda pending, config: 0.01))
+
+    fetched = {}
+
+    def fetch(task_id, api_token, config):
+        fetched[task_id] = time.monotonic()
+        return {'task_status': 'FAILED'}
+    monkeypatch.setattr(task_poller, '_fetch_task_status', fetch)
+
+    poller = task_poller.TaskPoller()
+    start = time.monotonic()
+    slow = poller.track('slow-task', 'slow', timeout=5)
+    fast = poller.track('fast-task', 'fast', timeout=5)
+
+    assert fast.result(timeout=1) == {'task_status': 'FAILED'}
+    # 唯一的轮询线程没有被暂停中的Token占用
+    assert fetched['fast-task'] - start < 0.2
+    assert 'slow-task' not in fetched
+
+    assert slow.result(timeout=2) == {'task_status': 'FAILED'}
+    assert fetched['slow-task'] - start >= 0.29
+
+
+def test_poll_request_does_not_acquire_again(monkeypatch):
+    calls = []
+
+    def request(url, headers, **kwargs):
+        calls.append(kwargs.get('acquire_token'))
+        return None
+    monkeypatch.setattr(task_poller, 'make_api_request_with_retry', request)
+
+    assert task_poller._fetch_task_status('t', 'token', {}) is None
+    assert calls == [False]
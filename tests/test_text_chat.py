@@ -0,0 +1,95 @@
+"""
+文本对话核心函数和界面包装的测试（模拟流式响应，不访问网络）
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from modules import text_chat
+
+
+def _chunk(content=None, reasoning=None):
+    delta = SimpleNamespace(content=content, reasoning_content=reasoning)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+@pytest.fixture
+def fake_stream(monkeypatch):
+    """把流式请求替换为给定的块序列，块为异常时在该处抛出"""
+    chunks = []
+
+    def stream():
+        for chunk in chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    monkeypatch.setattr(text_chat, 'is_openai_available', lambda: True)
+    monkeypatch.setattr(text_chat, 'get_openai_client', lambda token: None)
+    monkeypatch.setattr(text_chat, 'call_with_rate_limit', lambda token, request, trace=None: (stream(), time.monotonic()))
+    return chunks
+
+
+def _chat(core, message='hi', history=()):
+    return list(core(message, list(history), 'token', 'model', 'system', 100, 0.7))
+
+
+def test_core_reports_success_with_reasoning_and_stats(fake_stream):
+    fake_stream.extend([_chunk(reasoning='think'), _chunk(content='hel'), _chunk(content='lo')])
+
+    results = _chat(text_chat.stream_chat)
+
+    assert results[-2] == (None, ('think', 'hello'), '')
+    ok, content, stats = results[-1]
+    assert (ok, content) == (True, ('think', 'hello'))
+    assert '首字' in stats
+
+
+def test_core_reports_failure_without_parsing_text(fake_stream):
+    fake_stream.extend([_chunk(content='对话失败是正常回答的开头'), RuntimeError('boom')])
+
+    ok, content, stats = _chat(text_chat.stream_chat)[-1]
+
+    assert ok is False
+    assert content == '对话失败: boom'
+    assert stats
+
+
+def test_core_reports_empty_response(fake_stream):
+    ok, content, _ = _chat(text_chat.stream_chat)[-1]
+
+    assert (ok, content) == (False, 'API返回了空的响应')
+
+
+def test_core_rejects_missing_token():
+    results = list(text_chat.stream_chat('hi', [], '', 'model', 'system', 100, 0.7))
+
+    assert results == [(False, '请提供有效的API Token', '')]
+
+
+def test_ui_wrapper_keeps_partial_reply_on_failure(fake_stream):
+    fake_stream.extend([_chunk(content='part'), RuntimeError('boom')])
+
+    history, cleared = _chat(text_chat.chat_with_model)[-1]
+
+    assert cleared == ''
+    assert [msg['content'] for msg in history[:3]] == ['hi', 'part', '对话失败: boom']
+    assert history[3]['metadata']['title'] == text_chat.TIMING_TITLE
+
+
+def test_ui_wrapper_renders_reasoning_and_timing(fake_stream):
+    fake_stream.extend([_chunk(reasoning='think'), _chunk(content='hello')])
+
+    history, _ = _chat(text_chat.chat_with_model)[-1]
+
+    titles = [(msg.get('metadata') or {}).get('title') for msg in history]
+    assert titles == [None, text_chat.THINKING_TITLE, None, text_chat.TIMING_TITLE]
+    assert history[2]['content'] == 'hello'
+
+
+def test_ui_wrapper_ignores_empty_message():
+    assert _chat(text_chat.chat_with_model, message='  ', history=[{'role': 'user', 'content': 'x'}]) == [
+        ([{'role': 'user', 'content': 'x'}], '')
+    ]
@@ -0,0 +1,44 @@
+"""
+上传缓存测试：多个进程共用缓存文件时合并条目并清理过期条目
+"""
+
+import json
+import time
+
+from modules.upload_cache import UploadCache
+
+
+def read_file(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_processes_sharing_a_file_merge_their_entries(tmp_path):
+    path = str(tmp_path / 'uploads.json')
+    webui = UploadCache(path)
+    api = UploadCache(path)
+    webui.put('a', 'https://cdn/a', ttl=60)
+    api.put('b', 'https://cdn/b', ttl=60)
+
+    assert set(read_file(path)) == {'a', 'b'}
+    assert UploadCache(path).get('a', ttl=60) == 'https://cdn/a'
+
+
+def test_expired_entries_from_disk_are_pruned(tmp_path):
+    path = str(tmp_path / 'uploads.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'old': {'url': 'https://cdn/old', 'uploaded_at': time.time() - 120}}, f)
+    cache = UploadCache(str(path))
+    cache._entries = {}
+
+    cache.put('new', 'https://cdn/new', ttl=60)
+
+    assert set(read_file(path)) == {'new'}
+
+
+def test_memory_only_cache_without_file():
+    cache = UploadCache(None)
+    cache.put('a', 'https://cdn/a', ttl=60)
+
+    assert cache.get('a', ttl=60) == 'https://cdn/a'
+    assert cache.get('a', ttl=-1) is None